@@ -25,6 +25,7 @@ from djscrooge.util.data_types import OrderedSet, iterator_to_list, index_in_sor
 import math    
 from djscrooge.config import Config
 from collections import namedtuple
+import numpy
   
 class OpenPosition(object):
   """A class representing previously purchased shares.
@@ -215,6 +216,18 @@ class EndOfDay(object):
     self.splits = []
     self.volumes = []
     
+  @classmethod
+  def load_many(cls, symbols, start_date, end_date):
+    """Returns a dictionary mapping each of the given symbols to its EndOfDay object.
+    
+    By default, each object is constructed separately. Subclasses backed by a store which
+    can read many symbols at once should override this.
+    """
+    items = {}
+    for symbol in symbols:
+      items[symbol] = cls(symbol, start_date, end_date)
+    return items
+    
   def get_index_from_date(self, dateobj):
     """Gets the index into the dates array for the given date Object.
     
@@ -231,6 +244,65 @@ class EndOfDay(object):
     self.__date_index = {}
     for i in range(0, len(self.dates)):
       self.__date_index[self.dates[i]] = i
+      
+  def merge_tail(self, tail):
+    """Appends the days of another EndOfDay object for the same symbol after this object's last date.
+    
+    tail -- The EndOfDay object holding the newer days. It should start on or before this
+            object's last date, so the days held by both can be checked.
+            
+    Every day of the tail on or before this object's last date must exactly match the data
+    held here. If any differ, for instance because the source adjusted its history for a new
+    dividend or split, or if the tail does not overlap this object, nothing is merged. 
+    
+    Returns True if the tail was merged, or False if the overlap check failed and the full
+    history should be reloaded instead.
+    """
+    n = len(self.dates)
+    if n == 0:
+      first_new = 0
+    else:
+      last_date = self.dates[-1]
+      first_new = 0
+      while first_new < len(tail.dates) and tail.dates[first_new] <= last_date:
+        first_new += 1
+      if first_new == 0:
+        return False
+      for j in range(0, first_new):
+        i = self.get_index_from_date(tail.dates[j])
+        if i is None or self.get_row(i) != tail.get_row(j):
+          return False
+    if not hasattr(self, '_EndOfDay__date_index'):
+      self.initialize_date_index()
+    for j in range(first_new, len(tail.dates)):
+      self.__date_index[tail.dates[j]] = n + j - first_new
+    self.dates.extend(tail.dates[first_new:])
+    self.open_prices.extend(tail.open_prices[first_new:])
+    self.high_prices.extend(tail.high_prices[first_new:])
+    self.low_prices.extend(tail.low_prices[first_new:])
+    self.close_prices.extend(tail.close_prices[first_new:])
+    self.adj_close_prices.extend(tail.adj_close_prices[first_new:])
+    self.dividends.extend(tail.dividends[first_new:])
+    self.splits.extend(tail.splits[first_new:])
+    self.volumes.extend(tail.volumes[first_new:])
+    return True
+  
+  def get_first_trading_index(self):
+    """Returns the index of the first day which is not a split-only day, or None if there is none.
+    
+    A split on a day with no price data is held as a row with no volume, priced from the day
+    before. Such a day cannot start a request to a source, which has nothing to price it from.
+    """
+    for i in range(0, len(self.dates)):
+      if self.volumes[i] != 0 or self.splits[i] is None:
+        return i
+    return None
+    
+  def get_row(self, i):
+    """Returns a tuple of the date, prices, volume, dividend, and split of day i."""
+    return (self.dates[i], self.open_prices[i], self.high_prices[i], self.low_prices[i], 
+            self.close_prices[i], self.adj_close_prices[i], self.volumes[i], self.dividends[i],
+            self.splits[i])
 
 class BacktestComponent(object):
   """A class used in a backtest.
@@ -360,6 +432,123 @@ class Taxes(BacktestComponent):
     """
     return 0
   
+PerformanceSummary = namedtuple('PerformanceSummary', ['days', 'total_return', 'cagr', 'volatility', 
+                                                       'sharpe', 'max_drawdown', 'exposure', 'turnover'])
+
+class Analytics(BacktestComponent):
+  """Computes performance statistics while a backtest runs.
+  
+  The Backtest calls record_trade for every purchase and sale, and update once at the close of
+  every simulation day. Both take O(1) time, so the statistics are available as soon as the
+  simulation finishes, with no second pass over the daily values.
+  
+  Available properties/attributes:
+  
+  days -- The number of simulation days seen.
+  peak_value -- The highest closing value of the portfolio, in cents.
+  max_drawdown -- The largest decline from a previous peak, as a fraction of that peak.
+  log_return_mean -- The mean of the daily log returns of the closing values.
+  log_return_variance -- The sample variance of the daily log returns of the closing values.
+  traded_value -- The total value, in cents, of all shares bought and sold.
+  """
+  
+  TRADING_DAYS_PER_YEAR = 252
+  
+  def __init__(self, backtest):
+    """Construct an Analytics object with the given Backtest object."""
+    super(Analytics, self).__init__(backtest)
+    self.days = 0
+    self.peak_value = None
+    self.max_drawdown = 0.0
+    self.log_return_mean = 0.0
+    self.traded_value = 0
+    self.__first_date = None
+    self.__last_date = None
+    self.__first_value = None
+    self.__last_value = None
+    self.__log_returns = 0
+    self.__log_return_m2 = 0.0
+    self.__value_sum = 0.0
+    self.__exposure_sum = 0.0
+    
+  def record_trade(self, symbol, shares, price_per_share):
+    """Record the purchase or sale of the given number of shares.
+    
+    symbol -- The ticker symbol.
+    shares -- The number of shares.
+    price_per_share -- The price per share, in cents.
+    """
+    self.traded_value += shares * price_per_share
+  
+  def update(self, value, stock_value):
+    """Record the close of a simulation day.
+    
+    value -- The closing value of the portfolio, in cents.
+    stock_value -- The closing value of the stocks in the portfolio, in cents.
+    """
+    self.days += 1
+    self.__last_date = self.backtest.simulation_date
+    if self.__first_date is None:
+      self.__first_date = self.__last_date
+      self.__first_value = value
+    if self.__last_value is not None and self.__last_value > 0 and value > 0:
+      log_return = math.log(value * 1.0 / self.__last_value)
+      self.__log_returns += 1
+      delta = log_return - self.log_return_mean
+      self.log_return_mean += delta / self.__log_returns
+      self.__log_return_m2 += delta * (log_return - self.log_return_mean)
+    self.__last_value = value
+    if self.peak_value is None or value > self.peak_value:
+      self.peak_value = value
+    elif self.peak_value > 0:
+      self.max_drawdown = max(self.max_drawdown, (self.peak_value - value) * 1.0 / self.peak_value)
+    self.__value_sum += value
+    if value > 0:
+      self.__exposure_sum += stock_value * 1.0 / value
+      
+  @property
+  def log_return_variance(self):
+    if self.__log_returns < 2:
+      return float('nan')
+    return self.__log_return_m2 / (self.__log_returns - 1)
+  
+  def summary(self):
+    """Returns the PerformanceSummary of the days seen so far.
+    
+    The fields of the PerformanceSummary are:
+      days -- The number of simulation days.
+      total_return -- The change in value from the first to the last close, as a fraction.
+      cagr -- The compound annual growth rate, as a fraction, using calendar days.
+      volatility -- The annualized standard deviation of the daily log returns.
+      sharpe -- The annualized mean of the daily log returns over their standard deviation,
+                with a risk-free return of zero.
+      max_drawdown -- The largest decline from a previous peak, as a fraction of that peak.
+      exposure -- The average fraction of the closing value held in stocks.
+      turnover -- The total value of shares bought and sold over the average closing value.
+    
+    Statistics which are undefined for the days seen are NaN.
+    """
+    nan = float('nan')
+    total_return = nan
+    cagr = nan
+    if self.days > 0 and self.__first_value > 0:
+      total_return = self.__last_value * 1.0 / self.__first_value - 1.0
+      years = (self.__last_date - self.__first_date).days / 365.25
+      if years > 0 and self.__last_value >= 0:
+        cagr = (1.0 + total_return) ** (1.0 / years) - 1.0
+    volatility = math.sqrt(self.log_return_variance * self.TRADING_DAYS_PER_YEAR)
+    sharpe = nan
+    if volatility > 0:
+      sharpe = self.log_return_mean * self.TRADING_DAYS_PER_YEAR / volatility
+    exposure = nan
+    turnover = nan
+    if self.days > 0:
+      exposure = self.__exposure_sum / self.days
+      if self.__value_sum > 0:
+        turnover = self.traded_value / (self.__value_sum / self.days)
+    return PerformanceSummary(self.days, total_return, cagr, volatility, sharpe, self.max_drawdown,
+                              exposure, turnover)
+  
 class Backtest(object):
   """The controller of a Backtest.
   
@@ -374,12 +563,21 @@ class Backtest(object):
   commissions -- The Commissions object used to compute commissions for the simulation.
   taxes -- The Taxes object used to compute taxes for the simulation.
   strategy -- The Strategy object being tested.
+  analytics -- The Analytics object computing performance statistics during the simulation.
+  performance -- The PerformanceSummary of the finished simulation.
   dates -- The dates tested
   values -- The daily closing values of the portfolio.
   open_values -- The daily opening values of the portfolio. This is useful for statistical signifigance tests.
   start_date -- The start date of the simulation.
   end_date -- The end date of the simulation.
   end_of_day_class -- The class used to generate EndOfDay data.
+  open_returns -- The open-to-open simple returns, as a numpy array.
+  open_log_returns -- The open-to-open log returns, as a numpy array.
+  close_returns -- The close-to-close simple returns, as a numpy array.
+  close_log_returns -- The close-to-close log returns, as a numpy array.
+  
+  Return i is computed from values i and i+1, so each return array has one fewer entry than
+  the values. The return arrays are computed on first use and cached.
   """
     
   def __init__(self, start_date, end_date, 
@@ -388,7 +586,9 @@ class Backtest(object):
                strategy_class=Strategy, 
                end_of_day_class=EndOfDay,
                portfolio=None,
-               cache=True):
+               cache=True,
+               analytics_class=Analytics,
+               preload_symbols=None):
     """Construct a Backtest object and run the simulation.
     
     commissions_class -- The class of the Commissions class.
@@ -399,6 +599,8 @@ class Backtest(object):
     end_date -- The datetime.date object representing the last date to simulate.
     portfolio -- The Portfolio object representing the current holdings during the simulation.
     cache -- True if EndOfDay ojbects should be cached.
+    analytics_class -- The class of the Analytics object.
+    preload_symbols -- A list of symbols whose EndOfDay objects are loaded before the simulation.
     
     Note that if the portfolio is unspecified, it will be defaulted to a portfolio with
     $100,000 in cash.
@@ -408,6 +610,7 @@ class Backtest(object):
     self.commissions = commissions_class(self)
     self.taxes = taxes_class(self)
     self.strategy = strategy_class(self)
+    self.analytics = analytics_class(self)
     self.end_of_day_class = end_of_day_class
     self.portfolio = portfolio
     if portfolio is None:
@@ -420,9 +623,12 @@ class Backtest(object):
     self.values = []
     self.open_values = []
     self.cache = cache
+    if preload_symbols is not None:
+      self.preload(preload_symbols)
     self.commissions.after_initialization()
     self.taxes.after_initialization()
     self.strategy.after_initialization()
+    self.analytics.after_initialization()
     for i in range(0,len(self.dates)):
       self.simulation_date = self.dates[i]
       total_stock_value = 0
@@ -467,6 +673,8 @@ class Backtest(object):
           total_stock_value += symbol_data.close_price * position.remaining_shares
       self.portfolio.cash -= self.commissions.fees()
       self.values.append(total_stock_value + self.portfolio.cash)
+      self.analytics.update(self.values[-1], total_stock_value)
+    self.performance = self.analytics.summary()
             
   def buy_shares(self, symbol, shares, price_per_share):
     """Buy the specified number of shares of the given stock.
@@ -481,6 +689,7 @@ class Backtest(object):
     position = OpenPosition(symbol, self.simulation_date, price_per_share, shares)
     self.portfolio.add_position(position)
     self.portfolio.cash -= (commissions + taxes + cost)
+    self.analytics.record_trade(symbol, shares, price_per_share)
   
   def sell_shares(self, symbol, shares, price_per_share, open_position=None):
     """Sell the specified number of shares of the given stock.
@@ -503,6 +712,7 @@ class Backtest(object):
       revenue = price_per_share * shares
       open_position.remaining_shares -= shares
       self.portfolio.cash += (revenue - commissions - taxes)
+      self.analytics.record_trade(symbol, shares, price_per_share)
     if open_position is None:
       positions = self.portfolio.get_positions(symbol)
       for position in positions:
@@ -535,6 +745,51 @@ class Backtest(object):
       return CloseData(eod.close_prices[0], eod.dividends[0], eod.splits[0], eod.open_prices[0])
 
     
+  @property
+  def open_returns(self):
+    return self.__get_returns('open_values', False)
+  
+  @property
+  def open_log_returns(self):
+    return self.__get_returns('open_values', True)
+  
+  @property
+  def close_returns(self):
+    return self.__get_returns('values', False)
+  
+  @property
+  def close_log_returns(self):
+    return self.__get_returns('values', True)
+  
+  def __get_returns(self, attribute, log):
+    """Returns the cached returns of the named list of values, computing them if the list changed."""
+    if not hasattr(self, '_Backtest__returns'):
+      self.__returns = {}
+    values = getattr(self, attribute)
+    key = (attribute, log)
+    if self.__returns.has_key(key):
+      (cached_values, length, returns) = self.__returns[key]
+      if cached_values is values and length == len(values):
+        return returns
+    array = numpy.asarray(values, dtype=float)
+    if log:
+      returns = numpy.log(array[1:] / array[:-1])
+    else:
+      returns = array[1:] / array[:-1] - 1.0
+    self.__returns[key] = (values, len(values), returns)
+    return returns
+    
+  def preload(self, symbols):
+    """Loads the EndOfDay objects of the given symbols at once, with end_of_day_class.load_many.
+    
+    Strategies trading a large universe can call this from after_initialization, so a cache
+    can read all the symbols with a single query rather than one query per symbol.
+    """
+    missing = [symbol for symbol in symbols if not self.__end_of_day_items.has_key(symbol)]
+    if len(missing) > 0:
+      self.__end_of_day_items.update(self.end_of_day_class.load_many(missing, self.start_date, 
+                                                                     self.end_date))
+    
   def get_end_of_day(self, symbol):
     """Gets the EndOfDay object associated with the given stock.
     
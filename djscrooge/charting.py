@@ -20,7 +20,12 @@ Dependencies:
     matplotlib: <http://matplotlib.sourceforge.net/>
 """
 
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from multiprocessing import Pool
+import os
+from numpy import asarray, arange, floor, absolute, argmax, concatenate, nonzero, unique, repeat, \
+  diff, linspace, minimum, maximum, fromiter
 
 def chart_backtest(*backtests, **keywords):
   """Given a list of Backtest objects, this creates a value chart.
@@ -32,32 +37,172 @@ def chart_backtest(*backtests, **keywords):
     colors -- A list of color formats for the Backtest objects provided.
               See http://matplotlib.sourceforge.net/api/colors_api.html for
               the allowed formats.
+    downsample -- The downsampling method used with max_points, either 'lttb' (the default) for
+                  largest-triangle-three-buckets, or 'min_max' to keep the lowest and highest
+                  value of each bucket.
     file_name -- Save the chart to the given file name, instead of plotting to screen.
                  The file extension should be one of png, pdf, ps, eps, or svg.
     labels -- A list of labels for the Backtest objects provided.
               When this keyword is provided, a legend will be drawn on the upper left
               corner of the plot.
+    max_points -- The most points to plot for each Backtest. Longer series are downsampled,
+                  keeping the points which define the shape of the line. A value around the
+                  pixel width of the chart is visually lossless.
     title -- The title of the chart.
+  
+  This is the only function of this module which uses pyplot, and it is imported here, so
+  importing the module neither loads pyplot nor selects a backend.
+  """
+  import matplotlib.pyplot as plt
+  series = [get_chart_series(backtest, keywords.get('max_points'), keywords.get('downsample', 'lttb'))
+            for backtest in backtests]
+  draw_value_chart(plt.gca(), series, keywords)
+  if keywords.has_key('file_name'):
+    plt.savefig(keywords['file_name'])
+  else:
+    plt.show()
+  plt.close()
+  
+def chart_backtests_to_directory(charts, directory, file_format='png', processes=None):
+  """Renders many value charts in parallel worker processes, saving them to the given directory.
+  
+  charts -- A list of (name, backtests, keywords) tuples, one per chart. The name is the file
+            name of the chart, without the extension. The backtests are a list of Backtest objects,
+            and the keywords are a dictionary of the keywords accepted by chart_backtest.
+  directory -- The directory to save the charts in.
+  file_format -- The file extension of the charts, one of png, pdf, ps, eps, or svg.
+  processes -- The number of worker processes. When None, this is the number of CPUs. When 1, the
+               charts are rendered in the calling process.
+  
+  The charts are drawn on explicit Figure objects with a non-interactive canvas, so no pyplot
+  state is used, and nothing is plotted to screen. The series to plot, rather than the Backtest
+  objects, are sent to the workers. Returns the list of file names written, in order.
+  """
+  jobs = []
+  for (name, backtests, keywords) in charts:
+    series = [get_chart_series(backtest, keywords.get('max_points'), keywords.get('downsample', 'lttb'))
+              for backtest in backtests]
+    jobs.append((os.path.join(directory, name + '.' + file_format), series, keywords))
+  if processes == 1:
+    return map(render_chart, jobs)
+  pool = Pool(processes)
+  try:
+    return pool.map(render_chart, jobs)
+  finally:
+    pool.close()
+    pool.join()
+    
+def render_chart(job):
+  """Renders a (file_name, series, keywords) job to its file, and returns the file name.
+  
+  This is run in worker processes by chart_backtests_to_directory.
+  """
+  (file_name, series, keywords) = job
+  figure = Figure()
+  FigureCanvasAgg(figure)
+  draw_value_chart(figure.add_subplot(111), series, keywords)
+  figure.savefig(file_name)
+  return file_name
+  
+def draw_value_chart(axes, series, keywords):
+  """Draws the given list of (dates, values) series on the given matplotlib Axes object.
+  
+  The colors, labels, and title keywords are used as in chart_backtest.
   """
   plot_list = []
   i = 0
-  for backtest in backtests:
-    plot_list.append(backtest.dates)
-    plot_list.append(map(lambda x: x / 100.0, backtest.values))
+  for (dates, values) in series:
+    plot_list.append(dates)
+    plot_list.append(values)
     if keywords.has_key('colors'):
       plot_list.append(keywords['colors'][i])
     i += 1
-  apply(plt.plot, plot_list)
-  plt.xlabel('Date')
-  plt.ylabel('Value ($)')
+  apply(axes.plot, plot_list)
+  axes.set_xlabel('Date')
+  axes.set_ylabel('Value ($)')
   if keywords.has_key('title'):
-    plt.title(keywords['title'])
+    axes.set_title(keywords['title'])
   if keywords.has_key('labels'):
     legend_list = [tuple(keywords['labels'])]
     legend_dict = {'loc' : 2 }
-    apply(plt.legend, legend_list, legend_dict)
-  if keywords.has_key('file_name'):
-    plt.savefig(keywords['file_name'])
+    apply(axes.legend, legend_list, legend_dict)
+  
+def get_chart_series(backtest, max_points=None, downsample='lttb'):
+  """Returns the (dates, values) of the given Backtest to chart, with values in dollars.
+  
+  backtest -- The Backtest object.
+  max_points -- The most points to return, or None to return every day.
+  downsample -- The downsampling method, either 'lttb' or 'min_max'.
+  """
+  values = asarray(backtest.values) / 100.0
+  dates = backtest.dates
+  n = len(values)
+  if max_points is None or n <= max_points:
+    return (dates, values)
+  if downsample == 'lttb':
+    x = fromiter((d.toordinal() for d in dates), dtype=float, count=n)
+    indices = largest_triangle_three_buckets(x, values, max_points)
+  elif downsample == 'min_max':
+    indices = min_max_buckets(values, max_points)
   else:
-    plt.show()
-  plt.close()
\ No newline at end of file
+    raise ValueError('Unknown downsampling method: ' + str(downsample))
+  return ([dates[i] for i in indices], values[indices])
+
+def largest_triangle_three_buckets(x, y, threshold):
+  """Returns the indices of the points kept by largest-triangle-three-buckets downsampling.
+  
+  x -- The x coordinates, as a sorted numpy array.
+  y -- The y coordinates, as a numpy array.
+  threshold -- The number of points to keep, which must be at least 3.
+  
+  The first and last points are always kept. The points in between are split into
+  threshold - 2 buckets, and from each bucket the point forming the largest triangle with
+  the previously kept point and the average of the next bucket is kept.
+  """
+  n = len(x)
+  if threshold >= n:
+    return arange(n)
+  if threshold < 3:
+    raise ValueError('At least 3 points must be kept.')
+  edges = (floor(arange(threshold - 1) * ((n - 2) * 1.0 / (threshold - 2))) + 1).astype(int)
+  edges[-1] = n - 1
+  indices = [0] * threshold
+  indices[-1] = n - 1
+  a = 0
+  for i in range(0, threshold - 2):
+    start = edges[i]
+    end = edges[i + 1]
+    if i + 2 < len(edges):
+      next_end = edges[i + 2]
+    else:
+      next_end = n
+    average_x = x[end:next_end].mean()
+    average_y = y[end:next_end].mean()
+    areas = absolute((x[a] - average_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (average_y - y[a]))
+    a = start + int(argmax(areas))
+    indices[i + 1] = a
+  return asarray(indices)
+
+def min_max_buckets(y, threshold):
+  """Returns the indices of the lowest and highest points of each bucket, in order.
+  
+  y -- The y coordinates, as a numpy array.
+  threshold -- The most points to keep. The points are split into threshold / 2 equal buckets.
+  
+  The first and last points are always kept, so up to two points more than threshold can be
+  returned.
+  """
+  n = len(y)
+  if threshold >= n:
+    return arange(n)
+  buckets = max(1, threshold / 2)
+  edges = unique(linspace(0, n, buckets + 1).astype(int))
+  bucket_ids = repeat(arange(len(edges) - 1), diff(edges))
+  starts = edges[:-1]
+  def first_matches(bucket_values):
+    positions = nonzero(y == bucket_values[bucket_ids])[0]
+    first = unique(bucket_ids[positions], return_index=True)[1]
+    return positions[first]
+  lowest = first_matches(minimum.reduceat(y, starts))
+  highest = first_matches(maximum.reduceat(y, starts))
+  return unique(concatenate(([0, n - 1], lowest, highest)))
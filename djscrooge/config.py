@@ -18,22 +18,86 @@ Copyright (C) 2012  James Adam Cataldo
     
 Change these values to change the configuration used during runtime.
 """
+import os
 
 class Config(object):
   """Contains all configurations objects, avaliable as attributes."""
   
   BACKTEST_SYMBOL_FOR_ALL_DATES = 'GE'
+  
+  CACHE_REFRESH_OVERLAP_DAYS = 5
+  
+  CACHE_BACKEND = 'mongodb'
+  """The persistent EndOfDay cache returned by CACHE_END_OF_DAY_CLASS: 'mongodb', 'sqlite' or
+  'column_files'."""
+  
+  SQLITE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.djscrooge', 'end_of_day.sqlite')
+  
+  COLUMN_FILE_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.djscrooge', 'columns')
+  
+  MONGODB_INSERT_BATCH_SIZE = 1000
+  
+  MONGODB_READ_BATCH_SIZE = 10000
+  
+  MONGODB_BLOCK_CACHE_SIZE = 2000
+  
+  MONGODB_SYMBOL_CACHE_SIZE = 20000
+
+  @property
+  def CACHE_END_OF_DAY_CLASS(self):
+    if Config.CACHE_BACKEND == 'sqlite':
+      import djscrooge.library.end_of_day.sqlite_cache
+      return djscrooge.library.end_of_day.sqlite_cache.SqliteCache
+    if Config.CACHE_BACKEND == 'column_files':
+      import djscrooge.library.end_of_day.column_file_cache
+      return djscrooge.library.end_of_day.column_file_cache.ColumnFileCache
+    if Config.CACHE_BACKEND == 'mongodb':
+      import djscrooge.library.end_of_day.mongodb_cache
+      return djscrooge.library.end_of_day.mongodb_cache.MongodbCache
+    raise ValueError('Unknown cache backend: ' + str(Config.CACHE_BACKEND))
 
   @property
   def CACHE_END_OF_DAY_SOURCE_CLASS(self):
     import djscrooge.library.end_of_day.yahoo
     return djscrooge.library.end_of_day.yahoo.Yahoo
   
+  MONGODB_HOST = 'localhost'
+  
+  MONGODB_PORT = 27017
+  
+  MONGODB_MAX_POOL_SIZE = 10
+  
+  MONGODB_CONNECT_TIMEOUT_MS = 20000
+  
+  MONGODB_SOCKET_TIMEOUT_MS = None
+  
+  MONGODB_CLIENT_FACTORY = None
+  """A callable taking (host, port, **options) and returning a MongoDB client.
+  
+  If None, pymongo.MongoClient is used, which requires pymongo 2.4 or later. Plain functions
+  must be wrapped in staticmethod when assigned here.
+  """
+  
   __mongodb_connection = None
+  __mongodb_pid = None
   
   @property
   def MONGODB_CONNECTION(self):
-    if Config.__mongodb_connection is None:
-      import pymongo
-      Config.__mongodb_connection = pymongo.Connection()
-    return Config.__mongodb_connection
\ No newline at end of file
+    """The MongoDB client of the current process.
+    
+    Pooled clients must not be shared across fork(), so a new client is created the first
+    time a child process asks for one.
+    """
+    pid = os.getpid()
+    if Config.__mongodb_connection is None or Config.__mongodb_pid != pid:
+      factory = Config.MONGODB_CLIENT_FACTORY
+      if factory is None:
+        from pymongo import MongoClient
+        factory = MongoClient
+      options = {'maxPoolSize' : Config.MONGODB_MAX_POOL_SIZE,
+                 'connectTimeoutMS' : Config.MONGODB_CONNECT_TIMEOUT_MS}
+      if Config.MONGODB_SOCKET_TIMEOUT_MS is not None:
+        options['socketTimeoutMS'] = Config.MONGODB_SOCKET_TIMEOUT_MS
+      Config.__mongodb_connection = factory(Config.MONGODB_HOST, Config.MONGODB_PORT, **options)
+      Config.__mongodb_pid = pid
+    return Config.__mongodb_connection
@@ -0,0 +1,173 @@
+"""This file contains the cross-sectional ranking tools of the DJ Scrooge Backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies:
+    numpy: <http://numpy.scipy.org/>
+"""
+from numpy import argpartition, arange, empty, inf, isnan, nan, where
+
+PANEL_COLUMNS = {'open' : 'open_prices',
+                 'high' : 'high_prices',
+                 'low' : 'low_prices',
+                 'close' : 'close_prices',
+                 'adj_close' : 'adj_close_prices',
+                 'volume' : 'volumes'}
+"""The columns of a UniversePanel, mapped to the EndOfDay attributes they are built from."""
+
+class UniversePanel(object):
+  """The end-of-day data of a universe of stocks, as day-by-symbol numpy arrays.
+
+  Available attributes:
+  symbols -- The sorted ticker symbols of the universe. Column j of each array is symbols[j].
+  dates -- The sorted union of the dates of all the symbols. Row i of each array is dates[i].
+  failed_symbols -- The symbols which could not be loaded, if the panel was built with load.
+  errors -- A dictionary mapping each failed symbol to the exception it raised.
+  load_error -- The exception raised by load_many, if the panel was built with load and the
+                symbols had to be loaded one at a time, or None.
+
+  Days on which a symbol has no data are NaN.
+  """
+
+  def __init__(self, end_of_day_items):
+    """Construct a panel from a dictionary mapping ticker symbols to EndOfDay objects."""
+    self.symbols = sorted(end_of_day_items.keys())
+    self.end_of_day_items = end_of_day_items
+    dates = set([])
+    for eod in end_of_day_items.itervalues():
+      dates.update(eod.dates)
+    self.dates = sorted(dates)
+    self.failed_symbols = []
+    self.errors = {}
+    self.load_error = None
+    self.__date_index = dict((d, i) for (i, d) in enumerate(self.dates))
+    self.__symbol_index = dict((s, j) for (j, s) in enumerate(self.symbols))
+    self.__columns = {}
+
+  @classmethod
+  def load(cls, end_of_day_class, symbols, start_date, end_date):
+    """Loads a panel of the given symbols between start_date and end_date.
+
+    The symbols are loaded together with end_of_day_class.load_many. If that fails, its
+    exception is kept as the load_error of the panel, and the symbols are loaded one at a time.
+    The symbols which still fail are left out of the panel, and listed in its failed_symbols
+    attribute, with their exceptions in its errors attribute.
+    """
+    errors = {}
+    load_error = None
+    try:
+      items = end_of_day_class.load_many(symbols, start_date, end_date)
+    except Exception, e:
+      load_error = e
+      items = {}
+      for symbol in symbols:
+        try:
+          items[symbol] = end_of_day_class(symbol, start_date, end_date)
+        except Exception, e:
+          errors[symbol] = e
+    panel = cls(items)
+    panel.failed_symbols = [symbol for symbol in symbols if errors.has_key(symbol)]
+    panel.errors = errors
+    panel.load_error = load_error
+    return panel
+
+  def get(self, name):
+    """Returns the named column (open, high, low, close, adj_close or volume) as a float array."""
+    if not self.__columns.has_key(name):
+      if not PANEL_COLUMNS.has_key(name):
+        raise KeyError('No panel column named ' + name + '.')
+      column = empty((len(self.dates), len(self.symbols)))
+      column.fill(nan)
+      for (j, symbol) in enumerate(self.symbols):
+        eod = self.end_of_day_items[symbol]
+        rows = [self.__date_index[d] for d in eod.dates]
+        column[rows, j] = getattr(eod, PANEL_COLUMNS[name])
+      self.__columns[name] = column
+    return self.__columns[name]
+
+  def evaluate(self, expression):
+    """Returns the values of an expression as a day-by-symbol array.
+
+    expression -- A column name, or a function taking the panel and returning an array.
+    """
+    if callable(expression):
+      return expression(self)
+    return self.get(expression)
+
+  def rank(self, expression, k, largest=True):
+    """Returns a dictionary mapping each date to the symbols with the k largest values.
+
+    expression -- A column name, or a function taking the panel and returning an array.
+    k -- The number of symbols to return per day.
+    largest -- True for the k largest values, in decreasing order, or False for the k smallest,
+               in increasing order.
+
+    Symbols with NaN values are never ranked, so a day may have fewer than k symbols.
+    """
+    values = self.evaluate(expression)
+    if largest:
+      indices = top_k(values, k)
+    else:
+      indices = bottom_k(values, k)
+    rankings = {}
+    for (i, day) in enumerate(self.dates):
+      rankings[day] = [self.symbols[j] for j in indices[i] if j >= 0]
+    return rankings
+
+  def get_end_of_day(self, symbol):
+    """Returns the EndOfDay object of the given symbol."""
+    return self.end_of_day_items[symbol]
+
+  def get_date_index(self, dateobj):
+    """Returns the row of the given date, or None if no symbol has data on it."""
+    return self.__date_index.get(dateobj)
+
+  def get_symbol_index(self, symbol):
+    """Returns the column of the given symbol, or None if it is not in the panel."""
+    return self.__symbol_index.get(symbol)
+
+def top_k(values, k):
+  """Returns the column indexes of the k largest values of each row, in decreasing order.
+
+  values -- A 2-D numpy array.
+  k -- The number of indexes per row.
+
+  The result is a (rows, k) integer array. The largest values of each row are found with
+  numpy.argpartition, and only those k are sorted. NaN values are never selected; when a row
+  has fewer than k other values, its remaining indexes are -1.
+  """
+  (rows, columns) = values.shape
+  k = min(k, columns)
+  if k <= 0:
+    return empty((rows, 0), dtype=int)
+  valid = ~isnan(values)
+  keys = where(valid, -values, inf)
+  if k < columns:
+    indices = argpartition(keys, k - 1, axis=1)[:, :k]
+  else:
+    indices = arange(columns)[None, :].repeat(rows, axis=0)
+  row_indices = arange(rows)[:, None]
+  order = keys[row_indices, indices].argsort(axis=1, kind='mergesort')
+  indices = indices[row_indices, order]
+  return where(valid[row_indices, indices], indices, -1)
+
+def bottom_k(values, k):
+  """Returns the column indexes of the k smallest values of each row, in increasing order.
+
+  This is top_k of the negated values.
+  """
+  return top_k(-values, k)
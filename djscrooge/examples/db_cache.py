@@ -22,15 +22,16 @@ from djscrooge.charting import chart_backtest
 from djscrooge.library.strategy.biggest_loser import BiggestLoser
 from djscrooge.library.commissions.wells_pma_commissions import WellsPMACommissions
 from djscrooge.library.strategy.buy_hold_spy import BuyHoldSPY
-from djscrooge.library.end_of_day.mongodb_cache import MongodbCache
+from djscrooge.config import Config
 
 def main():
   start_date = date(2007,6,28)
   end_date = date(2012, 6, 28)
+  cache_class = Config().CACHE_END_OF_DAY_CLASS
   buy_hold_test = Backtest(start_date, end_date, commissions_class=WellsPMACommissions, 
-                      strategy_class=BuyHoldSPY, end_of_day_class=MongodbCache)
+                      strategy_class=BuyHoldSPY, end_of_day_class=cache_class)
   biggest_loser_test = Backtest(start_date, end_date, commissions_class=WellsPMACommissions, 
-                                 strategy_class=BiggestLoser,end_of_day_class=MongodbCache, cache=False)
+                                 strategy_class=BiggestLoser,end_of_day_class=cache_class, cache=False)
   chart_backtest(buy_hold_test, biggest_loser_test, labels=['Buy & Hold', 'BiggestLoser.'], colors=['g', 'b'], title='Strategy Comparison')
         
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+"""This file contains a benchmark of the Yahoo price file parsers of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from datetime import date
+from StringIO import StringIO
+from timeit import timeit
+from djscrooge.library.end_of_day.yahoo import HeadingCsv, parse_price_csv
+
+def make_price_csv(days):
+  """Returns a synthetic Yahoo price file with the given number of days, newest first."""
+  lines = ['Date,Open,High,Low,Close,Volume,Adj Close']
+  last = date(2012, 7, 6).toordinal()
+  for i in range(0, days):
+    cents = 2000 + (i * 37) % 500
+    lines.append('%s,%d.%02d,%d.%02d,%d.%02d,%d.%02d,%d,%d.%02d' % 
+                 (date.fromordinal(last - i).isoformat(), cents / 100, cents % 100, 
+                  (cents + 20) / 100, (cents + 20) % 100, (cents - 20) / 100, (cents - 20) % 100,
+                  (cents + 5) / 100, (cents + 5) % 100, 1000000 + i, cents / 100, cents % 100))
+  return '\n'.join(lines) + '\n'
+
+def parse_rows(text):
+  """Parses the price file row by row, as the Yahoo class did before parse_price_csv."""
+  dates = []
+  open_prices = []
+  high_prices = []
+  low_prices = []
+  close_prices = []
+  adj_close_prices = []
+  volumes = []
+  for line in HeadingCsv(StringIO(text)):
+    dateparts = line['Date'].split('-')
+    dates.append(date(int(dateparts[0]), int(dateparts[1]), int(dateparts[2])))
+    open_prices.append(int(line['Open'].replace('.', '')))
+    high_prices.append(int(line['High'].replace('.', '')))
+    low_prices.append(int(line['Low'].replace('.', '')))
+    close_prices.append(int(line['Close'].replace('.', '')))
+    adj_close_prices.append(int(line['Adj Close'].replace('.', '')))
+    volumes.append(int(line['Volume']))
+  for column in [dates, open_prices, high_prices, low_prices, close_prices, adj_close_prices, volumes]:
+    column.reverse()
+  return (dates, open_prices, high_prices, low_prices, close_prices, adj_close_prices, volumes)
+
+def parse_columns(text):
+  """Parses the price file with parse_price_csv, converting to the lists used by EndOfDay."""
+  columns = parse_price_csv(StringIO(text))
+  return (map(date.fromordinal, columns.date_ordinals.tolist()), columns.open_prices.tolist(),
+          columns.high_prices.tolist(), columns.low_prices.tolist(), columns.close_prices.tolist(),
+          columns.adj_close_prices.tolist(), columns.volumes.tolist())
+
+def main():
+  for years in [10, 25, 50]:
+    text = make_price_csv(years * 252)
+    assert parse_rows(text) == parse_columns(text)
+    rows = timeit(lambda: parse_rows(text), number=10) / 10
+    columns = timeit(lambda: parse_columns(text), number=10) / 10
+    print "%d years: row parser %.1f ms, columnar parser %.1f ms, %.1fx faster" % \
+      (years, rows * 1000, columns * 1000, rows / columns)
+  
+if __name__ == '__main__':
+  main()
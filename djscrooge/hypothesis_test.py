@@ -17,10 +17,17 @@ Copyright (C) 2012  James Adam Cataldo
     along with Pengoe.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from numpy import mean, log, exp
-from random import randint
+from numpy import mean, exp, asarray, atleast_2d, zeros, arange, bincount, argsort, \
+  minimum, maximum
+from numpy.random import RandomState
+from multiprocessing import Pool, cpu_count
+from collections import deque
+from math import sqrt
 
-def hypothesis_test(test_returns, benchmark_returns):
+MAX_CHUNK_ELEMENTS = 1 << 22
+"""The largest number of resample indices held in memory at once."""
+
+def hypothesis_test(test_returns, benchmark_returns, k=5000, seed=None, chunk_size=None):
   """
   Tests the hypothesis that the test_backetst will NOT have a greater return than the benchmark_backtest.
   
@@ -28,6 +35,11 @@ def hypothesis_test(test_returns, benchmark_returns):
     test_returns -- The naturual log of daily returns of the tested strategy, given as a list of floats.
     benchmark_returns -- The natural log of daily returns of the benchmark for comparison, given as a list
                          of floats.
+    k -- The number of bootstrap resamples to draw.
+    seed -- The seed of the random number generator. Tests with the same seed and returns give the same
+            p_value. When None, the generator is seeded from the operating system.
+    chunk_size -- The number of resamples drawn at a time. When None, this is chosen so that at most
+                  MAX_CHUNK_ELEMENTS indices are in memory at once.
     
   Returns: (excess_return, p_value):
     excess_return -- The average daily return of the strategy under test, after subtracting out the
@@ -37,39 +49,211 @@ def hypothesis_test(test_returns, benchmark_returns):
   
   If the excess_return is positive, and the p_value is less than 5.0%, it is reasonable to infer that
   the strategy under test will outperform the benchmark in the near future. Use the get_log_daily returns
-  funtion to compute the returns from a Backtest object.
+  funtion to compute the returns from a Backtest object. Neither list of returns is modified.
+  """
+  (centered_returns, test_mean) = center_returns(test_returns, benchmark_returns)
+  exceedances = count_exceedances(centered_returns, test_mean, k, RandomState(seed), chunk_size)
+  p_value = exceedances * 1.0 / k
+  return (annualize(test_mean), p_value * 100.0)
+
+def sequential_hypothesis_test(test_returns, benchmark_returns, significance=5.0, max_resamples=5000,
+                               batch_size=250, processes=None, seed=None, z=2.576):
+  """
+  Tests the same hypothesis as hypothesis_test, stopping as soon as the outcome is clear.
+  
+  Resamples are drawn in batches, spread across worker processes. Each batch is drawn from its own
+  random number generator, seeded from the given seed, so the result does not depend on the number
+  of processes. After each batch, a Wilson score interval on the p_value is computed. Resampling
+  stops once the whole interval is on one side of the significance threshold, or once
+  max_resamples resamples have been drawn. No more than one batch per process is submitted ahead
+  of the batches already counted, so little work is wasted when resampling stops early.
+  
+  Parameters:
+    test_returns -- The naturual log of daily returns of the tested strategy, given as a list of floats.
+    benchmark_returns -- The natural log of daily returns of the benchmark for comparison, given as a list
+                         of floats.
+    significance -- The significance threshold of the p_value, given as a percentage.
+    max_resamples -- The most bootstrap resamples to draw, at least 1.
+    batch_size -- The number of resamples in each batch, at least 1.
+    processes -- The number of worker processes. When None, this is the number of CPUs. When 1, all
+                 resamples are drawn in the calling process.
+    seed -- The seed of the random number generator, as in hypothesis_test.
+    z -- The standard normal quantile of the confidence interval. The default gives a 99% interval,
+         which is deliberately conservative, since the interval is checked after every batch.
+    
+  Returns: (excess_return, p_value, resamples):
+    excess_return -- The annualized excess return, as in hypothesis_test.
+    p_value -- The p-value, as in hypothesis_test, estimated from the resamples drawn.
+    resamples -- The number of resamples actually used.
+  """
+  if max_resamples < 1:
+    raise ValueError('At least one resample must be drawn.')
+  if batch_size < 1:
+    raise ValueError('Each batch must draw at least one resample.')
+  (centered_returns, test_mean) = center_returns(test_returns, benchmark_returns)
+  batches = (max_resamples + batch_size - 1) / batch_size
+  seeds = RandomState(seed).randint(0, 2**31 - 1, size=batches)
+  tasks = [(centered_returns, test_mean, min(batch_size, max_resamples - i * batch_size), seeds[i])
+           for i in range(0, batches)]
+  threshold = significance / 100.0
+  if processes is None:
+    processes = cpu_count()
+  pool = None
+  if processes > 1:
+    pool = Pool(processes)
+  pending = deque()
+  submitted = 0
+  exceedances = 0
+  resamples = 0
+  try:
+    for task in tasks:
+      if pool is None:
+        (batch_exceedances, batch_resamples) = bootstrap_batch(task)
+      else:
+        while submitted < batches and len(pending) < processes:
+          pending.append(pool.apply_async(bootstrap_batch, (tasks[submitted],)))
+          submitted += 1
+        (batch_exceedances, batch_resamples) = pending.popleft().get()
+      exceedances += batch_exceedances
+      resamples += batch_resamples
+      (lower, upper) = wilson_interval(exceedances, resamples, z)
+      if upper < threshold or lower > threshold:
+        break
+  finally:
+    if pool is not None:
+      pool.terminate()
+      pool.join()
+  p_value = exceedances * 1.0 / resamples
+  return (annualize(test_mean), p_value * 100.0, resamples)
+
+def bootstrap_batch(task):
+  """Returns (exceedances, resamples) for a (centered_returns, test_mean, resamples, seed) task.
+  
+  This is run in worker processes by sequential_hypothesis_test.
   """
-  benchmark_mean = mean(benchmark_returns)
-  n = len(test_returns)
-  for i in range(0, n):
-    test_returns[i] -= benchmark_mean
-  test_mean = mean(test_returns)
-  for i in range(0, n):
-    test_returns[i] -= test_mean
-  k = 5000
-  samples = [0.0] * n
-  test_means = [0.0] * k
-  for i in range(0, k):
-    for j in range(0, n):
-      x = randint(0, n - 1)
-      samples[j] = test_returns[x]
-    test_means[i] = mean(samples)
-  p_value = 0.0
-  for i in range(0, k):
-    if test_mean <= test_means[i]:
-      p_value += 1.0
-  p_value /= k
-  test_mean *= 252
-  test_mean = (exp(test_mean) - 1) * 100
-  return (test_mean, p_value * 100.0)
+  (centered_returns, test_mean, resamples, seed) = task
+  return (count_exceedances(centered_returns, test_mean, resamples, RandomState(seed)), resamples)
+
+def wilson_interval(successes, trials, z):
+  """Returns the (lower, upper) Wilson score interval of a binomial proportion, given as fractions."""
+  p = successes * 1.0 / trials
+  denominator = 1.0 + z * z / trials
+  center = (p + z * z / (2.0 * trials)) / denominator
+  half_width = z * sqrt(p * (1.0 - p) / trials + z * z / (4.0 * trials * trials)) / denominator
+  return (center - half_width, center + half_width)
+
+def batch_hypothesis_test(test_returns, benchmark_returns, k=5000, seed=None, chunk_size=None,
+                          adjustment=None):
+  """
+  Tests many strategies against one benchmark, as in hypothesis_test, sharing one set of resamples.
+  
+  Every strategy is resampled with the same bootstrap indices. For each chunk of resamples, the
+  indices are turned into a matrix of counts, and the resample means of every strategy are computed
+  with one matrix product. Testing many strategies costs about as much as drawing one bootstrap.
+  
+  Parameters:
+    test_returns -- The natural log of daily returns of the tested strategies, given as a list with one
+                    list of floats per strategy. All the lists must be the same length.
+    benchmark_returns -- The natural log of daily returns of the benchmark for comparison, given as a list
+                         of floats.
+    k -- The number of bootstrap resamples to draw.
+    seed -- The seed of the random number generator. With the same seed, each p_value equals the one
+            hypothesis_test gives for that strategy alone.
+    chunk_size -- The number of resamples drawn at a time, as in hypothesis_test.
+    adjustment -- The multiple-comparison adjustment of the p_values, given as one of the names
+                  accepted by adjust_p_values, or None for no adjustment.
+    
+  Returns: (excess_returns, p_values), numpy arrays with one entry per strategy, with the same
+  meaning as the values returned by hypothesis_test.
+  """
+  excess_returns = atleast_2d(asarray(test_returns, dtype=float)) - mean(benchmark_returns)
+  test_means = excess_returns.mean(axis=1)
+  centered_returns = excess_returns - test_means[:, None]
+  (m, n) = centered_returns.shape
+  exceedances = zeros(m)
+  for indices in resample_indices(n, k, RandomState(seed), chunk_size):
+    rows = len(indices)
+    offsets = arange(rows)[:, None] * n
+    counts = bincount((indices + offsets).ravel(), minlength=rows * n).reshape(rows, n)
+    resample_means = counts.dot(centered_returns.T) / float(n)
+    exceedances += (resample_means >= test_means).sum(axis=0)
+  p_values = exceedances / k * 100.0
+  if adjustment is not None:
+    p_values = adjust_p_values(p_values, adjustment)
+  return (annualize(test_means), p_values)
+
+def adjust_p_values(p_values, method):
+  """Adjusts p_values, given as percentages, for multiple comparisons.
+  
+  method -- One of:
+    'bonferroni' -- Multiplies each p_value by the number of tests. This controls the
+                    family-wise error rate.
+    'holm' -- The Holm-Bonferroni step-down method. This also controls the family-wise error
+              rate, and is never less powerful than 'bonferroni'.
+    'benjamini_hochberg' -- The Benjamini-Hochberg step-up method. This controls the false
+                            discovery rate.
+                            
+  Returns the adjusted p_values as a numpy array, in the original order, capped at 100.0.
+  """
+  p_values = asarray(p_values, dtype=float)
+  m = len(p_values)
+  if method == 'bonferroni':
+    return minimum(p_values * m, 100.0)
+  order = argsort(p_values)
+  ranked = p_values[order]
+  if method == 'holm':
+    ranked = maximum.accumulate(ranked * (m - arange(m)))
+  elif method == 'benjamini_hochberg':
+    ranked = minimum.accumulate((ranked * m / arange(1, m + 1))[::-1])[::-1]
+  else:
+    raise ValueError('Unknown p-value adjustment: ' + str(method))
+  result = zeros(m)
+  result[order] = minimum(ranked, 100.0)
+  return result
+
+def center_returns(test_returns, benchmark_returns):
+  """Returns (centered_returns, test_mean) for the bootstrap under the null hypothesis.
+  
+  The test_mean is the average daily excess return of the test_returns over the benchmark_returns.
+  The centered_returns are the daily excess returns minus the test_mean, as a new numpy array.
+  """
+  excess_returns = asarray(test_returns, dtype=float) - mean(benchmark_returns)
+  test_mean = excess_returns.mean()
+  return (excess_returns - test_mean, test_mean)
+
+def resample_indices(n, k, random_state, chunk_size=None):
+  """Yields arrays of bootstrap indices into a series of length n, one row per resample.
+  
+  n -- The length of the resampled series.
+  k -- The total number of resamples, over all yielded arrays.
+  random_state -- The numpy.random.RandomState object drawing the indices.
+  chunk_size -- The most rows in a yielded array. When None, this is chosen so that at most
+                MAX_CHUNK_ELEMENTS indices are in memory at once.
+                
+  The indices drawn do not depend on the chunk_size.
+  """
+  if chunk_size is None:
+    chunk_size = max(1, MAX_CHUNK_ELEMENTS / max(n, 1))
+  drawn = 0
+  while drawn < k:
+    rows = min(chunk_size, k - drawn)
+    yield random_state.randint(0, n, size=(rows, n))
+    drawn += rows
+
+def count_exceedances(centered_returns, test_mean, k, random_state, chunk_size=None):
+  """Returns how many of k bootstrap resamples of centered_returns have a mean of at least test_mean."""
+  exceedances = 0
+  for indices in resample_indices(len(centered_returns), k, random_state, chunk_size):
+    exceedances += int((centered_returns.take(indices).mean(axis=1) >= test_mean).sum())
+  return exceedances
+
+def annualize(daily_log_return):
+  """Converts an average daily log return to an annualized percentage, assuming 252 trading days."""
+  return (exp(daily_log_return * 252) - 1) * 100
     
 def get_log_daily_returns(backtest):
   """Gets the log daily returns of the given Backtest.
   
   The log-daily return of day i is computed as ln(open_price[i+2] / open_price[i+1]).
   """
-  returns = [0.0] * (len(backtest.open_values) - 2)
-  for i in range(0, len(returns)):
-    returns[i] = log(backtest.open_values[i+2] * 1.0 / backtest.open_values[i+1])
-  return returns
-    
\ No newline at end of file
+  return backtest.open_log_returns[1:].tolist()
@@ -0,0 +1,160 @@
+"""This file contains the parallel cache warmer of the DJ Scrooge Backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Usage:
+    python -m djscrooge.library.end_of_day.cache_warmer UNIVERSE_FILE END_DATE [options]
+
+The universe file lists one ticker symbol per line. Blank lines, and anything after a '#',
+are ignored, and so is anything after the first tab, so a failures file can be used as a
+universe file to retry the symbols which failed, or as a blacklist to skip them.
+"""
+from djscrooge.config import Config
+from collections import namedtuple
+from datetime import date, datetime
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+from time import time
+import sys
+
+WarmProgress = namedtuple('WarmProgress', ['symbol', 'error', 'done', 'total', 'failed',
+                                           'seconds', 'symbols_per_second'])
+"""The progress of a warm_symbols call, reported after each symbol."""
+
+WarmResult = namedtuple('WarmResult', ['warmed', 'failures', 'seconds'])
+"""The result of a warm_symbols call.
+
+warmed -- The symbols whose caches were brought up to date, in the order given.
+failures -- A dictionary mapping each symbol which failed to the reason it failed.
+seconds -- The wall-clock time taken.
+"""
+
+def read_universe(path):
+  """Returns the ticker symbols listed in the given universe file, without duplicates."""
+  symbols = []
+  seen = set([])
+  with open(path) as f:
+    for line in f:
+      symbol = line.split('#', 1)[0].split('\t', 1)[0].strip()
+      if symbol != '' and not symbol in seen:
+        seen.add(symbol)
+        symbols.append(symbol)
+  return symbols
+
+def write_failures(path, failures):
+  """Writes the failures of a WarmResult to the given path, one 'symbol<TAB>reason' per line."""
+  with open(path, 'w') as f:
+    for symbol in sorted(failures.keys()):
+      f.write(symbol + '\t' + ' '.join(failures[symbol].split()) + '\n')
+
+def print_progress(progress, stream=None):
+  """Prints a WarmProgress as one line, to standard error by default."""
+  if stream is None:
+    stream = sys.stderr
+  line = '[%d/%d] %s' % (progress.done, progress.total, progress.symbol)
+  if progress.error is not None:
+    line += ' FAILED (' + progress.error + ')'
+  line += ' -- %d failed, %.1f symbols/s' % (progress.failed, progress.symbols_per_second)
+  stream.write(line + '\n')
+
+def warm_symbol(task):
+  """Brings the cache of one symbol up to date, and returns (symbol, None) or (symbol, reason).
+
+  task -- A (symbol, end_date, end_of_day_class) tuple.
+  """
+  (symbol, end_date, end_of_day_class) = task
+  try:
+    end_of_day_class(symbol, date(1900,1,1), end_date)
+  except Exception, e:
+    return (symbol, type(e).__name__ + ': ' + str(e))
+  return (symbol, None)
+
+def warm_symbols(symbols, end_date, end_of_day_class=None, workers=8, report=None):
+  """Brings the caches of many symbols up to date concurrently, and returns a WarmResult.
+
+  symbols -- The ticker symbols to warm.
+  end_date -- The date the caches should be up to date with.
+  end_of_day_class -- The cache class, or None for djscrooge.config.Config.CACHE_END_OF_DAY_CLASS.
+  workers -- The most symbols warmed at once.
+  report -- A function called with a WarmProgress after each symbol, or None.
+
+  A symbol which fails does not stop the others. Its failure is recorded with the reason.
+  """
+  if end_of_day_class is None:
+    end_of_day_class = Config().CACHE_END_OF_DAY_CLASS
+  start = time()
+  failures = {}
+  succeeded = set([])
+  tasks = [(symbol, end_date, end_of_day_class) for symbol in symbols]
+  pool = ThreadPool(max(1, min(workers, len(tasks))))
+  try:
+    for (symbol, error) in pool.imap_unordered(warm_symbol, tasks):
+      if error is None:
+        succeeded.add(symbol)
+      else:
+        failures[symbol] = error
+      if report is not None:
+        seconds = time() - start
+        done = len(succeeded) + len(failures)
+        report(WarmProgress(symbol, error, done, len(tasks), len(failures), seconds,
+                            done / max(seconds, 1e-9)))
+  finally:
+    pool.terminate()
+  warmed = [symbol for symbol in symbols if symbol in succeeded]
+  return WarmResult(warmed, failures, time() - start)
+
+def warm_universe(universe_path, end_date, end_of_day_class=None, workers=8, report=None,
+                  blacklist_path=None, failures_path=None):
+  """Warms the caches of the symbols of a universe file, and returns a WarmResult.
+
+  universe_path -- The universe file.
+  blacklist_path -- An optional file of symbols to skip, in the same format.
+  failures_path -- An optional path where the failures are written with write_failures.
+
+  The other arguments are those of warm_symbols.
+  """
+  symbols = read_universe(universe_path)
+  if blacklist_path is not None:
+    blacklist = set(read_universe(blacklist_path))
+    symbols = [symbol for symbol in symbols if not symbol in blacklist]
+  result = warm_symbols(symbols, end_date, end_of_day_class, workers, report)
+  if failures_path is not None:
+    write_failures(failures_path, result.failures)
+  return result
+
+def main(arguments):
+  """Runs warm_universe from the command line."""
+  parser = OptionParser(usage='%prog UNIVERSE_FILE END_DATE [options]')
+  parser.add_option('-w', '--workers', type='int', default=8,
+                    help='the most symbols warmed at once [default: %default]')
+  parser.add_option('-b', '--blacklist', help='a file of symbols to skip')
+  parser.add_option('-f', '--failures', help='where to write the symbols which failed')
+  (options, arguments) = parser.parse_args(arguments)
+  if len(arguments) != 2:
+    parser.error('a universe file and an end date (YYYY-MM-DD) are required')
+  end_date = datetime.strptime(arguments[1], '%Y-%m-%d').date()
+  result = warm_universe(arguments[0], end_date, workers=options.workers, report=print_progress,
+                         blacklist_path=options.blacklist, failures_path=options.failures)
+  total = len(result.warmed) + len(result.failures)
+  sys.stderr.write('Warmed %d of %d symbols in %.1f s (%.1f symbols/s).\n' %
+                   (len(result.warmed), total, result.seconds, total / max(result.seconds, 1e-9)))
+  if len(result.failures) > 0:
+    return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main(sys.argv[1:]))
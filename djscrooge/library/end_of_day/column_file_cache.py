@@ -0,0 +1,271 @@
+"""This file contains the ColumnFileCache class of the DJ Scrooge Backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies:
+    numpy: <http://numpy.scipy.org/>
+"""
+from djscrooge.backtest import EndOfDay, Split
+from djscrooge.config import Config
+from djscrooge.util.trading_calendar import last_completed_session
+from datetime import date
+from collections import namedtuple
+from numpy import array, asarray, concatenate, dtype, fromfile, memmap, searchsorted, zeros
+from uuid import uuid4
+import json
+import os
+
+COLUMN_TYPES = [('dates', '<i4'),
+                ('open_prices', '<i8'),
+                ('high_prices', '<i8'),
+                ('low_prices', '<i8'),
+                ('close_prices', '<i8'),
+                ('adj_close_prices', '<f8'),
+                ('volumes', '<i8')]
+"""The fixed-width columns of the prices file of each symbol, with their little-endian types."""
+
+COLUMN_ALIGNMENT = 8
+"""The alignment, in bytes, of the start of each column in the prices file."""
+
+DIVIDEND_TYPE = dtype([('index', '<i8'), ('value', '<f8')])
+"""The record type of the sparse dividends file."""
+
+SPLIT_TYPE = dtype([('index', '<i8'), ('numerator', '<i8'), ('denominator', '<i8')])
+"""The record type of the sparse splits file."""
+
+HEADER_FILE = 'header.json'
+
+GENERATION_FILES = ['prices', 'dividends', 'splits']
+"""The files written for each generation of a symbol, suffixed with the generation."""
+
+SymbolColumns = namedtuple('SymbolColumns', ['arrays', 'dividends', 'splits'])
+"""The days of a symbol, in the layout of its files.
+
+arrays -- A dictionary mapping each column of COLUMN_TYPES to a numpy array, with the dates
+          as date ordinals.
+dividends -- A numpy array of DIVIDEND_TYPE records, one per day with a dividend.
+splits -- A numpy array of SPLIT_TYPE records, one per day with a split.
+"""
+
+class ColumnFileCache(EndOfDay):
+  """An EndOfDay object backed by memory-mapped binary column files.
+
+  Each symbol has a directory under djscrooge.config.Config.COLUMN_FILE_CACHE_DIRECTORY,
+  holding a prices file of fixed-width columns (listed in COLUMN_TYPES) at fixed offsets,
+  sparse dividend and split record files, and a small JSON header. The prices file is mapped
+  once, so each object holds a single file descriptor, and the pages of the file are shared
+  between processes by the operating system.
+
+  The EndOfDay attributes are lists, as for every other EndOfDay class. The columns between
+  the start and end dates are also available, without copying, in the arrays attribute: a
+  dictionary mapping each column of COLUMN_TYPES to a numpy.memmap slice of the prices file.
+
+  This has the same read-through behavior as MongodbCache. A symbol is rewritten as a new
+  generation of files, and its header is replaced last, so readers always see a complete
+  generation, and objects created before a rewrite keep reading the files they mapped. The
+  files of a generation are removed when the generation after next is written, so a reader
+  which has just read the header can still open them.
+  """
+
+  def __init__(self, symbol, start_date, end_date):
+    """Creates the ColumnFileCache object."""
+    super(ColumnFileCache, self).__init__(symbol, start_date, end_date)
+    self.symbol = symbol
+    self.start_date = start_date
+    self.end_date = end_date
+    self.session = last_completed_session(end_date)
+    self.directory = os.path.join(Config().COLUMN_FILE_CACHE_DIRECTORY, symbol)
+    header = read_header(self.directory)
+    if header is None or self.session.toordinal() > header['updated_to']:
+      if header is None or not self.refresh_symbol(header):
+        self.add_symbol()
+      header = read_header(self.directory)
+    self.read_prices(header, start_date.toordinal(), end_date.toordinal())
+
+  def add_symbol(self):
+    """Writes the full history of the symbol from the source."""
+    eod = Config().CACHE_END_OF_DAY_SOURCE_CLASS(self.symbol, date(1900,1,1), self.session)
+    write_symbol(self.directory, get_columns(eod), self.session.toordinal())
+
+  def refresh_symbol(self, header):
+    """Adds the days after the updated_to date of the header to the files of the symbol.
+
+    The last djscrooge.config.Config.CACHE_REFRESH_OVERLAP_DAYS days held are fetched again
+    from the source, from the first of them which is not a split-only day, and compared with
+    the files. Returns False, without changing the files,
+    if the source has rewritten those days. In that case the full history must be reloaded.
+    """
+    held = open_symbol(self.directory, header)
+    ordinals = held.arrays['dates']
+    stop = searchsorted(ordinals, header['updated_to'], 'right')
+    if stop == 0 or stop != len(ordinals):
+      return False
+    start = max(0, stop - Config().CACHE_REFRESH_OVERLAP_DAYS)
+    cached = EndOfDay(self.symbol, None, None)
+    set_lists(cached, held, start, stop)
+    held_days = len(cached.dates)
+    first = cached.get_first_trading_index()
+    if first is None:
+      return False
+    eod = Config().CACHE_END_OF_DAY_SOURCE_CLASS(self.symbol, cached.dates[first], self.session)
+    if not cached.merge_tail(eod):
+      return False
+    write_symbol(self.directory, concatenate_columns(held, get_columns(cached, held_days)),
+                 self.session.toordinal())
+    return True
+
+  def read_prices(self, header, start_ordinal, end_ordinal):
+    """Sets the columns of this object to the days of the files between the ordinals.
+
+    If the files of the header have been removed by two rewrites since it was read, the
+    header is read again.
+    """
+    try:
+      held = open_symbol(self.directory, header)
+    except (IOError, OSError):
+      held = open_symbol(self.directory, read_header(self.directory))
+    start = searchsorted(held.arrays['dates'], start_ordinal, 'left')
+    stop = searchsorted(held.arrays['dates'], end_ordinal, 'right')
+    self.arrays = dict((name, column[start:stop]) for (name, column) in held.arrays.iteritems())
+    set_lists(self, held, start, stop)
+
+
+def read_header(directory):
+  """Returns the header of the symbol directory as a dictionary, or None if there is none."""
+  path = os.path.join(directory, HEADER_FILE)
+  if not os.path.exists(path):
+    return None
+  with open(path) as f:
+    return json.load(f)
+
+def get_column_path(directory, header, name):
+  """Returns the path of the named file (listed in GENERATION_FILES) of the generation of the header."""
+  return os.path.join(directory, name + '.' + header['generation'])
+
+def get_column_offsets(days):
+  """Returns the byte offsets of the columns of a prices file of the given number of days.
+
+  The columns are stored in the order of COLUMN_TYPES, each starting on a multiple of
+  COLUMN_ALIGNMENT. The last offset is the size of the file.
+  """
+  offsets = [0]
+  for (name, column_type) in COLUMN_TYPES:
+    size = days * dtype(column_type).itemsize
+    offsets.append(offsets[-1] + -(-size // COLUMN_ALIGNMENT) * COLUMN_ALIGNMENT)
+  return offsets
+
+def open_symbol(directory, header):
+  """Returns the SymbolColumns of the files of the header, with the prices file mapped once."""
+  days = header['days']
+  offsets = get_column_offsets(days)
+  if days > 0:
+    prices = memmap(get_column_path(directory, header, 'prices'), dtype='u1', mode='r',
+                    shape=(offsets[-1],))
+  arrays = {}
+  for (i, (name, column_type)) in enumerate(COLUMN_TYPES):
+    if days == 0:
+      arrays[name] = zeros(0, dtype=column_type)
+    else:
+      arrays[name] = prices[offsets[i]:offsets[i] + days * dtype(column_type).itemsize].view(column_type)
+  return SymbolColumns(arrays,
+                       fromfile(get_column_path(directory, header, 'dividends'), dtype=DIVIDEND_TYPE),
+                       fromfile(get_column_path(directory, header, 'splits'), dtype=SPLIT_TYPE))
+
+def set_lists(eod, held, start, stop):
+  """Sets the columns of the EndOfDay object to lists of the days of held from start to stop.
+
+  eod -- The EndOfDay object.
+  held -- The SymbolColumns of the days.
+  start -- The index of the first day.
+  stop -- The index after the last day.
+  """
+  eod.dates = [date.fromordinal(ordinal) for ordinal in held.arrays['dates'][start:stop].tolist()]
+  for (name, column_type) in COLUMN_TYPES:
+    if name != 'dates':
+      setattr(eod, name, held.arrays[name][start:stop].tolist())
+  eod.dividends = [None] * len(eod.dates)
+  for (i, value) in held.dividends.tolist():
+    if start <= i < stop:
+      eod.dividends[i - start] = value
+  eod.splits = [None] * len(eod.dates)
+  for (i, numerator, denominator) in held.splits.tolist():
+    if start <= i < stop:
+      eod.splits[i - start] = Split(numerator, denominator)
+
+def get_columns(eod, start=0):
+  """Returns the SymbolColumns of the days of the EndOfDay object from start on."""
+  arrays = {'dates' : asarray([d.toordinal() for d in eod.dates[start:]], dtype='<i4')}
+  for (name, column_type) in COLUMN_TYPES:
+    if name != 'dates':
+      arrays[name] = asarray(getattr(eod, name)[start:], dtype=column_type)
+  dividends = [(i - start, eod.dividends[i]) for i in range(start, len(eod.dates))
+               if eod.dividends[i] is not None]
+  splits = [(i - start, eod.splits[i].numerator, eod.splits[i].denominator)
+            for i in range(start, len(eod.dates)) if eod.splits[i] is not None]
+  return SymbolColumns(arrays, array(dividends, dtype=DIVIDEND_TYPE), array(splits, dtype=SPLIT_TYPE))
+
+def concatenate_columns(first, second):
+  """Returns the SymbolColumns of the days of first followed by those of second."""
+  offset = len(first.arrays['dates'])
+  arrays = dict((name, concatenate([first.arrays[name], second.arrays[name]]).astype(column_type))
+                for (name, column_type) in COLUMN_TYPES)
+  dividends = second.dividends.copy()
+  dividends['index'] += offset
+  splits = second.splits.copy()
+  splits['index'] += offset
+  return SymbolColumns(arrays, concatenate([first.dividends, dividends]),
+                       concatenate([first.splits, splits]))
+
+def write_symbol(directory, columns, updated_to):
+  """Writes a new generation of the column files of a symbol, and then its header.
+
+  directory -- The directory of the symbol.
+  columns -- The SymbolColumns to write.
+  updated_to -- The date ordinal of the session the files are up to date with.
+  """
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  old_header = read_header(directory)
+  header = {'generation' : uuid4().hex, 'updated_to' : updated_to, 'previous_generation' : None}
+  if old_header is not None:
+    header['previous_generation'] = old_header['generation']
+  with open(get_column_path(directory, header, 'prices'), 'wb') as f:
+    for (name, column_type) in COLUMN_TYPES:
+      column = asarray(columns.arrays[name], dtype=column_type)
+      column.tofile(f)
+      f.write('\0' * (-column.nbytes % COLUMN_ALIGNMENT))
+  columns.dividends.astype(DIVIDEND_TYPE).tofile(get_column_path(directory, header, 'dividends'))
+  columns.splits.astype(SPLIT_TYPE).tofile(get_column_path(directory, header, 'splits'))
+  ordinals = columns.arrays['dates']
+  header['days'] = len(ordinals)
+  header['last_session'] = None
+  if len(ordinals) > 0:
+    header['last_session'] = int(ordinals[-1])
+  temporary_path = os.path.join(directory, HEADER_FILE + '.' + header['generation'])
+  with open(temporary_path, 'w') as f:
+    json.dump(header, f)
+  os.rename(temporary_path, os.path.join(directory, HEADER_FILE))
+  if old_header is not None and old_header.get('previous_generation') is not None:
+    removed = {'generation' : old_header['previous_generation']}
+    for name in GENERATION_FILES:
+      path = get_column_path(directory, removed, name)
+      if os.path.exists(path):
+        os.remove(path)
+
+def warm_cache(symbol, end_date):
+  """Warm the cache with the given symbol, up to the given end date."""
+  ColumnFileCache(symbol, date(1900,1,1), end_date)
@@ -0,0 +1,226 @@
+"""This file contains the ColumnarMongodbCache class of the DJ Scrooge Backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies:
+    numpy: <http://numpy.scipy.org/>
+    pymongo: <http://api.mongodb.org/python/current/>
+"""
+from djscrooge.backtest import EndOfDay, Split
+from djscrooge.config import Config
+from djscrooge.library.end_of_day.mongodb_cache import MongodbCache, append_price_document, \
+  append_row, get_year_ranges
+from bson.binary import Binary
+from datetime import date
+from pymongo import ASCENDING, DESCENDING
+from numpy import asarray, frombuffer, searchsorted
+
+PRICE_COLUMNS = ['open_prices', 'high_prices', 'low_prices', 'close_prices',
+                 'adj_close_prices', 'volumes']
+"""The EndOfDay columns stored as packed arrays, in addition to the dates."""
+
+class ColumnarMongodbCache(MongodbCache):
+  """A MongodbCache which stores one document per symbol per year.
+
+  Each document of the price_blocks collection holds the days of one calendar year as packed
+  little-endian arrays, so a read decodes whole columns instead of building one Python object
+  per day. Dividends and splits are rare, so they are stored sparsely, as the indexes of the
+  days which have them along with their values.
+
+  The symbols of this layout are tracked in the block_symbols collection, so both layouts can
+  share a database. Existing prices collections are converted by migrate_to_columnar.
+  """
+
+  PRICES_COLLECTION = 'price_blocks'
+  SYMBOLS_COLLECTION = 'block_symbols'
+
+  def ensure_indexes(self):
+    """Creates the indexes of the cache collections, if they do not exist."""
+    self.symbols_collection.ensure_index('symbol')
+    self.prices_collection.ensure_index([('symbol', ASCENDING), ('year', ASCENDING)])
+
+  def read_prices(self, eod, start_ordinal, end_ordinal):
+    """Appends the cached days between the given date ordinals, inclusive, to the EndOfDay object."""
+    blocks = self.prices_collection.find({'symbol' : self.symbol,
+                                          'year' : {'$gte' : date.fromordinal(start_ordinal).year,
+                                                    '$lte' : date.fromordinal(end_ordinal).year}})
+    for block in blocks.sort('year', ASCENDING):
+      decode_block(eod, block, start_ordinal, end_ordinal)
+
+  @classmethod
+  def read_many_prices(cls, prices_collection, items, start_ordinal, end_ordinal):
+    """Appends the cached days between the given date ordinals to each of the EndOfDay objects."""
+    blocks = prices_collection.find({'symbol' : {'$in' : items.keys()},
+                                     'year' : {'$gte' : date.fromordinal(start_ordinal).year,
+                                               '$lte' : date.fromordinal(end_ordinal).year}},
+                                    {'_id' : False})
+    blocks = blocks.sort([('symbol', ASCENDING), ('year', ASCENDING)])
+    for block in blocks.batch_size(Config().MONGODB_READ_BATCH_SIZE):
+      decode_block(items[block['symbol']], block, start_ordinal, end_ordinal)
+
+  def read_last_prices(self, eod, end_ordinal, days):
+    """Appends the last cached days on or before the given date ordinal to the EndOfDay object."""
+    blocks = self.prices_collection.find({'symbol' : self.symbol,
+                                          'year' : {'$lte' : date.fromordinal(end_ordinal).year}})
+    held = []
+    count = 0
+    for block in blocks.sort('year', DESCENDING):
+      tail = EndOfDay(self.symbol, None, None)
+      decode_block(tail, block, None, end_ordinal)
+      held.append(tail)
+      count += len(tail.dates)
+      if count >= days:
+        break
+    for tail in reversed(held):
+      start = max(0, count - days)
+      for i in range(start, len(tail.dates)):
+        append_row(eod, tail, i)
+      count -= len(tail.dates)
+
+  def write_prices(self, eod):
+    """Writes all the days of the EndOfDay object to the cache."""
+    blocks = [encode_block(self.symbol, eod, start, stop) for (start, stop) in get_year_ranges(eod)]
+    if len(blocks) > 0:
+      self.prices_collection.insert(blocks)
+
+  def upsert_prices(self, eod, start_index):
+    """Writes the days of the EndOfDay object from start_index on, replacing any cached days.
+
+    Each year touched is read, merged with the new days and written back as a whole block.
+    """
+    first_year = eod.dates[start_index].year
+    for (start, stop) in get_year_ranges(eod):
+      year = eod.dates[start].year
+      if year < first_year:
+        continue
+      merged = EndOfDay(self.symbol, None, None)
+      block = self.prices_collection.find_one({'symbol' : self.symbol, 'year' : year})
+      if block is not None:
+        decode_block(merged, block, None, eod.dates[max(start, start_index)].toordinal() - 1)
+      for i in range(max(start, start_index), stop):
+        append_row(merged, eod, i)
+      self.prices_collection.update({'symbol' : self.symbol, 'year' : year},
+                                    encode_block(self.symbol, merged, 0, len(merged.dates)),
+                                    upsert=True)
+
+  def remove_prices(self):
+    """Removes all the cached days of the symbol."""
+    self.prices_collection.remove({'symbol' : self.symbol})
+
+
+def pack(values):
+  """Returns the given list of numbers as a (dtype string, bson Binary) tuple."""
+  values = asarray(values)
+  if values.dtype.kind in 'iub':
+    values = values.astype('<i8')
+  else:
+    values = values.astype('<f8')
+  return (values.dtype.str, Binary(values.tostring()))
+
+def unpack(block, name):
+  """Returns the packed array of the given name in the block as a numpy array."""
+  return frombuffer(block[name], dtype=block['dtypes'][name])
+
+def encode_block(symbol, eod, start, stop):
+  """Returns the price_blocks document of the days start to stop of the EndOfDay object.
+
+  All the days must belong to the same calendar year.
+  """
+  block = {'symbol' : symbol,
+           'year' : eod.dates[start].year,
+           'dtypes' : {}}
+  columns = {'dates' : [d.toordinal() for d in eod.dates[start:stop]]}
+  for column in PRICE_COLUMNS:
+    columns[column] = getattr(eod, column)[start:stop]
+  dividend_days = [i - start for i in range(start, stop) if eod.dividends[i] is not None]
+  split_days = [i - start for i in range(start, stop) if eod.splits[i] is not None]
+  columns['dividend_days'] = dividend_days
+  columns['dividends'] = [eod.dividends[start + i] for i in dividend_days]
+  columns['split_days'] = split_days
+  columns['split_numerators'] = [eod.splits[start + i].numerator for i in split_days]
+  columns['split_denominators'] = [eod.splits[start + i].denominator for i in split_days]
+  for (name, values) in columns.iteritems():
+    (block['dtypes'][name], block[name]) = pack(values)
+  return block
+
+def decode_block(eod, block, start_ordinal, end_ordinal):
+  """Appends the days of a price_blocks document to the EndOfDay object.
+
+  eod -- The EndOfDay object.
+  block -- The price_blocks document.
+  start_ordinal -- The date ordinal of the first day to append, or None for the first day of the block.
+  end_ordinal -- The date ordinal of the last day to append, or None for the last day of the block.
+  """
+  ordinals = unpack(block, 'dates')
+  start = 0
+  stop = len(ordinals)
+  if start_ordinal is not None:
+    start = searchsorted(ordinals, start_ordinal, 'left')
+  if end_ordinal is not None:
+    stop = searchsorted(ordinals, end_ordinal, 'right')
+  if start >= stop:
+    return
+  eod.dates.extend([date.fromordinal(d) for d in ordinals[start:stop].tolist()])
+  for column in PRICE_COLUMNS:
+    getattr(eod, column).extend(unpack(block, column)[start:stop].tolist())
+  dividends = [None] * (stop - start)
+  for (i, dividend) in zip(unpack(block, 'dividend_days').tolist(), unpack(block, 'dividends').tolist()):
+    if start <= i < stop:
+      dividends[i - start] = dividend
+  eod.dividends.extend(dividends)
+  splits = [None] * (stop - start)
+  for (i, numerator, denominator) in zip(unpack(block, 'split_days').tolist(),
+                                         unpack(block, 'split_numerators').tolist(),
+                                         unpack(block, 'split_denominators').tolist()):
+    if start <= i < stop:
+      splits[i - start] = Split(numerator, denominator)
+  eod.splits.extend(splits)
+
+def migrate_to_columnar(db, remove=False, source_class=MongodbCache, target_class=ColumnarMongodbCache):
+  """Converts the prices collection of the cache database to the price_blocks layout.
+
+  db -- The cache database.
+  remove -- If True, the prices and symbols documents of each symbol are removed once converted.
+  source_class -- The MongodbCache class whose collections are converted.
+  target_class -- The ColumnarMongodbCache class whose collections are written.
+
+  The collections are those named by the PRICES_COLLECTION and SYMBOLS_COLLECTION attributes
+  of the classes. Symbols already in the symbols collection of target_class are replaced.
+  Returns the number of symbols converted.
+  """
+  prices = db[source_class.PRICES_COLLECTION]
+  symbols = db[source_class.SYMBOLS_COLLECTION]
+  blocks_collection = db[target_class.PRICES_COLLECTION]
+  block_symbols = db[target_class.SYMBOLS_COLLECTION]
+  converted = 0
+  for data in list(symbols.find()):
+    symbol = data['symbol']
+    eod = EndOfDay(symbol, None, None)
+    for price in prices.find({'symbol' : symbol}).sort('date', ASCENDING):
+      append_price_document(eod, price)
+    blocks_collection.remove({'symbol' : symbol})
+    block_symbols.remove({'symbol' : symbol})
+    blocks = [encode_block(symbol, eod, start, stop) for (start, stop) in get_year_ranges(eod)]
+    if len(blocks) > 0:
+      blocks_collection.insert(blocks)
+    del data['_id']
+    block_symbols.insert(data)
+    if remove:
+      prices.remove({'symbol' : symbol})
+      symbols.remove({'symbol' : symbol})
+    converted += 1
+  return converted
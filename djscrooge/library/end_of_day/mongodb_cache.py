@@ -18,8 +18,12 @@ Copyright (C) 2012  James Adam Cataldo
 """
 from djscrooge.backtest import EndOfDay, Split
 from djscrooge.config import Config
+from djscrooge.util.trading_calendar import last_completed_session
+from djscrooge.util.data_types import LRUCache
+from bisect import bisect_left, bisect_right
 from datetime import date
-from pymongo import ASCENDING
+from pymongo import ASCENDING, DESCENDING
+from weakref import ref
 
 class MongodbCache(EndOfDay):
   """An EndOfDay object which uses MongoDB as a backing store.
@@ -28,75 +32,358 @@ class MongodbCache(EndOfDay):
   it uses the underlying EndOfDay class specified in:
     djscrooge.config.Config.CACHE_END_OF_DAY_SOURCE_CLASS
     
-  When the class is created, it retrieves a new pymongo.Connection from:
-    djscrooge.config.MONGODB_CONNECTION
+  The data is up to date when it covers the last completed trading session on or before the
+  end date, so weekends, exchange holidays and sessions which have not closed yet never cause
+  a fetch. The symbols collection records the session covered as updated_to, and the last day
+  actually stored as last_session.
+    
+  When the class is created, it retrieves the pymongo.MongoClient of the process from:
+    djscrooge.config.Config.MONGODB_CONNECTION
+    
+  Each day is stored as one document of the prices collection. Subclasses may store the days
+  differently by overriding the ensure_indexes, read_prices, read_last_prices, write_prices,
+  upsert_prices and remove_prices methods, and the collection names.
+  
+  Decoded days are kept in block_cache, a process-wide LRUCache of one EndOfDay object per
+  symbol per calendar year, holding at most djscrooge.config.Config.MONGODB_BLOCK_CACHE_SIZE
+  blocks. Ranges overlapping cached years are served by slicing the cached blocks. The blocks
+  are keyed on the updated_to of the symbol, which is kept in symbol_cache, a separate LRUCache
+  holding at most djscrooge.config.Config.MONGODB_SYMBOL_CACHE_SIZE symbols, so blocks read
+  before an update are never used after it. Updates made by other processes are seen once the
+  process updates the symbol. Both sizes are read from the Config whenever the caches are used.
   """
   
-  def __init__(self, symbol, start_date, end_date):
-    """Creates the MongodbCache object."""
+  PRICES_COLLECTION = 'prices'
+  SYMBOLS_COLLECTION = 'symbols'
+  
+  indexed_connections = {}
+  """Maps the id of each connection used to a (weak reference, set of PRICES_COLLECTION names) tuple."""
+  
+  block_cache = LRUCache(Config.MONGODB_BLOCK_CACHE_SIZE)
+  
+  symbol_cache = LRUCache(Config.MONGODB_SYMBOL_CACHE_SIZE)
+  
+  def __init__(self, symbol, start_date, end_date, read=True):
+    """Creates the MongodbCache object.
+    
+    If read is False, the cache is neither updated nor read, which leaves the price lists empty.
+    This is used by load_many, which reads many symbols at once.
+    """
     super(MongodbCache, self).__init__(symbol, start_date, end_date)
     self.symbol = symbol
     self.start_date = start_date
     self.end_date = end_date
+    self.session = last_completed_session(end_date)
     connection = Config().MONGODB_CONNECTION  
     db = connection.djscrooge
     self.db = db
-    symbols = db.symbols
-    data = symbols.find_one({'symbol' : symbol})
+    self.prices_collection = db[self.PRICES_COLLECTION]
+    self.symbols_collection = db[self.SYMBOLS_COLLECTION]
+    self.index_connection(connection)
+    if read:
+      self.update_symbol(self.get_symbol_data())
+      self.read_cached_prices(self, start_date.toordinal(), end_date.toordinal())
+      
+  @classmethod
+  def load_many(cls, symbols, start_date, end_date):
+    """Returns a dictionary mapping each of the symbols to its MongodbCache object.
+    
+    The symbols are checked with one query of the symbols collection, and the prices of all
+    of them are read with one query, whose cursor is split among the symbols as it streams.
+    Only symbols missing from the cache, or stale, are updated one by one.
+    """
+    items = {}
+    for symbol in symbols:
+      items[symbol] = cls(symbol, start_date, end_date, read=False)
+    if len(items) == 0:
+      return items
+    first = items.values()[0]
+    data = {}
+    for symbol_data in first.symbols_collection.find({'symbol' : {'$in' : items.keys()}}):
+      data[symbol_data['symbol']] = symbol_data
+    for symbol in items.keys():
+      items[symbol].update_symbol(data.get(symbol))
+    cls.read_many_prices(first.prices_collection, items, 
+                         start_date.toordinal(), end_date.toordinal())
+    return items
+  
+  @classmethod
+  def read_many_prices(cls, prices_collection, items, start_ordinal, end_ordinal):
+    """Appends the cached days between the given date ordinals to each of the EndOfDay objects.
+    
+    prices_collection -- The prices collection of the cache.
+    items -- A dictionary mapping symbols to the EndOfDay objects to fill.
+    start_ordinal -- The date ordinal of the first day to read.
+    end_ordinal -- The date ordinal of the last day to read.
+    """
+    prices = prices_collection.find({'symbol' : {'$in' : items.keys()}, 
+                                     'date' : {'$gte': start_ordinal, '$lte': end_ordinal}}, 
+                                    {'_id' : False})
+    prices = prices.sort([('symbol', ASCENDING), ('date', ASCENDING)])
+    for price in prices.batch_size(Config().MONGODB_READ_BATCH_SIZE):
+      append_price_document(items[price['symbol']], price)
+    
+  def index_connection(self, connection):
+    """Calls ensure_indexes the first time the given connection is used by this class of cache.
+    
+    Each connection is tracked with a weak reference, so a new connection given the id of one
+    which has been garbage collected is indexed again.
+    """
+    (reference, indexed) = MongodbCache.indexed_connections.get(id(connection), (None, None))
+    if reference is None or reference() is not connection:
+      indexed = set([])
+      MongodbCache.indexed_connections[id(connection)] = (ref(connection), indexed)
+    if not self.PRICES_COLLECTION in indexed:
+      self.ensure_indexes()
+      indexed.add(self.PRICES_COLLECTION)
+    
+  def update_symbol(self, data):
+    """Brings the cache of the symbol up to date, given its symbols document, or None if it has none."""
     if data is None:
       self.add_symbol()
-    elif end_date.toordinal() > data['updated_to']:
-      self.remove_symbol()
-      self.add_symbol()
-    prices = db.prices.find({'symbol' : symbol, 
-                             'date' : {'$gte': start_date.toordinal(), 
-                                       '$lte': end_date.toordinal()}})
-    for price in prices:
-      self.dates.append(date.fromordinal(price['date']))
-      self.open_prices.append(price['open'])
-      self.high_prices.append(price['high'])
-      self.low_prices.append(price['low'])
-      self.close_prices.append(price['close'])
-      self.adj_close_prices.append(price['adj_close'])
-      self.volumes.append(price['volume'])
-      if price.has_key('dividend'):
-        self.dividends.append(price['dividend'])
-      else:
-        self.dividends.append(None)
-      if price.has_key('split_numerator'):
-        self.splits.append(Split(price['split_numerator'], price['split_denominator']))
+    elif self.session.toordinal() > data['updated_to']:
+      if not self.refresh_symbol(data['updated_to']):
+        self.remove_symbol()
+        self.add_symbol()
+    else:
+      self.updated_to = data['updated_to']
+      return
+    self.updated_to = self.session.toordinal()
+    get_symbol_cache().put((self.SYMBOLS_COLLECTION, self.symbol), self.updated_to)
+    
+  def get_symbol_data(self):
+    """Returns the symbols document of the symbol, or None if it is not in the cache.
+    
+    The document is not queried if symbol_cache shows the symbol is up to date.
+    """
+    key = (self.SYMBOLS_COLLECTION, self.symbol)
+    symbol_cache = get_symbol_cache()
+    updated_to = symbol_cache.get(key)
+    if updated_to is None or updated_to < self.session.toordinal():
+      data = self.symbols_collection.find_one({'symbol' : self.symbol})
+      if data is None:
+        return None
+      updated_to = data['updated_to']
+      symbol_cache.put(key, updated_to)
+    self.updated_to = updated_to
+    return {'symbol' : self.symbol, 'updated_to' : updated_to}
+  
+  def read_cached_prices(self, eod, start_ordinal, end_ordinal):
+    """Appends the days between the given date ordinals to the EndOfDay object, using block_cache.
+    
+    The years missing from block_cache are read with one call to read_prices, and cached.
+    """
+    block_cache = get_block_cache()
+    first_year = date.fromordinal(start_ordinal).year
+    last_year = date.fromordinal(end_ordinal).year
+    blocks = {}
+    missing = []
+    for year in range(first_year, last_year + 1):
+      block = block_cache.get(self.get_block_key(year))
+      if block is None:
+        missing.append(year)
       else:
-        self.splits.append(None)
+        blocks[year] = block
+    if len(missing) > 0:
+      loaded = EndOfDay(self.symbol, None, None)
+      self.read_prices(loaded, date(missing[0], 1, 1).toordinal(), 
+                       date(missing[-1], 12, 31).toordinal())
+      for year in missing:
+        blocks[year] = EndOfDay(self.symbol, None, None)
+      for (start, stop) in get_year_ranges(loaded):
+        year = loaded.dates[start].year
+        if year in missing:
+          append_rows(blocks[year], loaded, start, stop)
+      for year in missing:
+        block_cache.put(self.get_block_key(year), blocks[year])
+    first_date = date.fromordinal(start_ordinal)
+    last_date = date.fromordinal(end_ordinal)
+    for year in range(first_year, last_year + 1):
+      block = blocks[year]
+      append_rows(eod, block, bisect_left(block.dates, first_date), 
+                  bisect_right(block.dates, last_date))
+  
+  def get_block_key(self, year):
+    """Returns the block_cache key of the given year of the symbol."""
+    return (self.PRICES_COLLECTION, self.symbol, self.updated_to, year)
     
   def add_symbol(self):
     """Adds the symbol to the cache."""
+    eod = Config().CACHE_END_OF_DAY_SOURCE_CLASS(self.symbol, date(1900,1,1), self.session)
+    self.write_prices(eod)
     data = {'symbol' : self.symbol,
-            'updated_to' : self.end_date.toordinal()}
-    self.db.symbols.insert(data)
-    self.db.symbols.ensure_index('symbol')
-    eod = Config().CACHE_END_OF_DAY_SOURCE_CLASS(self.symbol, date(1900,1,1), self.end_date)
-    for i in range(0, len(eod.dates)):
-      price = {'symbol' : self.symbol,
-               'date' : eod.dates[i].toordinal(),
-               'open' : eod.open_prices[i],
-               'high' : eod.high_prices[i],
-               'low' : eod.low_prices[i],
-               'close' : eod.close_prices[i], 
-               'adj_close' : eod.adj_close_prices[i],
-               'volume' : eod.volumes[i]}
-      if eod.dividends[i] is not None:
-        price['dividend'] = eod.dividends[i]
-      if eod.splits[i] is not None:
-        price['split_numerator'] = eod.splits[i].numerator
-        price['split_denominator'] = eod.splits[i].denominator
-      self.db.prices.insert(price)
-      self.db.prices.ensure_index([('symbol', ASCENDING), ('date', ASCENDING)])
+            'updated_to' : self.session.toordinal(),
+            'last_session' : get_last_session(eod)}
+    self.symbols_collection.insert(data)
       
+  def refresh_symbol(self, updated_to):
+    """Adds the days after the given updated_to date ordinal to the cache.
+    
+    The last djscrooge.config.Config.CACHE_REFRESH_OVERLAP_DAYS cached days are fetched again
+    from the source, from the first of them which is not a split-only day, and compared with
+    the cache. If they match, only the newer days are
+    written, with upsert_prices. Returns False, without changing the cache, if the source has
+    rewritten those days, for instance to adjust for a new dividend or split. In that case the
+    full history must be reloaded.
+    """
+    cached = EndOfDay(self.symbol, None, None)
+    self.read_last_prices(cached, updated_to, Config().CACHE_REFRESH_OVERLAP_DAYS)
+    if len(cached.dates) == 0:
+      return False
+    held_days = len(cached.dates)
+    first = cached.get_first_trading_index()
+    if first is None:
+      return False
+    eod = Config().CACHE_END_OF_DAY_SOURCE_CLASS(self.symbol, cached.dates[first], self.session)
+    if not cached.merge_tail(eod):
+      return False
+    if len(cached.dates) > held_days:
+      self.upsert_prices(cached, held_days)
+    self.symbols_collection.update({'symbol' : self.symbol}, 
+                                   {'$set' : {'updated_to' : self.session.toordinal(),
+                                              'last_session' : get_last_session(cached)}})
+    return True
+    
   def remove_symbol(self):
     """Removes stale data from the cache."""
-    self.db.prices.remove({'symbol' : self.symbol})
-    self.db.symbols.remove({'symbol' : self.symbol})
+    self.remove_prices()
+    self.symbols_collection.remove({'symbol' : self.symbol})
+    
+  def ensure_indexes(self):
+    """Creates the indexes of the cache collections, if they do not exist."""
+    self.symbols_collection.ensure_index('symbol')
+    self.prices_collection.ensure_index([('symbol', ASCENDING), ('date', ASCENDING)])
+    
+  def read_prices(self, eod, start_ordinal, end_ordinal):
+    """Appends the cached days between the given date ordinals, inclusive, to the EndOfDay object."""
+    prices = self.prices_collection.find({'symbol' : self.symbol, 
+                                          'date' : {'$gte': start_ordinal, 
+                                                    '$lte': end_ordinal}}).sort('date', ASCENDING)
+    for price in prices:
+      append_price_document(eod, price)
+      
+  def read_last_prices(self, eod, end_ordinal, days):
+    """Appends the last cached days on or before the given date ordinal to the EndOfDay object."""
+    prices = self.prices_collection.find({'symbol' : self.symbol, 
+                                          'date' : {'$lte' : end_ordinal}}).sort('date', DESCENDING).limit(days)
+    for price in reversed(list(prices)):
+      append_price_document(eod, price)
+      
+  def write_prices(self, eod):
+    """Writes all the days of the EndOfDay object to the cache."""
+    insert_prices(self.prices_collection, self.symbol, eod)
+    
+  def upsert_prices(self, eod, start_index):
+    """Writes the days of the EndOfDay object from start_index on, replacing any cached days.
+    
+    The cached days from the first day written on are removed with one query, and the days
+    are then written with the bulk inserts of insert_prices.
+    """
+    self.prices_collection.remove({'symbol' : self.symbol, 
+                                   'date' : {'$gte' : eod.dates[start_index].toordinal()}})
+    insert_prices(self.prices_collection, self.symbol, eod, start_index)
+      
+  def remove_prices(self):
+    """Removes all the cached days of the symbol."""
+    self.prices_collection.remove({'symbol' : self.symbol})
+    
     
+def get_block_cache():
+  """Returns MongodbCache.block_cache, sized by djscrooge.config.Config.MONGODB_BLOCK_CACHE_SIZE."""
+  MongodbCache.block_cache.resize(Config().MONGODB_BLOCK_CACHE_SIZE)
+  return MongodbCache.block_cache
+
+def get_symbol_cache():
+  """Returns MongodbCache.symbol_cache, sized by djscrooge.config.Config.MONGODB_SYMBOL_CACHE_SIZE."""
+  MongodbCache.symbol_cache.resize(Config().MONGODB_SYMBOL_CACHE_SIZE)
+  return MongodbCache.symbol_cache
+
+def insert_prices(prices_collection, symbol, eod, start_index=0):
+  """Inserts the days of the EndOfDay object into a prices collection with bulk inserts.
+  
+  prices_collection -- The prices collection of the cache.
+  symbol -- The ticker symbol of the EndOfDay object.
+  eod -- The EndOfDay object.
+  start_index -- The index of the first day of eod to insert.
+  
+  The days are inserted in order, djscrooge.config.Config.MONGODB_INSERT_BATCH_SIZE at a time.
+  """
+  batch_size = Config().MONGODB_INSERT_BATCH_SIZE
+  batch = []
+  for i in range(start_index, len(eod.dates)):
+    batch.append(get_price_document(symbol, eod, i))
+    if len(batch) == batch_size:
+      prices_collection.insert(batch)
+      batch = []
+  if len(batch) > 0:
+    prices_collection.insert(batch)
+
+def get_last_session(eod):
+  """Returns the date ordinal of the last day of the EndOfDay object, or None if it is empty."""
+  if len(eod.dates) == 0:
+    return None
+  return eod.dates[-1].toordinal()
+
+def append_price_document(eod, price):
+  """Appends the day of the given prices document to the lists of the EndOfDay object."""
+  eod.dates.append(date.fromordinal(price['date']))
+  eod.open_prices.append(price['open'])
+  eod.high_prices.append(price['high'])
+  eod.low_prices.append(price['low'])
+  eod.close_prices.append(price['close'])
+  eod.adj_close_prices.append(price['adj_close'])
+  eod.volumes.append(price['volume'])
+  if price.has_key('dividend'):
+    eod.dividends.append(price['dividend'])
+  else:
+    eod.dividends.append(None)
+  if price.has_key('split_numerator'):
+    eod.splits.append(Split(price['split_numerator'], price['split_denominator']))
+  else:
+    eod.splits.append(None)
+
+def get_year_ranges(eod):
+  """Returns the (start, stop) index ranges of the calendar years of the EndOfDay object."""
+  ranges = []
+  start = 0
+  for i in range(1, len(eod.dates) + 1):
+    if i == len(eod.dates) or eod.dates[i].year != eod.dates[start].year:
+      ranges.append((start, i))
+      start = i
+  return ranges
+
+def append_row(eod, source, i):
+  """Appends day i of the source EndOfDay object to the given EndOfDay object."""
+  append_rows(eod, source, i, i + 1)
+
+def append_rows(eod, source, start, stop):
+  """Appends the days start to stop of the source EndOfDay object to the given EndOfDay object."""
+  eod.dates.extend(source.dates[start:stop])
+  eod.open_prices.extend(source.open_prices[start:stop])
+  eod.high_prices.extend(source.high_prices[start:stop])
+  eod.low_prices.extend(source.low_prices[start:stop])
+  eod.close_prices.extend(source.close_prices[start:stop])
+  eod.adj_close_prices.extend(source.adj_close_prices[start:stop])
+  eod.volumes.extend(source.volumes[start:stop])
+  eod.dividends.extend(source.dividends[start:stop])
+  eod.splits.extend(source.splits[start:stop])
+
+def get_price_document(symbol, eod, i):
+  """Returns the prices document of day i of the EndOfDay object."""
+  price = {'symbol' : symbol,
+           'date' : eod.dates[i].toordinal(),
+           'open' : eod.open_prices[i],
+           'high' : eod.high_prices[i],
+           'low' : eod.low_prices[i],
+           'close' : eod.close_prices[i], 
+           'adj_close' : eod.adj_close_prices[i],
+           'volume' : eod.volumes[i]}
+  if eod.dividends[i] is not None:
+    price['dividend'] = eod.dividends[i]
+  if eod.splits[i] is not None:
+    price['split_numerator'] = eod.splits[i].numerator
+    price['split_denominator'] = eod.splits[i].denominator
+  return price
     
 def warm_cache(symbol, end_date):
   """Warm the cache with the given symbol, up to the given end date."""
@@ -0,0 +1,252 @@
+"""This file contains the SqliteCache class of the DJ Scrooge Backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from djscrooge.backtest import EndOfDay, Split
+from djscrooge.config import Config
+from djscrooge.util.trading_calendar import last_completed_session
+from datetime import date
+from threading import local
+import sqlite3
+import os
+
+SQLITE_MAX_VARIABLES = 999
+"""The most parameters SQLite accepts in one statement, with its default compile options."""
+
+SCHEMA = [
+  """CREATE TABLE IF NOT EXISTS prices (
+       symbol TEXT NOT NULL,
+       date INTEGER NOT NULL,
+       open INTEGER NOT NULL,
+       high INTEGER NOT NULL,
+       low INTEGER NOT NULL,
+       close INTEGER NOT NULL,
+       adj_close REAL NOT NULL,
+       volume INTEGER NOT NULL,
+       dividend REAL,
+       split_numerator INTEGER,
+       split_denominator INTEGER,
+       PRIMARY KEY (symbol, date)
+     ) WITHOUT ROWID""",
+  """CREATE TABLE IF NOT EXISTS symbols (
+       symbol TEXT NOT NULL PRIMARY KEY,
+       updated_to INTEGER NOT NULL,
+       last_session INTEGER
+     )"""]
+"""The tables of the cache. The prices table is clustered on its (symbol, date) primary key."""
+
+PRICE_COLUMNS = ('date, open, high, low, close, adj_close, volume, dividend, '
+                 'split_numerator, split_denominator')
+
+__connections = local()
+
+def get_connection(path):
+  """Returns the connection of the current thread and process to the cache database at path.
+
+  SQLite connections cannot be shared across threads or fork(), so each thread of each
+  process opens its own. New databases are created with the cache tables, in WAL mode, so
+  readers are not blocked while another process writes.
+  """
+  connections = getattr(__connections, 'connections', None)
+  if connections is None or __connections.pid != os.getpid():
+    connections = {}
+    __connections.connections = connections
+    __connections.pid = os.getpid()
+  if not connections.has_key(path):
+    directory = os.path.dirname(path)
+    if directory != '' and not os.path.isdir(directory):
+      os.makedirs(directory)
+    connection = sqlite3.connect(path, timeout=30.0)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    with connection:
+      for statement in SCHEMA:
+        connection.execute(statement)
+    connections[path] = connection
+  return connections[path]
+
+class SqliteCache(EndOfDay):
+  """An EndOfDay object which uses an SQLite database as a backing store.
+
+  This has the same read-through behavior as MongodbCache. When the cache does not have
+  up-to-date end-of-day data for a symbol, it uses the underlying EndOfDay class specified in:
+    djscrooge.config.Config.CACHE_END_OF_DAY_SOURCE_CLASS
+
+  The data is up to date when it covers the last completed trading session on or before the
+  end date. Stale symbols are refreshed with only the newer days, unless the source has
+  rewritten the overlapping history, in which case the symbol is reloaded in one transaction.
+
+  The database file is given by:
+    djscrooge.config.Config.SQLITE_CACHE_PATH
+  """
+
+  def __init__(self, symbol, start_date, end_date, read=True):
+    """Creates the SqliteCache object.
+
+    If read is False, the cache is neither updated nor read, which leaves the price lists empty.
+    This is used by load_many, which reads many symbols at once.
+    """
+    super(SqliteCache, self).__init__(symbol, start_date, end_date)
+    self.symbol = symbol
+    self.start_date = start_date
+    self.end_date = end_date
+    self.session = last_completed_session(end_date)
+    self.connection = get_connection(Config().SQLITE_CACHE_PATH)
+    if read:
+      self.update_symbol(self.get_updated_to())
+      self.read_prices(self, start_date.toordinal(), end_date.toordinal())
+
+  @classmethod
+  def load_many(cls, symbols, start_date, end_date):
+    """Returns a dictionary mapping each of the symbols to its SqliteCache object.
+
+    The prices of all the symbols are read with as few queries as the SQLite parameter limit
+    allows, ordered by the primary key.
+    """
+    items = {}
+    for symbol in symbols:
+      items[symbol] = cls(symbol, start_date, end_date, read=False)
+      items[symbol].update_symbol(items[symbol].get_updated_to())
+    keys = sorted(items.keys())
+    chunk_size = SQLITE_MAX_VARIABLES - 2
+    for i in range(0, len(keys), chunk_size):
+      chunk = keys[i:i + chunk_size]
+      rows = get_connection(Config().SQLITE_CACHE_PATH).execute(
+        'SELECT symbol, ' + PRICE_COLUMNS + ' FROM prices WHERE symbol IN (' +
+        ', '.join(['?'] * len(chunk)) + ') AND date BETWEEN ? AND ? ORDER BY symbol, date',
+        chunk + [start_date.toordinal(), end_date.toordinal()])
+      for row in rows:
+        append_price_row(items[row[0]], row[1:])
+    return items
+
+  def get_updated_to(self):
+    """Returns the updated_to date ordinal of the symbol, or None if it is not in the cache."""
+    row = self.connection.execute('SELECT updated_to FROM symbols WHERE symbol = ?',
+                                  (self.symbol,)).fetchone()
+    if row is None:
+      return None
+    return row[0]
+
+  def update_symbol(self, updated_to):
+    """Brings the cache of the symbol up to date, given its updated_to, or None if it has none."""
+    if updated_to is None or self.session.toordinal() > updated_to:
+      if updated_to is None or not self.refresh_symbol(updated_to):
+        self.add_symbol()
+
+  def add_symbol(self):
+    """Replaces the cached days of the symbol with its full history, in one transaction."""
+    eod = Config().CACHE_END_OF_DAY_SOURCE_CLASS(self.symbol, date(1900,1,1), self.session)
+    with self.connection:
+      self.connection.execute('DELETE FROM prices WHERE symbol = ?', (self.symbol,))
+      self.write_prices(eod, 0)
+      self.set_updated_to(eod)
+
+  def refresh_symbol(self, updated_to):
+    """Adds the days after the given updated_to date ordinal to the cache.
+
+    The last djscrooge.config.Config.CACHE_REFRESH_OVERLAP_DAYS cached days are fetched again
+    from the source, from the first of them which is not a split-only day, and compared with
+    the cache. Returns False, without changing the cache,
+    if the source has rewritten those days. In that case the full history must be reloaded.
+    """
+    cached = EndOfDay(self.symbol, None, None)
+    rows = self.connection.execute(
+      'SELECT ' + PRICE_COLUMNS + ' FROM prices WHERE symbol = ? AND date <= ? '
+      'ORDER BY date DESC LIMIT ?', (self.symbol, updated_to, Config().CACHE_REFRESH_OVERLAP_DAYS))
+    for row in reversed(rows.fetchall()):
+      append_price_row(cached, row)
+    if len(cached.dates) == 0:
+      return False
+    held_days = len(cached.dates)
+    first = cached.get_first_trading_index()
+    if first is None:
+      return False
+    eod = Config().CACHE_END_OF_DAY_SOURCE_CLASS(self.symbol, cached.dates[first], self.session)
+    if not cached.merge_tail(eod):
+      return False
+    with self.connection:
+      self.write_prices(cached, held_days)
+      self.set_updated_to(cached)
+    return True
+
+  def remove_symbol(self):
+    """Removes the symbol from the cache."""
+    with self.connection:
+      self.connection.execute('DELETE FROM prices WHERE symbol = ?', (self.symbol,))
+      self.connection.execute('DELETE FROM symbols WHERE symbol = ?', (self.symbol,))
+
+  def read_prices(self, eod, start_ordinal, end_ordinal):
+    """Appends the cached days between the given date ordinals, inclusive, to the EndOfDay object."""
+    rows = self.connection.execute(
+      'SELECT ' + PRICE_COLUMNS + ' FROM prices WHERE symbol = ? AND date BETWEEN ? AND ? '
+      'ORDER BY date', (self.symbol, start_ordinal, end_ordinal))
+    for row in rows:
+      append_price_row(eod, row)
+
+  def write_prices(self, eod, start_index):
+    """Writes the days of the EndOfDay object from start_index on with one executemany call.
+
+    This must be called inside a transaction.
+    """
+    self.connection.executemany(
+      'INSERT OR REPLACE INTO prices (symbol, ' + PRICE_COLUMNS + ') '
+      'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+      (get_price_row(self.symbol, eod, i) for i in xrange(start_index, len(eod.dates))))
+
+  def set_updated_to(self, eod):
+    """Records the symbol as up to date with the session, given the EndOfDay object stored.
+
+    This must be called inside a transaction.
+    """
+    last_session = None
+    if len(eod.dates) > 0:
+      last_session = eod.dates[-1].toordinal()
+    self.connection.execute(
+      'INSERT OR REPLACE INTO symbols (symbol, updated_to, last_session) VALUES (?, ?, ?)',
+      (self.symbol, self.session.toordinal(), last_session))
+
+
+def get_price_row(symbol, eod, i):
+  """Returns the prices table row of day i of the EndOfDay object."""
+  split = eod.splits[i]
+  if split is None:
+    (numerator, denominator) = (None, None)
+  else:
+    (numerator, denominator) = (split.numerator, split.denominator)
+  return (symbol, eod.dates[i].toordinal(), eod.open_prices[i], eod.high_prices[i],
+          eod.low_prices[i], eod.close_prices[i], eod.adj_close_prices[i], eod.volumes[i],
+          eod.dividends[i], numerator, denominator)
+
+def append_price_row(eod, row):
+  """Appends a row of the prices table, without its symbol, to the EndOfDay object."""
+  (ordinal, open_price, high, low, close, adj_close, volume, dividend, numerator, denominator) = row
+  eod.dates.append(date.fromordinal(ordinal))
+  eod.open_prices.append(open_price)
+  eod.high_prices.append(high)
+  eod.low_prices.append(low)
+  eod.close_prices.append(close)
+  eod.adj_close_prices.append(adj_close)
+  eod.volumes.append(volume)
+  eod.dividends.append(dividend)
+  if numerator is None:
+    eod.splits.append(None)
+  else:
+    eod.splits.append(Split(numerator, denominator))
+
+def warm_cache(symbol, end_date):
+  """Warm the cache with the given symbol, up to the given end date."""
+  SqliteCache(symbol, date(1900,1,1), end_date)
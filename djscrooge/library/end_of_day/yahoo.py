@@ -19,9 +19,23 @@ Copyright (C) 2012  James Adam Cataldo
 
 from djscrooge.backtest import EndOfDay
 from djscrooge.backtest import Split
+from djscrooge.util.http_pool import PersistentHttpClient, backoff_delay
 from urllib2 import urlopen
 from datetime import date
 from time import sleep
+from collections import namedtuple
+from bisect import bisect_right
+from multiprocessing.pool import ThreadPool
+import numpy
+
+ICHART_URL = 'http://ichart.yahoo.com'
+QUOTES_URL = 'http://finance.yahoo.com'
+MAX_QUOTES_PER_REQUEST = 200
+
+ORDINAL_OF_UNIX_EPOCH = date(1970, 1, 1).toordinal()
+
+PriceColumns = namedtuple('PriceColumns', ['date_ordinals', 'open_prices', 'high_prices', 'low_prices',
+                                           'close_prices', 'adj_close_prices', 'volumes'])
 
 def robust_urlopen(url):
   for i in [0, 1, 2]:
@@ -31,7 +45,7 @@ def robust_urlopen(url):
     except Exception, e:
       i = i + 1
       if i < 3:
-        sleep(i)
+        sleep(backoff_delay(i))
       else:
         raise e
   
@@ -65,89 +79,287 @@ class HeadingCsv(object):
       result[self.headings[i]] = data[i]
     return result
 
+def parse_price_csv(file_handle):
+  """Parses a Yahoo price CSV file into a PriceColumns tuple of numpy int64 arrays.
+  
+  The file is read in one buffer, and each column is converted with a single numpy call.
+  Rows are returned in chronological order, while Yahoo lists the newest row first. Dates are
+  given as ordinals, as returned by datetime.date.toordinal. Prices are converted to cents by
+  removing the decimal point, as Yahoo always reports two decimal places.
+  
+  Raises IOError if a row does not have one field per heading, and ValueError if a field is
+  not a date or a number, so a malformed file never yields misaligned columns.
+  """
+  text = file_handle.read().replace('\r', '')
+  newline = text.find('\n')
+  if newline < 0:
+    newline = len(text)
+  headings = text[0:newline].split(',')
+  if headings == ['']:
+    raise IOError('No heading column found.')
+  body = text[newline+1:].strip()
+  width = len(headings)
+  if body == '':
+    rows = 0
+    fields = []
+  else:
+    check_field_counts(body, width)
+    rows = body.count('\n') + 1
+    fields = body.replace('\n', ',').split(',')
+  def column(heading):
+    values = fields[headings.index(heading)::width]
+    values.reverse()
+    return values
+  def integers(heading):
+    values = numpy.fromstring(','.join(column(heading)).replace('.', ''), dtype=numpy.int64, sep=',')
+    if len(values) != rows:
+      raise ValueError('Expected %d numbers in the %s column, but only the first %d could be read.' % 
+                       (rows, heading, len(values)))
+    return values
+  return PriceColumns(numpy.array(column('Date'), dtype='datetime64[D]').astype(numpy.int64) + 
+                      ORDINAL_OF_UNIX_EPOCH,
+                      integers('Open'),
+                      integers('High'),
+                      integers('Low'),
+                      integers('Close'),
+                      integers('Adj Close'),
+                      integers('Volume'))
+
+def check_field_counts(body, width):
+  """Raises IOError if a line of the body of a CSV file does not have the given number of fields.
+  
+  The commas of every line are counted in one pass over the body, with numpy.
+  """
+  characters = numpy.frombuffer(body, dtype=numpy.uint8)
+  commas = numpy.flatnonzero(characters == ord(','))
+  ends = numpy.flatnonzero(characters == ord('\n'))
+  counts = numpy.diff(numpy.concatenate([[0], numpy.searchsorted(commas, ends), [len(commas)]]))
+  wrong = numpy.flatnonzero(counts != width - 1)
+  if len(wrong) > 0:
+    raise IOError('Expected %d fields on line %d, but found %d.' % 
+                  (width, wrong[0] + 2, counts[wrong[0]] + 1))
+
+def parse_corporate_actions(file_handle):
+  """Parses a Yahoo dividend and split file into (dividends, splits).
+  
+  dividends -- A list of (datetime.date, dividend) tuples, with dividends in cents.
+  splits -- A list of (datetime.date, Split) tuples.
+  """
+  dividends = []
+  splits = []
+  for line in file_handle:
+    parts = line.split(',')
+    if parts[0] == 'DIVIDEND':
+      datestr = parts[1].strip()
+      dateobj = date(int(datestr[0:4]), int(datestr[4:6]), int(datestr[6:]))
+      dividends.append((dateobj, float(parts[2].strip()) * 100))
+    elif parts[0] == 'SPLIT':
+      datestr = parts[1].strip()
+      dateobj = date(int(datestr[0:4]), int(datestr[4:6]), int(datestr[6:]))
+      split = parts[2].strip().split(':')
+      splits.append((dateobj, Split(int(split[0]), int(split[1]))))
+  return (dividends, splits)
+
 class Yahoo(EndOfDay):
   """An EndOfDay object using Yahoo's REST API."""
   
-  def __init__(self, symbol, start_date, end_date):
-    """Construct a new Yahoo EndOfDay object."""
+  def __init__(self, symbol, start_date, end_date, fetch=robust_urlopen, base_url=ICHART_URL):
+    """Construct a new Yahoo EndOfDay object.
+    
+    fetch -- The function returning a file object with the response to a url.
+    base_url -- The scheme and host of Yahoo's historical price service.
+    """
     self.symbol = symbol
+    self.fetch = fetch
+    self.base_url = base_url
     super(Yahoo, self).__init__(symbol, start_date, end_date)
-    url = 'http://ichart.yahoo.com/table.csv?s=' + symbol
+    url = base_url + '/table.csv?s=' + symbol
     url += '&a={0}&b={1}&c={2}'.format(start_date.month - 1, start_date.day, start_date.year)
     url += '&d={0}&e={1}&f={2}'.format(end_date.month - 1, end_date.day, end_date.year)
-    data = robust_urlopen(url)
-    csv = HeadingCsv(data)
-    for line in csv:
-      dateparts = line['Date'].split('-')
-      self.dates.append(date(int(dateparts[0]), int(dateparts[1]), int(dateparts[2])))
-      self.open_prices.append(int(line['Open'].replace('.', '')))
-      self.high_prices.append(int(line['High'].replace('.', '')))
-      self.low_prices.append(int(line['Low'].replace('.', '')))
-      self.close_prices.append(int(line['Close'].replace('.', '')))
-      self.adj_close_prices.append(int(line['Adj Close'].replace('.', '')))
-      self.volumes.append(int(line['Volume']))
-    self.open_prices.reverse()
-    self.high_prices.reverse()
-    self.low_prices.reverse()
-    self.close_prices.reverse()
-    self.adj_close_prices.reverse()
-    self.dates.reverse()
-    self.volumes.reverse()
+    data = fetch(url)
+    columns = parse_price_csv(data)
+    self.dates = map(date.fromordinal, columns.date_ordinals.tolist())
+    self.open_prices = columns.open_prices.tolist()
+    self.high_prices = columns.high_prices.tolist()
+    self.low_prices = columns.low_prices.tolist()
+    self.close_prices = columns.close_prices.tolist()
+    self.adj_close_prices = columns.adj_close_prices.tolist()
+    self.volumes = columns.volumes.tolist()
     url = url.replace('table.csv', 'x')
     url += '&g=v&y=0'
-    data = robust_urlopen(url)
-    self.dividends = [None] * len(self.dates)
-    self.splits = [None] * len(self.dates)
-    for line in data:
-      parts = line.split(',')
-      if parts[0] == 'DIVIDEND':
-        datestr = parts[1].strip()
-        dateobj = date(int(datestr[0:4]), int(datestr[4:6]), int(datestr[6:]))
-        dividend = float(parts[2].strip()) * 100
-        self.dividends[self.get_index_from_date(dateobj)] = dividend
-      elif parts[0] == 'SPLIT':
-        datestr = parts[1].strip()
-        dateobj = date(int(datestr[0:4]), int(datestr[4:6]), int(datestr[6:]))
-        split = parts[2].strip().split(':')
-        try:
-          self.splits[self.get_index_from_date(dateobj)] = Split(int(split[0]), int(split[1]))
-        except TypeError:
-          if len(self.dates) > 0 and self.dates[0] < dateobj:
-            array_index = 1
-            while array_index < len(self.dates):
-              if self.dates[array_index] > dateobj:
-                break
-              else:
-                array_index += 1
-            ratio = int(split[1]) * 1.0 / int(split[0])
-            synthetic_price = int(self.close_prices[array_index - 1] * ratio)
-            self.dates.insert(array_index, dateobj)
-            self.open_prices.insert(array_index, synthetic_price)
-            self.high_prices.insert(array_index, synthetic_price)
-            self.low_prices.insert(array_index, synthetic_price)
-            self.close_prices.insert(array_index, synthetic_price)
-            self.adj_close_prices.insert(array_index, synthetic_price)
-            self.volumes.insert(array_index, 0)
-            self.dividends.insert(array_index, None)
-            self.splits.insert(array_index, Split(int(split[0]), int(split[1])))
-            self.initialize_date_index()
-          else:
-            raise
+    data = fetch(url)
+    (dividends, splits) = parse_corporate_actions(data)
+    self.merge_corporate_actions(dividends, splits)
+    
+  def update(self, end_date, overlap=5):
+    """Extends this object with the days after its last date, up to the given end_date.
+    
+    end_date -- The datetime.date object of the new last date to observe.
+    overlap -- The number of days already held to request again, to check for changes. This
+               must be at least 1, since the tail must overlap the days held.
+    
+    Only the missing days, plus the overlapping days, are requested from Yahoo. Yahoo adjusts
+    past prices when new dividends and splits occur, so if any overlapping day no longer matches
+    the data held, nothing is merged. Returns True if this object was extended, or False if the
+    full history should be downloaded again.
+    """
+    if overlap < 1:
+      raise ValueError('The overlap must be at least one day.')
+    if len(self.dates) == 0:
+      return False
+    start_date = self.dates[-min(overlap, len(self.dates))]
+    tail = Yahoo(self.symbol, start_date, end_date, fetch=self.fetch, base_url=self.base_url)
+    return self.merge_tail(tail)
+    
+  def merge_corporate_actions(self, dividends, splits):
+    """Merges dividend and split events into the price columns in one sorted pass.
+    
+    dividends -- A list of (datetime.date, dividend) tuples, with dividends in cents.
+    splits -- A list of (datetime.date, Split) tuples.
+    
+    A split falling on a day with no price data gets a synthetic row, priced at the previous
+    close adjusted by the split, with no volume. The synthetic rows are built in date order, so
+    when several fall between the same two trading days, each is priced from the synthetic row
+    before it, whatever the order of the events in the file. The date index is built once,
+    after all the synthetic rows are merged in.
+    """
+    n = len(self.dates)
+    self.dividends = [None] * n
+    self.splits = [None] * n
+    index = dict(zip(self.dates, range(0, n)))
+    synthetic_splits = []
+    for (dateobj, split) in splits:
+      if index.has_key(dateobj):
+        self.splits[index[dateobj]] = split
+      elif n > 0 and self.dates[0] < dateobj:
+        synthetic_splits.append((dateobj, split))
+      else:
+        raise TypeError('No price data for the split on ' + str(dateobj) + '.')
+    if len(synthetic_splits) > 0:
+      synthetic_splits.sort(key=lambda event: event[0])
+      columns = [self.dates, self.open_prices, self.high_prices, self.low_prices, self.close_prices,
+                 self.adj_close_prices, self.volumes, self.dividends, self.splits]
+      merged = [[] for column in columns]
+      last_position = 0
+      for (dateobj, split) in synthetic_splits:
+        position = bisect_right(self.dates, dateobj)
+        if position > last_position:
+          close_price = self.close_prices[position - 1]
+          for (merged_column, column) in zip(merged, columns):
+            merged_column.extend(column[last_position:position])
+          last_position = position
+        ratio = split.denominator * 1.0 / split.numerator
+        synthetic_price = int(close_price * ratio)
+        row = [dateobj] + [synthetic_price] * 5 + [0, None, split]
+        for (merged_column, value) in zip(merged, row):
+          merged_column.append(value)
+        close_price = synthetic_price
+      for (merged_column, column) in zip(merged, columns):
+        merged_column.extend(column[last_position:])
+      (self.dates, self.open_prices, self.high_prices, self.low_prices, self.close_prices,
+       self.adj_close_prices, self.volumes, self.dividends, self.splits) = merged
+    self.initialize_date_index()
+    for (dateobj, dividend) in dividends:
+      i = self.get_index_from_date(dateobj)
+      if i is None:
+        raise TypeError('No price data for the dividend on ' + str(dateobj) + '.')
+      self.dividends[i] = dividend
           
   def get_current_price_and_market_cap(self):
-    """Return the latest (price, market_cap) from Yahoo. Both are reported 
-    in dollar amounts, given as floats.
+    """Return the latest (price, market_cap) from Yahoo. The price is 
+    in cents and the market cap in dollars, both given as floats.
     """
-    url = 'http://finance.yahoo.com/d/quotes.csv?s=%s&f=l1j1' % self.symbol
-    f = robust_urlopen(url)
-    data = f.read()
-    parts = data.split(',')
-    price = float(parts[0].replace('.', ''))
-    parts[1] = parts[1].strip()
-    if parts[1].endswith('M'):
-      market_cap = float(parts[1][0:-1]) * 1.0e6
-    elif parts[1].endswith('B'):
-      market_cap = float(parts[1][0:-1]) * 1.0e9
-    else:
-      market_cap = float(parts[1])
-    return (price, market_cap)
\ No newline at end of file
+    (prices, market_caps) = get_current_prices_and_market_caps([self.symbol], self.fetch)
+    return (prices[0], market_caps[0])
+
+def get_current_prices_and_market_caps(symbols, fetch=robust_urlopen, base_url=QUOTES_URL, 
+                                       batch_size=MAX_QUOTES_PER_REQUEST):
+  """Returns the latest (prices, market_caps) of many symbols from Yahoo's quote service.
+  
+  symbols -- The list of ticker symbols.
+  fetch -- The function returning a file object with the response to a url.
+  base_url -- The scheme and host of Yahoo's quote service.
+  batch_size -- The most symbols to request at once.
+  
+  The symbols are requested batch_size at a time, and no historical data is loaded. The prices
+  and market_caps are numpy float arrays in the order of the symbols. Prices are in cents, and
+  market caps are in dollars. Values Yahoo does not report are NaN.
+  """
+  n = len(symbols)
+  prices = numpy.empty(n)
+  market_caps = numpy.empty(n)
+  for start in range(0, n, batch_size):
+    batch = symbols[start:start+batch_size]
+    url = base_url + '/d/quotes.csv?s=%s&f=l1j1' % '+'.join(batch)
+    lines = fetch(url).read().strip().splitlines()
+    if len(lines) != len(batch):
+      raise IOError('Expected %d quotes, but received %d.' % (len(batch), len(lines)))
+    for i in range(0, len(batch)):
+      (prices[start+i], market_caps[start+i]) = parse_quote(lines[i])
+  return (prices, market_caps)
+
+def parse_quote(line):
+  """Parses a line of the form 'price,market_cap' from Yahoo's quote service.
+  
+  Returns (price, market_cap), with the price in cents and the market cap in dollars, both as
+  floats. A market cap may be suffixed with M or B, for millions or billions. Values reported
+  as N/A are NaN.
+  """
+  parts = line.split(',')
+  price = parts[0].strip()
+  if price == 'N/A':
+    price = float('nan')
+  else:
+    price = float(price.replace('.', ''))
+  market_cap = parts[1].strip()
+  if market_cap == 'N/A':
+    market_cap = float('nan')
+  elif market_cap.endswith('M'):
+    market_cap = float(market_cap[0:-1]) * 1.0e6
+  elif market_cap.endswith('B'):
+    market_cap = float(market_cap[0:-1]) * 1.0e9
+  else:
+    market_cap = float(market_cap)
+  return (price, market_cap)
+
+def download_symbols(symbols, start_date, end_date, workers=8, requests_per_second=10.0, 
+                     base_url=ICHART_URL, callback=None):
+  """Downloads Yahoo EndOfDay objects for many symbols concurrently.
+  
+  symbols -- The list of ticker symbols.
+  start_date -- The datetime.date object of the first date to download.
+  end_date -- The datetime.date object of the last date to download.
+  workers -- The number of worker threads.
+  requests_per_second -- The most requests per second to the Yahoo host, over all workers.
+  base_url -- The scheme and host of Yahoo's historical price service.
+  callback -- A function called with (symbol, eod, error) as each symbol finishes, where eod is
+              the Yahoo object, or None if the download failed with the given error.
+  
+  Each worker thread keeps a persistent connection to Yahoo, which is closed once all the
+  symbols are done, and failed requests are retried with exponential backoff and jitter. Each
+  symbol is parsed by its worker as soon as its responses arrive. Returns (results, failures),
+  where results maps each downloaded symbol to its Yahoo object and failures maps each failed
+  symbol to its exception.
+  """
+  client = PersistentHttpClient(requests_per_second)
+  def download(symbol):
+    try:
+      return (symbol, Yahoo(symbol, start_date, end_date, fetch=client.get, base_url=base_url), None)
+    except Exception, e:
+      return (symbol, None, e)
+  results = {}
+  failures = {}
+  pool = ThreadPool(workers)
+  try:
+    for (symbol, eod, error) in pool.imap_unordered(download, symbols):
+      if eod is None:
+        failures[symbol] = error
+      else:
+        results[symbol] = eod
+      if callback is not None:
+        callback(symbol, eod, error)
+  finally:
+    pool.close()
+    pool.join()
+    client.close()
+  return (results, failures)
@@ -17,80 +17,58 @@ Copyright (C) 2012  James Adam Cataldo
     along with Pengoe.  If not, see <http://www.gnu.org/licenses/>.
 """
 from djscrooge.backtest import Strategy
-from djscrooge.config import Config
-from datetime import timedelta, date
+from djscrooge.cross_section import UniversePanel
+from djscrooge.library.end_of_day.cache_warmer import read_universe
+from datetime import timedelta
 import os
-from collections import namedtuple
-from djscrooge.library.end_of_day.mongodb_cache import warm_cache
-from bson.code import Code
-
-DailyReturn = namedtuple('DailyReturn', ['percentage', 'symbol'])
 
 class BiggestLoser(Strategy):
+  """Holds the S&P 500 constituent which lost the most, from open to close, the previous day.
   
-  def after_initialization(self):
+  The universe is loaded as a UniversePanel with the backtest's end_of_day_class, so this
+  works with any EndOfDay source. For a cache, warm the universe first with:
+    python -m djscrooge.library.end_of_day.cache_warmer djscrooge/library/strategy/s_p_500_constituents END_DATE
+  """
+  
+  def get_symbols(self):
+    """Returns the ticker symbols of the universe."""
     pwd = os.path.dirname(__file__)
-    symbols = []
-    errors = 0.0
-    with open(pwd + '/s_p_500_constituents') as f:
-      for line in f:
-        symbol = line.strip()
-        if symbol != '':
-          try:
-            warm_cache(symbol, self.backtest.end_date)
-            symbols.append(symbol)
-          except:
-            errors = errors + 1.0
-    mapper = Code("""
-    function () {
-      loss = this.open - this.close
-      emit(this.date, { "loss" : loss, "symbol" : this.symbol });
-    }
-    """)
-    reducer = Code("""
-    function (key, values) {
-      result = { "loss" : -Infinity, "symbol" : "NONE" };
-      for (var i = 0; i < values.length; i++) {
-        if (values[i].loss > result.loss) {
-          result.loss = values[i].loss;
-          result.symbol = values[i].symbol;
-        }
-      }
-      return result;
-    }
-    """)
-    connection = Config().MONGODB_CONNECTION
-    db = connection.djscrooge
-    query = { 'symbol' : {'$in' : symbols}, 
-             'date': {'$gte' : (self.backtest.start_date - timedelta(14)).toordinal(),
-                      '$lte' : self.backtest.end_date.toordinal()}}
-    results = db.prices.map_reduce(mapper, reducer, 'biggest_loser', query=query)
-    last = None
+    return read_universe(pwd + '/s_p_500_constituents')
+  
+  def after_initialization(self):
+    symbols = self.get_symbols()
+    backtest = self.backtest
+    self.panel = UniversePanel.load(backtest.end_of_day_class, symbols, 
+                                    backtest.start_date - timedelta(14), backtest.end_date)
+    losers = self.panel.rank(lambda panel: panel.get('open') - panel.get('close'), 1)
     self.biggest_losers = {}
-    for result in results.find():
-      if last is None:
-        last = result
-      else:
-        key = date.fromordinal(int(result['_id']))
-        symbol = last['value']['symbol']
-        self.biggest_losers[key] = symbol
-        last = result
+    dates = self.panel.dates
+    for i in range(1, len(dates)):
+      if len(losers[dates[i - 1]]) > 0:
+        self.biggest_losers[dates[i]] = losers[dates[i - 1]][0]
     self.holding = None
+    
+  def get_open_price(self, symbol, t):
+    """Returns the open price of the symbol on day t, or None if it did not trade."""
+    eod = self.panel.get_end_of_day(symbol)
+    i = eod.get_index_from_date(t)
+    if i is None:
+      return None
+    return eod.open_prices[i]
   
   def execute(self):
     backtest = self.backtest
     t = backtest.simulation_date
-    if self.holding != self.biggest_losers[t]:
+    target = self.biggest_losers.get(t)
+    if target is not None and self.holding != target:
       if self.holding is not None:
-        open_prices = backtest.end_of_day_class(self.holding, t, t).open_prices
-        if len(open_prices) != 0:
-          price = open_prices[0]
+        price = self.get_open_price(self.holding, t)
+        if price is not None:
           for position in backtest.portfolio.get_positions(self.holding):
             shares = position.remaining_shares
             backtest.sell_shares(self.holding, shares, price)
-      self.holding = self.biggest_losers[t]
-      eod = backtest.end_of_day_class(self.holding, t, t)
-      if len(eod.open_prices) > 0:
-        price = eod.open_prices[0]
+      self.holding = target
+      price = self.get_open_price(self.holding, t)
+      if price is not None:
         shares = int(backtest.portfolio.cash / price)
         backtest.buy_shares(self.holding, shares, price)
@@ -17,7 +17,9 @@ Copyright (C) 2012  James Adam Cataldo
     along with Pengoe.  If not, see <http://www.gnu.org/licenses/>.
 """
 from copy import copy
-from numpy import mean
+from numpy import asarray, atleast_2d, concatenate, cumsum, zeros, empty, \
+  sqrt, errstate, nan, where, sign
+import numpy
 from math import log
 from scipy.stats.stats import linregress
 
@@ -119,27 +121,124 @@ def accumulation_distribution_volume(high_prices, low_prices, close_prices, volu
     
   The ADV is then the volume times the range factor.
   """
-  n = len(high_prices)
-  result = [0.0] * n
-  for i in range(0, n):
-    if high_prices[i] > low_prices[i]:
-      range_factor = ((close_prices[i] - low_prices[i]) - (high_prices[i] - close_prices[i])) * 1.0 / (high_prices[i] - low_prices[i])
-    else:
-      range_factor = 0.0
-    result[i] = range_factor * volumes[i]
-  return result
+  pipeline = IndicatorPipeline(high=high_prices, low=low_prices, close=close_prices, volume=volumes)
+  return pipeline.get('accumulation_distribution_volume').tolist()
 
 def money_flow(high_prices, low_prices, close_prices, volumes):
   """Returns the money flow for each day. 
   
   This is the ADV multiplied by the average of high, low, and close prices.
   """
-  result = accumulation_distribution_volume(high_prices, low_prices, close_prices, volumes)
-  n = len(result)
-  for i in range(0, n):
-    result[i] *= mean([high_prices[i], low_prices[i], close_prices[i]])
+  pipeline = IndicatorPipeline(high=high_prices, low=low_prices, close=close_prices, volume=volumes)
+  return pipeline.get('money_flow').tolist()
+
+class IndicatorPipeline(object):
+  """Computes indicators over end-of-day data, sharing intermediate series between them.
+  
+  Every indicator is declared with a function and the names of the series it depends on.
+  When an indicator is requested, its dependencies are computed first. Each series is
+  computed at most once per pipeline, as a vectorized pass over numpy arrays, and reused by
+  everything that depends on it.
+  
+  The base series are the end-of-day columns: open, high, low, close, adj_close, and volume.
+  The built-in indicators are:
+    typical_price -- The average of the high, low, and close prices.
+    price_range -- The high price minus the low price.
+    range_factor -- [(close - low) - (high - close)]/(high - low), or 0.0 when there is no range.
+    log_returns -- ln(close[i] / close[i-1]), with 0.0 on the first day.
+    volume_deltas -- volume[i] - volume[i-1], with 0 on the first day.
+    accumulation_distribution_volume -- The volume times the range factor.
+    money_flow -- The accumulation/distribution volume times the typical price.
+    on_balance_volume -- The volume signed by the direction of the close price.
+    negative_volume_index -- The daily return, as a percentage, on days the volume declined.
+  """
+  
+  definitions = {}
+  
+  @classmethod
+  def declare(cls, name, function, *dependencies):
+    """Declare an indicator available to every pipeline.
+    
+    name -- The name of the indicator.
+    function -- A function taking the dependency series, as numpy arrays, in order.
+    *dependencies -- The names of the series the indicator is computed from.
+    """
+    cls.definitions[name] = (function, dependencies)
+  
+  def __init__(self, end_of_day=None, **columns):
+    """Construct a pipeline from an EndOfDay object, or from the given columns.
+    
+    end_of_day -- The EndOfDay object supplying the base series.
+    **columns -- Base series given directly as lists, overriding those of end_of_day.
+    """
+    self.__series = {}
+    self.__definitions = dict(IndicatorPipeline.definitions)
+    if end_of_day is not None:
+      self.__series['open'] = asarray(end_of_day.open_prices)
+      self.__series['high'] = asarray(end_of_day.high_prices)
+      self.__series['low'] = asarray(end_of_day.low_prices)
+      self.__series['close'] = asarray(end_of_day.close_prices)
+      self.__series['adj_close'] = asarray(end_of_day.adj_close_prices)
+      self.__series['volume'] = asarray(end_of_day.volumes)
+    for name in columns:
+      self.__series[name] = asarray(columns[name])
+      
+  def define(self, name, function, *dependencies):
+    """Declare an indicator available only to this pipeline, with the same arguments as declare."""
+    self.__definitions[name] = (function, dependencies)
+  
+  def get(self, name):
+    """Returns the named series as a numpy array, computing it and its dependencies if needed."""
+    if not self.__series.has_key(name):
+      if not self.__definitions.has_key(name):
+        raise KeyError('No series or indicator named ' + name + '.')
+      (function, dependencies) = self.__definitions[name]
+      self.__series[name] = function(*[self.get(x) for x in dependencies])
+    return self.__series[name]
+  
+  def evaluate(self, *names):
+    """Returns a tuple of the named series, sharing any intermediate series between them."""
+    return tuple([self.get(name) for name in names])
+
+def _range_factor(high, low, close):
+  with errstate(divide='ignore', invalid='ignore'):
+    factor = ((close - low) - (high - close)) * 1.0 / (high - low)
+  return where(high > low, factor, 0.0)
+
+def _log_returns(close):
+  result = zeros(len(close))
+  result[1:] = numpy.log(close[1:] * 1.0 / close[:-1])
+  return result
+
+def _volume_deltas(volume):
+  result = zeros(len(volume), dtype=volume.dtype)
+  result[1:] = volume[1:] - volume[:-1]
+  return result
+
+def _on_balance_volume(close, volume):
+  result = zeros(len(close), dtype=volume.dtype)
+  result[1:] = sign(close[1:] - close[:-1]) * volume[1:]
   return result
 
+def _negative_volume_index(close, volume):
+  result = zeros(len(close))
+  declining = volume[1:] < volume[:-1]
+  result[1:][declining] = (close[1:][declining] * 1.0 / close[:-1][declining] - 1.0) * 100.0
+  return result
+
+IndicatorPipeline.declare('typical_price', lambda high, low, close: (high + low + close) / 3.0,
+                          'high', 'low', 'close')
+IndicatorPipeline.declare('price_range', lambda high, low: high - low, 'high', 'low')
+IndicatorPipeline.declare('range_factor', _range_factor, 'high', 'low', 'close')
+IndicatorPipeline.declare('log_returns', _log_returns, 'close')
+IndicatorPipeline.declare('volume_deltas', _volume_deltas, 'volume')
+IndicatorPipeline.declare('accumulation_distribution_volume', lambda factor, volume: factor * volume,
+                          'range_factor', 'volume')
+IndicatorPipeline.declare('money_flow', lambda adv, typical_price: adv * typical_price,
+                          'accumulation_distribution_volume', 'typical_price')
+IndicatorPipeline.declare('on_balance_volume', _on_balance_volume, 'close', 'volume')
+IndicatorPipeline.declare('negative_volume_index', _negative_volume_index, 'close', 'volume')
+
 def negative_volume_index(prices, volumes):
   """Returns the negative volume index for each day.
   
@@ -210,4 +309,69 @@ def capm(investment, market, risk_free_return=0):
   r = x[2]
   return (alpha, beta, r)
   
-  
\ No newline at end of file
+  
+
+def rolling_capm(investments, market, windows, risk_free_return=0):
+  """Computes rolling CAPM parameters, using log returns, of many investments over the market.
+  
+  investments -- The daily prices of the investments under analysis, given as a list with one
+                 price list per investment. Each price list must be the same length as market.
+  market -- The daily prices of the market investment.
+  windows -- The number of daily returns in each regression, or a list of such window lengths.
+  risk_free_return -- The risk-free return, given as a fraction, with the same meaning as in capm.
+  
+  Returns (alpha, beta, r), each a numpy array indexed as [window][investment][day]. When windows
+  is a single number, the window axis is dropped. Day i holds the regression over the window of
+  log returns ending with ln(price[i+1] / price[i]), so there is one fewer day than there are
+  prices. Days before a full window is available are NaN.
+  
+  The regressions are computed from running sums, so each day costs O(1) for any window length.
+  """
+  single_window = not hasattr(windows, '__iter__')
+  if single_window:
+    windows = [windows]
+  alr = log(1.0 + risk_free_return)
+  investment_prices = atleast_2d(asarray(investments, dtype=float))
+  market_prices = asarray(market, dtype=float)
+  y = numpy.log(investment_prices[:, 1:] / investment_prices[:, :-1]) - alr
+  x = numpy.log(market_prices[1:] / market_prices[:-1]) - alr
+  (m, n) = y.shape
+  # Centering the series first keeps the running sums from losing precision over long histories.
+  x_center = x.mean() if n > 0 else 0.0
+  y_center = y.mean(axis=1) if n > 0 else zeros(m)
+  x = x - x_center
+  y = y - y_center[:, None]
+  def running(values):
+    return concatenate((zeros(values.shape[:-1] + (1,)), cumsum(values, axis=-1)), axis=-1)
+  sum_x = running(x)
+  sum_xx = running(x * x)
+  sum_y = running(y)
+  sum_yy = running(y * y)
+  sum_xy = running(y * x)
+  alpha = empty((len(windows), m, n))
+  beta = empty((len(windows), m, n))
+  r = empty((len(windows), m, n))
+  alpha.fill(nan)
+  beta.fill(nan)
+  r.fill(nan)
+  for (k, window) in enumerate(windows):
+    if window < 2:
+      raise ValueError('The regression window must contain at least two returns.')
+    if window > n:
+      continue
+    sx = sum_x[window:] - sum_x[:-window]
+    sxx = sum_xx[window:] - sum_xx[:-window]
+    sy = sum_y[:, window:] - sum_y[:, :-window]
+    syy = sum_yy[:, window:] - sum_yy[:, :-window]
+    sxy = sum_xy[:, window:] - sum_xy[:, :-window]
+    covariance = sxy - sx * sy / window
+    x_variance = sxx - sx * sx / window
+    y_variance = syy - sy * sy / window
+    with errstate(divide='ignore', invalid='ignore'):
+      b = covariance / x_variance
+      beta[k, :, window-1:] = b
+      alpha[k, :, window-1:] = (sy / window + y_center[:, None]) - b * (sx / window + x_center)
+      r[k, :, window-1:] = covariance / sqrt(x_variance * y_variance)
+  if single_window:
+    return (alpha[0], beta[0], r[0])
+  return (alpha, beta, r)
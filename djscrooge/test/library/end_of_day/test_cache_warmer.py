@@ -0,0 +1,85 @@
+"""This file contains the test_cache_warmer module of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies: 
+    proboscis: <https://github.com/rackspace/python-proboscis>
+"""
+from proboscis import test
+from proboscis.asserts import assert_equal
+from proboscis.asserts import assert_true
+from djscrooge.backtest import EndOfDay
+from djscrooge.library.end_of_day.cache_warmer import warm_universe, read_universe
+from datetime import date
+from threading import Lock
+from time import sleep
+import os
+import shutil
+import tempfile
+
+class SlowEndOfDay(EndOfDay):
+  """An EndOfDay class which takes a moment per symbol, fails for symbols starting with X, and
+  tracks how many objects are being created at once."""
+  
+  lock = Lock()
+  active = 0
+  most_active = 0
+  
+  def __init__(self, symbol, start_date, end_date):
+    super(SlowEndOfDay, self).__init__(symbol, start_date, end_date)
+    with SlowEndOfDay.lock:
+      SlowEndOfDay.active += 1
+      SlowEndOfDay.most_active = max(SlowEndOfDay.most_active, SlowEndOfDay.active)
+    try:
+      sleep(0.01)
+      if symbol.startswith('X'):
+        raise IOError('No data for ' + symbol + '.')
+    finally:
+      with SlowEndOfDay.lock:
+        SlowEndOfDay.active -= 1
+
+@test
+def test_warm_universe():
+  """Test that warm_universe bounds its parallelism, reports progress and records failures."""
+  directory = tempfile.mkdtemp()
+  try:
+    universe_path = os.path.join(directory, 'universe')
+    with open(universe_path, 'w') as f:
+      f.write('# Test universe\nAAA\nXBB\n\nCCC  # comment\nXDD\nEEE\nFFF\nAAA\n')
+    blacklist_path = os.path.join(directory, 'blacklist')
+    with open(blacklist_path, 'w') as f:
+      f.write('FFF\tDelisted\n')
+    failures_path = os.path.join(directory, 'failures')
+    reports = []
+    result = warm_universe(universe_path, date(2012, 6, 1), end_of_day_class=SlowEndOfDay,
+                           workers=2, report=reports.append, blacklist_path=blacklist_path,
+                           failures_path=failures_path)
+    assert_equal(result.warmed, ['AAA', 'CCC', 'EEE'])
+    assert_equal(sorted(result.failures.keys()), ['XBB', 'XDD'])
+    assert_equal(result.failures['XBB'], 'IOError: No data for XBB.')
+    assert_equal(SlowEndOfDay.most_active, 2)
+    assert_equal([(progress.done, progress.total) for progress in reports],
+                 [(i, 5) for i in range(1, 6)])
+    assert_equal(reports[-1].failed, 2)
+    assert_true(reports[-1].symbols_per_second > 0)
+    assert_equal(read_universe(failures_path), ['XBB', 'XDD'])
+  finally:
+    shutil.rmtree(directory)
+
+if __name__ == "__main__":
+  from proboscis import TestProgram
+  TestProgram().run_and_exit()
@@ -0,0 +1,170 @@
+"""This file contains the test_column_file_cache module of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies: 
+    proboscis: <https://github.com/rackspace/python-proboscis>
+    numpy: <http://numpy.scipy.org/>
+"""
+from proboscis import test
+from proboscis.asserts import assert_equal
+from proboscis.asserts import assert_true
+from djscrooge.test.library.end_of_day.test_end_of_day import TestEndOfDay, RecordedEndOfDay, \
+  HISTORY, FETCHES
+from djscrooge.library.end_of_day.column_file_cache import ColumnFileCache, read_header, \
+  open_symbol, write_symbol
+from djscrooge.backtest import Backtest, Split
+from djscrooge.config import Config
+from datetime import date, timedelta
+from numpy import memmap
+from proboscis.asserts import assert_raises
+import os
+import resource
+import shutil
+import tempfile
+
+@test()
+class TestColumnFileCache(TestEndOfDay):
+  """Tests the ColumnFileCache EndOfDay class."""
+  
+  def __init__(self):
+    super(TestColumnFileCache, self).__init__(ColumnFileCache)
+
+@test
+class TestColumnFileCacheReadThrough(object):
+  """Tests that the ColumnFileCache class maps its files and only fetches days it does not have."""
+  
+  def set_up(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache_directory = Config.COLUMN_FILE_CACHE_DIRECTORY
+    self.source = Config.CACHE_END_OF_DAY_SOURCE_CLASS
+    self.overlap_days = Config.CACHE_REFRESH_OVERLAP_DAYS
+    Config.COLUMN_FILE_CACHE_DIRECTORY = os.path.join(self.directory, 'columns')
+    Config.CACHE_END_OF_DAY_SOURCE_CLASS = property(lambda config: RecordedEndOfDay)
+    del FETCHES[:]
+    HISTORY['FOO'] = {}
+    day = date(2012, 1, 2)
+    while day < date(2012, 4, 1):
+      if day.weekday() < 5:
+        HISTORY['FOO'][day] = 1000 + day.toordinal() % 100
+      day += timedelta(1)
+    HISTORY[Config.BACKTEST_SYMBOL_FOR_ALL_DATES] = dict(HISTORY['FOO'])
+      
+  def tear_down(self):
+    Config.COLUMN_FILE_CACHE_DIRECTORY = self.cache_directory
+    Config.CACHE_END_OF_DAY_SOURCE_CLASS = self.source
+    Config.CACHE_REFRESH_OVERLAP_DAYS = self.overlap_days
+    shutil.rmtree(self.directory)
+  
+  @test
+  def test_read_through(self):
+    """Test that cached days are mapped from the files and stale symbols are refreshed."""
+    self.set_up()
+    try:
+      first = ColumnFileCache('FOO', date(2012, 1, 1), date(2012, 2, 17))
+      second = ColumnFileCache('FOO', date(2012, 1, 10), date(2012, 2, 20))
+      assert_equal(len(FETCHES), 1)
+      assert_true(isinstance(second.close_prices, list))
+      assert_equal(type(second.close_prices[0]), int)
+      assert_equal(type(second.volumes[0]), int)
+      assert_true(isinstance(second.arrays['close_prices'], memmap))
+      assert_equal(second.arrays['close_prices'].tolist(), second.close_prices)
+      assert_equal(second.dates, first.dates[first.get_index_from_date(date(2012, 1, 10)):])
+      assert_equal(second.close_prices, [HISTORY['FOO'][day] for day in second.dates])
+      assert_equal(second.dividends[second.get_index_from_date(date(2012, 2, 1))], 12.5)
+      assert_equal(second.splits[second.get_index_from_date(date(2012, 2, 15))], Split(2, 1))
+      assert_equal(second.get_index_from_date(date(2012, 2, 18)), None)
+      refreshed = ColumnFileCache('FOO', date(2012, 2, 1), date(2012, 3, 2))
+      assert_true(FETCHES[-1][1] > date(2012, 2, 1))
+      assert_equal(refreshed.dates[-1], date(2012, 3, 2))
+      assert_equal(refreshed.close_prices, [HISTORY['FOO'][day] for day in refreshed.dates])
+      assert_equal(refreshed.splits.count(Split(2, 1)), 1)
+      HISTORY['FOO'][date(2012, 3, 1)] = 1
+      reloaded = ColumnFileCache('FOO', date(2012, 2, 1), date(2012, 3, 9))
+      assert_equal(FETCHES[-1][1], date(1900, 1, 1))
+      assert_equal(reloaded.close_prices[reloaded.get_index_from_date(date(2012, 3, 1))], 1)
+      assert_equal(second.arrays['close_prices'].tolist(), [HISTORY['FOO'][day] for day in second.dates])
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_split_only_overlap(self):
+    """Test that an overlap starting on a split-only day is fetched from the next trading day."""
+    self.set_up()
+    try:
+      HISTORY['FOO'][date(2012, 2, 18)] = Split(2, 1)
+      ColumnFileCache('FOO', date(2012, 1, 2), date(2012, 2, 24))
+      Config.CACHE_REFRESH_OVERLAP_DAYS = 6
+      refreshed = ColumnFileCache('FOO', date(2012, 2, 1), date(2012, 3, 2))
+      assert_equal(len(FETCHES), 2)
+      assert_equal(FETCHES[-1][1], date(2012, 2, 20))
+      assert_equal(refreshed.splits[refreshed.get_index_from_date(date(2012, 2, 18))], Split(2, 1))
+      assert_equal(refreshed.dates, sorted([day for day in HISTORY['FOO'].keys() 
+                                            if date(2012, 2, 1) <= day <= date(2012, 3, 2)]))
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_many_symbols(self):
+    """Test that several hundred symbols can be held open with few file descriptors."""
+    self.set_up()
+    limits = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+      symbols = ['S%03d' % i for i in range(400)]
+      for symbol in symbols:
+        HISTORY[symbol] = HISTORY['FOO']
+      resource.setrlimit(resource.RLIMIT_NOFILE, (min(512, limits[1]), limits[1]))
+      items = [ColumnFileCache(symbol, date(2012, 1, 1), date(2012, 3, 30)) for symbol in symbols]
+      assert_equal(items[-1].close_prices, [HISTORY['FOO'][day] for day in items[-1].dates])
+    finally:
+      resource.setrlimit(resource.RLIMIT_NOFILE, limits)
+      for symbol in symbols:
+        del HISTORY[symbol]
+      self.tear_down()
+      
+  @test
+  def test_rewritten_header(self):
+    """Test that a header read before a rewrite can still be opened, or is read again."""
+    self.set_up()
+    try:
+      cache = ColumnFileCache('FOO', date(2012, 1, 1), date(2012, 2, 17))
+      header = read_header(cache.directory)
+      write_symbol(cache.directory, open_symbol(cache.directory, header), header['updated_to'])
+      held = open_symbol(cache.directory, header)
+      assert_equal(held.arrays['dates'].tolist(), [day.toordinal() for day in cache.dates])
+      write_symbol(cache.directory, held, header['updated_to'])
+      assert_raises(IOError, open_symbol, cache.directory, header)
+      cache.read_prices(header, date(2012, 1, 1).toordinal(), date(2012, 2, 17).toordinal())
+      assert_equal(cache.close_prices, [HISTORY['FOO'][day] for day in cache.dates])
+      assert_equal(len(os.listdir(cache.directory)), 7)
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_backtest(self):
+    """Test that a Backtest runs on the memory-mapped columns."""
+    self.set_up()
+    try:
+      backtest = Backtest(date(2012, 1, 2), date(2012, 1, 31), end_of_day_class=ColumnFileCache)
+      assert_equal(len(backtest.values), len(backtest.dates))
+      assert_equal(backtest.values[-1], int(1e7))
+    finally:
+      self.tear_down()
+
+if __name__ == "__main__":
+  from proboscis import TestProgram
+  TestProgram().run_and_exit()
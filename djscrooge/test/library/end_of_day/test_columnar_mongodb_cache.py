@@ -0,0 +1,158 @@
+"""This file contains the test_columnar_mongodb_cache module of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies: 
+    proboscis: <https://github.com/rackspace/python-proboscis>
+    mongomock: <https://github.com/mongomock/mongomock>
+"""
+from proboscis import test
+from proboscis.asserts import assert_equal
+from djscrooge.test.library.end_of_day.test_end_of_day import TestEndOfDay, RecordedEndOfDay, \
+  HISTORY, FETCHES
+from djscrooge.test.library.end_of_day.test_mongodb_cache import MongomockFixture, RenamedMongodbCache
+from djscrooge.library.end_of_day.columnar_mongodb_cache import ColumnarMongodbCache, pack, unpack, \
+  encode_block, decode_block, migrate_to_columnar
+from djscrooge.library.end_of_day.mongodb_cache import MongodbCache, get_year_ranges
+from djscrooge.backtest import EndOfDay, Split
+from datetime import date, timedelta
+
+COLUMNS = ['dates', 'open_prices', 'high_prices', 'low_prices', 'close_prices', 'adj_close_prices',
+           'volumes', 'dividends', 'splits']
+
+def record_year_end_history():
+  """Records the weekdays from 2011-12-01 to 2012-01-31 as the history of BAZ."""
+  HISTORY['BAZ'] = {}
+  day = date(2011, 12, 1)
+  while day <= date(2012, 1, 31):
+    if day.weekday() < 5:
+      HISTORY['BAZ'][day] = 2000 + day.toordinal() % 100
+    day += timedelta(1)
+
+def assert_same_days(eod, expected, start=0, stop=None):
+  """Asserts that the columns of eod are those of the days start to stop of expected."""
+  if stop is None:
+    stop = len(expected.dates)
+  for column in COLUMNS:
+    assert_equal(list(getattr(eod, column)), list(getattr(expected, column)[start:stop]))
+
+@test()
+class TestColumnarMongodbCache(TestEndOfDay):
+  """Tests the ColumnarMongodbCache EndOfDay class."""
+  
+  def __init__(self):
+    super(TestColumnarMongodbCache, self).__init__(ColumnarMongodbCache)   
+
+@test
+class TestColumnarBlocks(object):
+  """Tests the encoding of the price_blocks documents."""
+  
+  @test
+  def test_pack(self):
+    """Test that integer and float columns round-trip through pack and unpack."""
+    for (values, dtype) in [([1, 2, 3000000000], '<i8'), ([0.5, 1.25], '<f8'), ([], '<f8')]:
+      block = {'dtypes' : {}}
+      (block['dtypes']['column'], block['column']) = pack(values)
+      assert_equal(block['dtypes']['column'], dtype)
+      assert_equal(unpack(block, 'column').tolist(), values)
+  
+  @test
+  def test_blocks(self):
+    """Test that whole and partial blocks round-trip, with their dividends and splits."""
+    record_year_end_history()
+    eod = RecordedEndOfDay('BAZ', date(2011, 12, 1), date(2012, 1, 31))
+    ranges = get_year_ranges(eod)
+    split = eod.get_index_from_date(date(2012, 1, 2))
+    assert_equal(ranges, [(0, split), (split, len(eod.dates))])
+    blocks = [encode_block('BAZ', eod, start, stop) for (start, stop) in ranges]
+    assert_equal([block['year'] for block in blocks], [2011, 2012])
+    decoded = EndOfDay('BAZ', None, None)
+    for block in blocks:
+      decode_block(decoded, block, None, None)
+    assert_same_days(decoded, eod)
+    assert_equal(decoded.dividends[0], 12.5)
+    assert_equal(decoded.splits[decoded.get_index_from_date(date(2011, 12, 15))], Split(2, 1))
+    partial = EndOfDay('BAZ', None, None)
+    decode_block(partial, blocks[0], date(2011, 12, 14).toordinal(), date(2011, 12, 25).toordinal())
+    decode_block(partial, blocks[1], None, date(2012, 1, 1).toordinal())
+    assert_same_days(partial, eod, eod.get_index_from_date(date(2011, 12, 14)), 
+                     eod.get_index_from_date(date(2011, 12, 26)))
+    assert_equal(partial.splits[1], Split(2, 1))
+    empty = EndOfDay('BAZ', None, None)
+    decode_block(empty, blocks[0], date(2012, 1, 2).toordinal(), None)
+    assert_same_days(empty, eod, 0, 0)
+
+class RenamedColumnarMongodbCache(ColumnarMongodbCache):
+  """A ColumnarMongodbCache storing its documents in other collections."""
+  
+  PRICES_COLLECTION = 'renamed_blocks'
+  SYMBOLS_COLLECTION = 'renamed_block_symbols'
+
+@test
+class TestMigrateToColumnar(MongomockFixture):
+  """Tests the migrate_to_columnar function against mongomock."""
+  
+  @test
+  def test_migrate(self):
+    """Test that migrated symbols are read from the price_blocks collection without a fetch."""
+    self.set_up()
+    try:
+      record_year_end_history()
+      expected = MongodbCache('BAZ', date(2011, 12, 1), date(2012, 1, 31))
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 3, 30))
+      db = self.client.djscrooge
+      prices = len(list(db.prices.find()))
+      assert_equal(migrate_to_columnar(db), 2)
+      assert_equal(len(list(db.prices.find())), prices)
+      fetches = len(FETCHES)
+      migrated = ColumnarMongodbCache('BAZ', date(2011, 12, 1), date(2012, 1, 31))
+      assert_equal(len(FETCHES), fetches)
+      assert_same_days(migrated, expected)
+      assert_equal(migrate_to_columnar(db, remove=True), 2)
+      assert_equal(len(list(db.prices.find())), 0)
+      assert_equal(len(list(db.symbols.find())), 0)
+      assert_equal(sorted([data['symbol'] for data in db.block_symbols.find()]), ['BAZ', 'FOO'])
+      assert_equal(sorted([(block['symbol'], block['year']) for block in db.price_blocks.find()]),
+                   [('BAZ', 2011), ('BAZ', 2012), ('FOO', 2012)])
+      migrated = ColumnarMongodbCache('FOO', date(2012, 3, 1), date(2012, 3, 30))
+      assert_equal(len(FETCHES), fetches)
+      assert_equal(migrated.close_prices, [HISTORY['FOO'][day] for day in migrated.dates])
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_migrate_collection_names(self):
+    """Test that the migration reads and writes the collections named by the given classes."""
+    self.set_up()
+    try:
+      RenamedMongodbCache('FOO', date(2012, 1, 2), date(2012, 3, 30))
+      db = self.client.djscrooge
+      assert_equal(migrate_to_columnar(db, remove=True, source_class=RenamedMongodbCache,
+                                       target_class=RenamedColumnarMongodbCache), 1)
+      assert_equal(len(list(db.renamed_prices.find())), 0)
+      assert_equal(len(list(db.price_blocks.find())), 0)
+      assert_equal([block['year'] for block in db.renamed_blocks.find({'symbol' : 'FOO'})], [2012])
+      fetches = len(FETCHES)
+      migrated = RenamedColumnarMongodbCache('FOO', date(2012, 3, 1), date(2012, 3, 30))
+      assert_equal(len(FETCHES), fetches)
+      assert_equal(migrated.close_prices, [HISTORY['FOO'][day] for day in migrated.dates])
+    finally:
+      self.tear_down()
+
+if __name__ == "__main__":
+  from proboscis import TestProgram
+  TestProgram().run_and_exit()
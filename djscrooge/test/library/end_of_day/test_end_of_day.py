@@ -19,7 +19,48 @@ Copyright (C) 2012  James Adam Cataldo
 from proboscis import test
 from proboscis.asserts import assert_equal
 from datetime import date
-from djscrooge.backtest import Split
+from djscrooge.backtest import EndOfDay, Split
+
+HISTORY = {}
+"""The close prices of the RecordedEndOfDay class, by symbol and date.
+
+A Split in place of a close price is a split on a day with no price data. As with the Yahoo
+class, it gets a synthetic row priced from the previous close, and it cannot be the first day.
+"""
+
+FETCHES = []
+"""The (symbol, start_date, end_date) arguments of each RecordedEndOfDay object created."""
+
+class RecordedEndOfDay(EndOfDay):
+  """An EndOfDay source serving HISTORY, which records every fetch."""
+  
+  def __init__(self, symbol, start_date, end_date):
+    super(RecordedEndOfDay, self).__init__(symbol, start_date, end_date)
+    FETCHES.append((symbol, start_date, end_date))
+    for day in sorted(HISTORY[symbol].keys()):
+      if start_date <= day <= end_date:
+        close = HISTORY[symbol][day]
+        if isinstance(close, Split):
+          if len(self.dates) == 0:
+            raise TypeError('No price data for the split on ' + str(day) + '.')
+          price = int(self.close_prices[-1] * close.denominator * 1.0 / close.numerator)
+          self.dates.append(day)
+          for prices in [self.open_prices, self.high_prices, self.low_prices, self.close_prices,
+                         self.adj_close_prices]:
+            prices.append(price)
+          self.volumes.append(0)
+          self.dividends.append(None)
+          self.splits.append(close)
+          continue
+        self.dates.append(day)
+        self.open_prices.append(close - 1)
+        self.high_prices.append(close + 1)
+        self.low_prices.append(close - 2)
+        self.close_prices.append(close)
+        self.adj_close_prices.append(close * 0.5)
+        self.volumes.append(1000)
+        self.dividends.append(12.5 if day.day == 1 else None)
+        self.splits.append(Split(2, 1) if day.day == 15 else None)
 
 class TestEndOfDay(object):
   """Tests an arbitrary EndOfDay sublclass."""
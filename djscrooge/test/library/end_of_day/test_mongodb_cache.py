@@ -1,4 +1,4 @@
-"""This file contains the test_yahoo module of the DJ Scrooge backtesting API.
+"""This file contains the test_mongodb_cache module of the DJ Scrooge backtesting API.
 Copyright (C) 2012  James Adam Cataldo
 
     This file is part of Pengoe.
@@ -18,10 +18,20 @@ Copyright (C) 2012  James Adam Cataldo
 
 Dependencies: 
     proboscis: <https://github.com/rackspace/python-proboscis>
+    mongomock: <https://github.com/mongomock/mongomock>
 """
 from proboscis import test
-from djscrooge.test.library.end_of_day.test_end_of_day import TestEndOfDay
-from djscrooge.library.end_of_day.mongodb_cache import MongodbCache
+from proboscis.asserts import assert_equal
+from proboscis.asserts import assert_true
+from djscrooge.test.library.end_of_day.test_end_of_day import TestEndOfDay, RecordedEndOfDay, \
+  HISTORY, FETCHES
+from djscrooge.library.end_of_day.mongodb_cache import MongodbCache, insert_prices
+from djscrooge.library.end_of_day.columnar_mongodb_cache import ColumnarMongodbCache
+from djscrooge.backtest import Split
+from djscrooge.config import Config
+from datetime import date, timedelta
+from weakref import ref
+import mongomock
 
 @test()
 class TestMongodbCache(TestEndOfDay):
@@ -30,6 +40,338 @@ class TestMongodbCache(TestEndOfDay):
   def __init__(self):
     super(TestMongodbCache, self).__init__(MongodbCache)   
 
+class MongomockFixture(object):
+  """Runs the Mongo caches against a mongomock client, with RecordedEndOfDay as their source.
+  
+  FOO and BAR have the same weekdays from 2012-01-02 to 2012-03-30.
+  """
+  
+  def set_up(self):
+    self.factory = Config.MONGODB_CLIENT_FACTORY
+    self.connection = Config._Config__mongodb_connection
+    self.pid = Config._Config__mongodb_pid
+    self.source = Config.CACHE_END_OF_DAY_SOURCE_CLASS
+    self.insert_batch_size = Config.MONGODB_INSERT_BATCH_SIZE
+    self.read_batch_size = Config.MONGODB_READ_BATCH_SIZE
+    self.block_cache_size = Config.MONGODB_BLOCK_CACHE_SIZE
+    self.symbol_cache_size = Config.MONGODB_SYMBOL_CACHE_SIZE
+    self.overlap_days = Config.CACHE_REFRESH_OVERLAP_DAYS
+    self.client = mongomock.MongoClient()
+    client = self.client
+    Config.MONGODB_CLIENT_FACTORY = staticmethod(lambda host, port, **options: client)
+    Config._Config__mongodb_connection = None
+    Config.CACHE_END_OF_DAY_SOURCE_CLASS = property(lambda config: RecordedEndOfDay)
+    MongodbCache.block_cache.clear()
+    MongodbCache.symbol_cache.clear()
+    del FETCHES[:]
+    HISTORY['FOO'] = {}
+    day = date(2012, 1, 2)
+    while day < date(2012, 4, 1):
+      if day.weekday() < 5:
+        HISTORY['FOO'][day] = 1000 + day.toordinal() % 100
+      day += timedelta(1)
+    HISTORY['BAR'] = dict(HISTORY['FOO'])
+    
+  def tear_down(self):
+    Config.MONGODB_CLIENT_FACTORY = self.factory
+    Config._Config__mongodb_connection = self.connection
+    Config._Config__mongodb_pid = self.pid
+    Config.CACHE_END_OF_DAY_SOURCE_CLASS = self.source
+    Config.MONGODB_INSERT_BATCH_SIZE = self.insert_batch_size
+    Config.MONGODB_READ_BATCH_SIZE = self.read_batch_size
+    Config.MONGODB_BLOCK_CACHE_SIZE = self.block_cache_size
+    Config.MONGODB_SYMBOL_CACHE_SIZE = self.symbol_cache_size
+    Config.CACHE_REFRESH_OVERLAP_DAYS = self.overlap_days
+    MongodbCache.block_cache.clear()
+    MongodbCache.symbol_cache.clear()
+    
+  def record_calls(self, collection, name):
+    """Replaces the named method of the mongomock collection with one recording its arguments.
+    
+    Returns the list the (args, keywords) of each call are appended to.
+    """
+    calls = []
+    method = getattr(collection, name)
+    def recorded(*args, **keywords):
+      calls.append((args, keywords))
+      return method(*args, **keywords)
+    setattr(collection, name, recorded)
+    return calls
+
+class IndexCountingMongodbCache(MongodbCache):
+  """A MongodbCache counting the calls to ensure_indexes."""
+  
+  index_calls = 0
+  
+  def ensure_indexes(self):
+    IndexCountingMongodbCache.index_calls += 1
+    super(IndexCountingMongodbCache, self).ensure_indexes()
+
+class RenamedMongodbCache(MongodbCache):
+  """A MongodbCache storing its documents in other collections."""
+  
+  PRICES_COLLECTION = 'renamed_prices'
+  SYMBOLS_COLLECTION = 'renamed_symbols'
+
+@test
+class TestMongodbCacheWrites(MongomockFixture):
+  """Tests the bulk inserts and index creation of the MongodbCache class against mongomock."""
+  
+  @test
+  def test_insert_prices(self):
+    """Test that insert_prices inserts the days in order, MONGODB_INSERT_BATCH_SIZE at a time."""
+    self.set_up()
+    try:
+      Config.MONGODB_INSERT_BATCH_SIZE = 2
+      db = self.client.djscrooge
+      inserts = self.record_calls(db.prices, 'insert')
+      eod = RecordedEndOfDay('FOO', date(2012, 1, 2), date(2012, 1, 10))
+      insert_prices(db.prices, 'FOO', eod, 1)
+      assert_equal([len(args[0]) for (args, keywords) in inserts], [2, 2, 2])
+      stored = [price['date'] for price in db.prices.find({'symbol' : 'FOO'}).sort('date', 1)]
+      assert_equal(stored, [d.toordinal() for d in eod.dates[1:]])
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_ensure_indexes(self):
+    """Test that the indexes are created once per connection, even if its id is reused."""
+    self.set_up()
+    try:
+      IndexCountingMongodbCache.index_calls = 0
+      IndexCountingMongodbCache('FOO', date(2012, 1, 2), date(2012, 1, 31))
+      IndexCountingMongodbCache('BAR', date(2012, 1, 2), date(2012, 1, 31))
+      assert_equal(IndexCountingMongodbCache.index_calls, 1)
+      indexes = [index['key'] for index in self.client.djscrooge.prices.index_information().values()]
+      assert_true([('symbol', 1), ('date', 1)] in indexes)
+      other = mongomock.MongoClient()
+      MongodbCache.indexed_connections[id(self.client)] = (ref(other), set(['prices']))
+      IndexCountingMongodbCache('FOO', date(2012, 1, 2), date(2012, 1, 31))
+      assert_equal(IndexCountingMongodbCache.index_calls, 2)
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_collection_names(self):
+    """Test that the prices, symbols and indexes of a subclass use its collection names."""
+    self.set_up()
+    try:
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 2, 17))
+      Config.CACHE_REFRESH_OVERLAP_DAYS = 2
+      RenamedMongodbCache('FOO', date(2012, 1, 2), date(2012, 2, 17))
+      refreshed = RenamedMongodbCache('FOO', date(2012, 1, 2), date(2012, 3, 2))
+      db = self.client.djscrooge
+      assert_equal(db.prices.find({'symbol' : 'FOO'}).count(), len(refreshed.dates) - 10)
+      assert_equal(db.renamed_prices.find({'symbol' : 'FOO'}).count(), len(refreshed.dates))
+      assert_equal(db.renamed_symbols.find({'symbol' : 'FOO'}).count(), 1)
+      indexes = [index['key'] for index in db.renamed_prices.index_information().values()]
+      assert_true([('symbol', 1), ('date', 1)] in indexes)
+    finally:
+      self.tear_down()
+
+@test
+class TestMongodbCacheRefresh(MongomockFixture):
+  """Tests the incremental refresh of stale MongodbCache symbols against mongomock."""
+  
+  def get_stored_dates(self, symbol):
+    """Returns the dates of the stored prices documents of the symbol, in the order stored."""
+    return [date.fromordinal(price['date']) for price in 
+            self.client.djscrooge.prices.find({'symbol' : symbol}).sort('date', 1)]
+  
+  @test
+  def test_refresh(self):
+    """Test that a stale symbol is extended with one bulk insert of the new days."""
+    self.set_up()
+    try:
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 2, 17))
+      prices = self.client.djscrooge.prices
+      inserts = self.record_calls(prices, 'insert')
+      updates = self.record_calls(prices, 'update')
+      refreshed = MongodbCache('FOO', date(2012, 2, 1), date(2012, 3, 2))
+      assert_equal(len(FETCHES), 2)
+      assert_true(FETCHES[-1][1] > date(2012, 2, 1))
+      assert_equal(len(inserts), 1)
+      assert_equal(updates, [])
+      assert_equal(refreshed.dates[-1], date(2012, 3, 2))
+      assert_equal(refreshed.close_prices, [HISTORY['FOO'][day] for day in refreshed.dates])
+      assert_equal(self.get_stored_dates('FOO'), 
+                   sorted([day for day in HISTORY['FOO'].keys() if day <= date(2012, 3, 2)]))
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_reload(self):
+    """Test that the full history is reloaded when the source has rewritten the overlapping days."""
+    self.set_up()
+    try:
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 2, 17))
+      HISTORY['FOO'][date(2012, 2, 16)] = 1
+      reloaded = MongodbCache('FOO', date(2012, 2, 1), date(2012, 3, 2))
+      assert_equal(len(FETCHES), 3)
+      assert_equal(FETCHES[-1][1], date(1900, 1, 1))
+      assert_equal(reloaded.close_prices[reloaded.get_index_from_date(date(2012, 2, 16))], 1)
+      assert_equal(reloaded.close_prices, [HISTORY['FOO'][day] for day in reloaded.dates])
+      assert_equal(self.get_stored_dates('FOO'), 
+                   sorted([day for day in HISTORY['FOO'].keys() if day <= date(2012, 3, 2)]))
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_split_only_overlap(self):
+    """Test that an overlap starting on a split-only day is fetched from the next trading day."""
+    self.set_up()
+    try:
+      HISTORY['FOO'][date(2012, 2, 18)] = Split(2, 1)
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 2, 24))
+      Config.CACHE_REFRESH_OVERLAP_DAYS = 6
+      refreshed = MongodbCache('FOO', date(2012, 2, 1), date(2012, 3, 2))
+      assert_equal(len(FETCHES), 2)
+      assert_equal(FETCHES[-1][1], date(2012, 2, 20))
+      assert_equal(refreshed.splits[refreshed.get_index_from_date(date(2012, 2, 18))], Split(2, 1))
+      assert_equal(refreshed.dates[-1], date(2012, 3, 2))
+      assert_equal(self.get_stored_dates('FOO'), 
+                   sorted([day for day in HISTORY['FOO'].keys() if day <= date(2012, 3, 2)]))
+    finally:
+      self.tear_down()
+
+@test
+class TestMongodbCacheSessions(MongomockFixture):
+  """Tests that MongodbCache symbols are only refreshed once a new trading session has closed."""
+  
+  @test
+  def test_sessions(self):
+    """Test that end dates on a weekend or an exchange holiday do not cause a fetch.
+    
+    symbol_cache is cleared before each read, so the stored updated_to is checked.
+    """
+    self.set_up()
+    try:
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 2, 17))
+      assert_equal(len(FETCHES), 1)
+      for end_date in [date(2012, 2, 18), date(2012, 2, 19), date(2012, 2, 20)]:
+        MongodbCache.symbol_cache.clear()
+        eod = MongodbCache('FOO', date(2012, 2, 1), end_date)
+        assert_equal(len(FETCHES), 1)
+        assert_equal(eod.dates[-1], date(2012, 2, 17))
+      symbol_data = self.client.djscrooge.symbols.find_one({'symbol' : 'FOO'})
+      assert_equal(symbol_data['updated_to'], date(2012, 2, 17).toordinal())
+      eod = MongodbCache('FOO', date(2012, 2, 1), date(2012, 2, 21))
+      assert_equal(len(FETCHES), 2)
+      assert_equal(FETCHES[-1][2], date(2012, 2, 21))
+      assert_equal(eod.dates[-1], date(2012, 2, 21))
+    finally:
+      self.tear_down()
+
+@test
+class TestMongodbCacheLoadMany(MongomockFixture):
+  """Tests the batched reads of the Mongo caches against mongomock."""
+  
+  def record_batch_sizes(self, collection):
+    """Records the batch size of each cursor returned by find on the mongomock collection.
+    
+    Returns the list of batch sizes, with None for each cursor whose batch size was not set.
+    """
+    batch_sizes = []
+    find = collection.find
+    def recorded_find(*args, **keywords):
+      cursor = find(*args, **keywords)
+      batch_sizes.append(None)
+      index = len(batch_sizes) - 1
+      batch_size = cursor.batch_size
+      def recorded_batch_size(size):
+        batch_sizes[index] = size
+        return batch_size(size)
+      cursor.batch_size = recorded_batch_size
+      return cursor
+    collection.find = recorded_find
+    return batch_sizes
+  
+  @test
+  def test_load_many(self):
+    """Test that load_many reads the same days as single reads, with one batched query."""
+    self.set_up()
+    try:
+      Config.MONGODB_READ_BATCH_SIZE = 7
+      for end_of_day_class in [MongodbCache, ColumnarMongodbCache]:
+        del FETCHES[:]
+        singles = {}
+        for symbol in ['FOO', 'BAR']:
+          singles[symbol] = end_of_day_class(symbol, date(2012, 2, 1), date(2012, 3, 2))
+        MongodbCache.block_cache.clear()
+        batch_sizes = self.record_batch_sizes(self.client.djscrooge[end_of_day_class.PRICES_COLLECTION])
+        items = end_of_day_class.load_many(['FOO', 'BAR'], date(2012, 2, 1), date(2012, 3, 2))
+        assert_equal(len(FETCHES), 2)
+        assert_equal(batch_sizes, [7])
+        assert_equal(sorted(items.keys()), ['BAR', 'FOO'])
+        assert_equal(items['FOO'].dates[-1], date(2012, 3, 2))
+        for symbol in ['FOO', 'BAR']:
+          for column in ['dates', 'open_prices', 'high_prices', 'low_prices', 'close_prices', 
+                         'adj_close_prices', 'volumes', 'dividends', 'splits']:
+            assert_equal(getattr(items[symbol], column), getattr(singles[symbol], column))
+    finally:
+      self.tear_down()
+
+@test
+class TestMongodbCacheBlocks(MongomockFixture):
+  """Tests the block_cache and symbol_cache of the MongodbCache class against mongomock."""
+  
+  @test
+  def test_hit_and_miss(self):
+    """Test that cached blocks and symbols are served without queries, and missing blocks are read."""
+    self.set_up()
+    try:
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 3, 30))
+      price_finds = self.record_calls(self.client.djscrooge.prices, 'find')
+      symbol_finds = self.record_calls(self.client.djscrooge.symbols, 'find_one')
+      hits = MongodbCache.block_cache.hits
+      eod = MongodbCache('FOO', date(2012, 2, 1), date(2012, 2, 29))
+      assert_equal(price_finds, [])
+      assert_equal(symbol_finds, [])
+      assert_equal(MongodbCache.block_cache.hits, hits + 1)
+      expected = sorted([day for day in HISTORY['FOO'].keys() if date(2012, 2, 1) <= day <= date(2012, 2, 29)])
+      assert_equal(eod.dates, expected)
+      assert_equal(eod.close_prices, [HISTORY['FOO'][day] for day in expected])
+      MongodbCache.block_cache.clear()
+      eod = MongodbCache('FOO', date(2012, 2, 1), date(2012, 2, 29))
+      assert_equal(len(price_finds), 1)
+      assert_equal(symbol_finds, [])
+      assert_equal((MongodbCache.block_cache.hits, MongodbCache.block_cache.misses), (0, 1))
+      assert_equal(eod.dates, expected)
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_refresh(self):
+    """Test that blocks cached before a refresh are not used after it."""
+    self.set_up()
+    try:
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 2, 17))
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 2, 17))
+      assert_equal(MongodbCache.block_cache.hits, 1)
+      refreshed = MongodbCache('FOO', date(2012, 2, 1), date(2012, 3, 2))
+      assert_equal(len(FETCHES), 2)
+      assert_equal(refreshed.dates[-1], date(2012, 3, 2))
+      assert_equal(refreshed.close_prices, [HISTORY['FOO'][day] for day in refreshed.dates])
+      symbol_data = MongodbCache('FOO', date(2012, 1, 2), date(2012, 3, 2)).get_symbol_data()
+      assert_equal(symbol_data['updated_to'], date(2012, 3, 2).toordinal())
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_sizes(self):
+    """Test that the cache sizes follow the Config, and blocks do not evict symbols."""
+    self.set_up()
+    try:
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 3, 30))
+      MongodbCache('BAR', date(2012, 1, 2), date(2012, 3, 30))
+      assert_equal(len(MongodbCache.block_cache), 2)
+      Config.MONGODB_BLOCK_CACHE_SIZE = 1
+      MongodbCache('FOO', date(2012, 1, 2), date(2012, 3, 30))
+      assert_equal(len(MongodbCache.block_cache), 1)
+      assert_equal(len(MongodbCache.symbol_cache), 2)
+    finally:
+      self.tear_down()
+
 if __name__ == "__main__":
   from proboscis import TestProgram
   TestProgram().run_and_exit()
\ No newline at end of file
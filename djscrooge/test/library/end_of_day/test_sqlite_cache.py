@@ -0,0 +1,114 @@
+"""This file contains the test_sqlite_cache module of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies: 
+    proboscis: <https://github.com/rackspace/python-proboscis>
+"""
+from proboscis import test
+from proboscis.asserts import assert_equal
+from djscrooge.test.library.end_of_day.test_end_of_day import TestEndOfDay, RecordedEndOfDay, \
+  HISTORY, FETCHES
+from djscrooge.library.end_of_day.sqlite_cache import SqliteCache
+from djscrooge.backtest import Split
+from djscrooge.config import Config
+from datetime import date, timedelta
+import os
+import shutil
+import tempfile
+
+@test()
+class TestSqliteCache(TestEndOfDay):
+  """Tests the SqliteCache EndOfDay class."""
+  
+  def __init__(self):
+    super(TestSqliteCache, self).__init__(SqliteCache)
+
+@test
+class TestSqliteCacheReadThrough(object):
+  """Tests that the SqliteCache class only fetches days it does not have."""
+  
+  def set_up(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = Config.SQLITE_CACHE_PATH
+    self.source = Config.CACHE_END_OF_DAY_SOURCE_CLASS
+    self.overlap_days = Config.CACHE_REFRESH_OVERLAP_DAYS
+    Config.SQLITE_CACHE_PATH = os.path.join(self.directory, 'cache', 'end_of_day.sqlite')
+    Config.CACHE_END_OF_DAY_SOURCE_CLASS = property(lambda config: RecordedEndOfDay)
+    del FETCHES[:]
+    HISTORY['FOO'] = {}
+    day = date(2012, 1, 2)
+    while day < date(2012, 4, 1):
+      if day.weekday() < 5:
+        HISTORY['FOO'][day] = 1000 + day.toordinal() % 100
+      day += timedelta(1)
+    HISTORY['BAR'] = dict(HISTORY['FOO'])
+      
+  def tear_down(self):
+    Config.SQLITE_CACHE_PATH = self.path
+    Config.CACHE_END_OF_DAY_SOURCE_CLASS = self.source
+    Config.CACHE_REFRESH_OVERLAP_DAYS = self.overlap_days
+    shutil.rmtree(self.directory)
+  
+  @test
+  def test_read_through(self):
+    """Test that cached days are served locally and stale symbols are refreshed."""
+    self.set_up()
+    try:
+      first = SqliteCache('FOO', date(2012, 1, 1), date(2012, 2, 17))
+      second = SqliteCache('FOO', date(2012, 1, 1), date(2012, 2, 20))
+      assert_equal(len(FETCHES), 1)
+      assert_equal(second.dates, first.dates)
+      assert_equal(second.dividends[second.get_index_from_date(date(2012, 2, 1))], 12.5)
+      assert_equal(second.splits[second.get_index_from_date(date(2012, 2, 15))], Split(2, 1))
+      refreshed = SqliteCache('FOO', date(2012, 2, 1), date(2012, 3, 2))
+      assert_equal(FETCHES[-1][1] < date(2012, 2, 17), True)
+      assert_equal(refreshed.dates[-1], date(2012, 3, 2))
+      assert_equal(refreshed.close_prices, 
+                   [HISTORY['FOO'][day] for day in refreshed.dates])
+      HISTORY['FOO'][date(2012, 3, 1)] = 1
+      reloaded = SqliteCache('FOO', date(2012, 2, 1), date(2012, 3, 9))
+      assert_equal(FETCHES[-1][1], date(1900, 1, 1))
+      assert_equal(reloaded.close_prices[reloaded.get_index_from_date(date(2012, 3, 1))], 1)
+      fetches = len(FETCHES)
+      items = SqliteCache.load_many(['FOO', 'BAR'], date(2012, 2, 1), date(2012, 3, 9))
+      assert_equal(len(FETCHES), fetches + 1)
+      assert_equal(items['FOO'].dates, reloaded.dates)
+      assert_equal(items['BAR'].dates, reloaded.dates)
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_split_only_overlap(self):
+    """Test that an overlap starting on a split-only day is fetched from the next trading day."""
+    self.set_up()
+    try:
+      HISTORY['FOO'][date(2012, 2, 18)] = Split(2, 1)
+      SqliteCache('FOO', date(2012, 1, 2), date(2012, 2, 24))
+      Config.CACHE_REFRESH_OVERLAP_DAYS = 6
+      refreshed = SqliteCache('FOO', date(2012, 2, 1), date(2012, 3, 2))
+      assert_equal(len(FETCHES), 2)
+      assert_equal(FETCHES[-1][1], date(2012, 2, 20))
+      assert_equal(refreshed.splits[refreshed.get_index_from_date(date(2012, 2, 18))], Split(2, 1))
+      assert_equal(refreshed.dates, sorted([day for day in HISTORY['FOO'].keys() 
+                                            if date(2012, 2, 1) <= day <= date(2012, 3, 2)]))
+    finally:
+      self.tear_down()
+
+if __name__ == "__main__":
+  from proboscis import TestProgram
+  TestProgram().run_and_exit()
@@ -22,11 +22,17 @@ Dependencies:
 from proboscis import test
 from proboscis.asserts import assert_equal
 from proboscis.asserts import assert_true
+from proboscis.asserts import assert_raises
 from StringIO import StringIO
-from djscrooge.library.end_of_day.yahoo import HeadingCsv, Yahoo
+from djscrooge.library.end_of_day.yahoo import HeadingCsv, Yahoo, parse_price_csv, parse_corporate_actions, \
+  download_symbols, get_current_prices_and_market_caps
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread
+from urlparse import urlparse, parse_qs
 from djscrooge.test.library.end_of_day.test_end_of_day import TestEndOfDay
 from datetime import date
-from djscrooge.backtest import Split
+from djscrooge.backtest import Split, EndOfDay
 
 @test(groups=['csv'])
 class TestHeadingCsv(object):
@@ -54,6 +60,46 @@ class TestHeadingCsv(object):
       row += 1
     assert_equal(row, 2)
     
+  @test
+  def test_parse_price_csv(self):
+    """Test that a Yahoo price file is parsed into chronological columns of cents."""
+    f = StringIO("Date,Open,High,Low,Close,Volume,Adj Close\r\n" +
+                 "2012-05-01,19.58,19.95,19.46,19.80,40295400,19.62\r\n" +
+                 "2012-04-30,19.68,19.72,19.44,19.58,35751000,19.40\r\n")
+    columns = parse_price_csv(f)
+    assert_equal(columns.date_ordinals.tolist(), [date(2012, 4, 30).toordinal(), date(2012, 5, 1).toordinal()])
+    assert_equal(columns.open_prices.tolist(), [1968, 1958])
+    assert_equal(columns.high_prices.tolist(), [1972, 1995])
+    assert_equal(columns.low_prices.tolist(), [1944, 1946])
+    assert_equal(columns.close_prices.tolist(), [1958, 1980])
+    assert_equal(columns.adj_close_prices.tolist(), [1940, 1962])
+    assert_equal(columns.volumes.tolist(), [35751000, 40295400])
+    columns = parse_price_csv(StringIO("Date,Open,High,Low,Close,Volume,Adj Close\n"))
+    assert_equal(len(columns.date_ordinals), 0)
+    assert_equal(len(columns.volumes), 0)
+    
+  @test
+  def test_parse_malformed_price_csv(self):
+    """Test that malformed rows and values raise errors instead of misaligning the columns."""
+    heading = "Date,Open,High,Low,Close,Volume,Adj Close\n"
+    row = "2012-05-01,19.58,19.95,19.46,19.80,40295400,19.62\n"
+    assert_raises(ValueError, parse_price_csv, 
+                  StringIO(heading + row + "2012-04-30,null,null,null,null,null,null\n"))
+    assert_raises(ValueError, parse_price_csv, 
+                  StringIO(heading + row + "null,19.68,19.72,19.44,19.58,35751000,19.40\n"))
+    assert_raises(IOError, parse_price_csv, 
+                  StringIO(heading + row + "2012-04-30,19.68,19.72,19.44,19.58,35751000\n"))
+    assert_raises(IOError, parse_price_csv, 
+                  StringIO(heading + row + "2012-04-30,19.68,19.72,19.44,19.58,35751000,19.40,1\n"))
+    assert_raises(IOError, parse_price_csv, StringIO(heading + row + "\n" + row))
+    assert_raises(IOError, parse_price_csv, 
+                  StringIO(heading + "2012-05-01,19.58,19.95,19.46,19.80,40295400\n" +
+                           "2012-04-30,19.68,19.72,19.44,19.58,35751000,19.40,1\n"))
+    assert_raises(ValueError, parse_price_csv, 
+                  StringIO(heading + row + "2012-04-30,19.68,19.72x,19.44,19.58,35751000,19.40\n"))
+    assert_raises(ValueError, parse_price_csv, 
+                  StringIO(heading + row + "2012-04-30,19.68,19.72,19.44,,35751000,19.40\n"))
+    
 @test(depends_on_groups=['csv'])
 class TestYahoo(TestEndOfDay):
   """Tests the Yahoo EndOfDay class."""
@@ -61,6 +107,75 @@ class TestYahoo(TestEndOfDay):
   def __init__(self):
     super(TestYahoo, self).__init__(Yahoo)  
     
+  @test
+  def test_merge_corporate_actions(self):
+    """Test that dividends and splits, including those on days without prices, are merged."""
+    events = ["SPLIT, 20000828,2:1\n",
+              "DIVIDEND, 20000830,0.170000\n",
+              "SPLIT, 20000827,1:2\n",
+              "SPLIT, 20000901,3:1\n"]
+    self.check_merge_corporate_actions(events)
+    events.reverse()
+    self.check_merge_corporate_actions(events)
+    
+  def check_merge_corporate_actions(self, events):
+    """Merges the given lines of a Yahoo dividend and split file, and checks the result.
+    
+    The 1:2 split on 8/27 and the 2:1 split on 8/28 both fall after the close of 15688 on
+    8/25, so both get synthetic rows. Each synthetic row is priced from the row before it, so
+    8/27 closes at 15688 * 2 = 31376, and 8/28 at 31376 / 2 = 15688, in either file order.
+    """
+    (dividends, splits) = parse_corporate_actions(StringIO("Date,Dividends\n" + ''.join(events)))
+    eod = Yahoo.__new__(Yahoo)
+    EndOfDay.__init__(eod, 'FOO', date(2000, 8, 25), date(2000, 9, 1))
+    eod.dates = [date(2000, 8, 25), date(2000, 8, 30), date(2000, 9, 1)]
+    eod.open_prices = [15050, 7900, 2600]
+    eod.high_prices = [15844, 7962, 2700]
+    eod.low_prices = [15025, 7712, 2500]
+    eod.close_prices = [15688, 7762, 2650]
+    eod.adj_close_prices = [15688, 7762, 2650]
+    eod.volumes = [450800, 491200, 300000]
+    eod.merge_corporate_actions(dividends, splits)
+    assert_equal(eod.dates, [date(2000, 8, 25), date(2000, 8, 27), date(2000, 8, 28), date(2000, 8, 30), 
+                             date(2000, 9, 1)])
+    assert_equal(eod.open_prices, [15050, 31376, 15688, 7900, 2600])
+    assert_equal(eod.close_prices, [15688, 31376, 15688, 7762, 2650])
+    assert_equal(eod.volumes, [450800, 0, 0, 491200, 300000])
+    assert_equal(eod.dividends, [None, None, None, 17.0, None])
+    assert_equal(eod.splits, [None, Split(1,2), Split(2,1), None, Split(3,1)])
+    assert_equal(eod.get_index_from_date(date(2000, 8, 30)), 3)
+    
+  @test
+  def test_update(self):
+    """Test that update requests only the missing days and detects adjusted history."""
+    rows = ["2012-05-03,20.00,20.00,20.00,20.00,300,%s\n",
+            "2012-05-02,19.00,19.00,19.00,19.00,200,%s\n",
+            "2012-05-01,18.00,18.00,18.00,18.00,100,%s\n"]
+    requests = []
+    adjusted_close = ['20.00', '19.00', '18.00']
+    def fetch(url):
+      requests.append(url)
+      if url.find('table.csv') < 0:
+        return StringIO("Date,Dividends\n")
+      start_day = int(url[url.index('&b=')+3:url.index('&c=')])
+      end_day = int(url[url.index('&e=')+3:url.index('&f=')])
+      lines = [rows[i] % adjusted_close[i] for i in range(0, 3) if start_day <= 3 - i <= end_day]
+      return StringIO("Date,Open,High,Low,Close,Volume,Adj Close\n" + ''.join(lines))
+    eod = Yahoo('FOO', date(2012, 5, 1), date(2012, 5, 2), fetch=fetch)
+    assert_equal(eod.close_prices, [1800, 1900])
+    fetches = len(requests)
+    assert_raises(ValueError, eod.update, date(2012, 5, 3), overlap=0)
+    assert_equal(len(requests), fetches)
+    assert_true(eod.update(date(2012, 5, 3), overlap=1))
+    assert_true(requests[-2].find('&b=2&c=2012') > 0)
+    assert_equal(eod.close_prices, [1800, 1900, 2000])
+    assert_equal(eod.volumes, [100, 200, 300])
+    assert_equal(eod.get_index_from_date(date(2012, 5, 3)), 2)
+    adjusted_close[0] = '19.50'
+    adjusted_close[1] = '18.50'
+    assert_equal(eod.update(date(2012, 5, 3), overlap=2), False)
+    assert_equal(eod.close_prices, [1800, 1900, 2000])
+    
   @test
   def test_split_only_days(self):
     """Test days with a split and no stock price data."""
@@ -73,6 +188,107 @@ class TestYahoo(TestEndOfDay):
     assert_equal(eod.dividends, [None, None, None]) 
     assert_equal(eod.splits, [None, Split(2,1), None])
     
+RECORDED_PRICES = {
+  'FOO' : "Date,Open,High,Low,Close,Volume,Adj Close\n" +
+          "2012-05-01,19.58,19.95,19.46,19.80,40295400,19.80\n" +
+          "2012-04-30,19.68,19.72,19.44,19.58,35751000,19.58\n",
+  'BAR' : "Date,Open,High,Low,Close,Volume,Adj Close\n" +
+          "2012-05-01,10.00,10.50,9.50,10.25,1000,10.25\n"
+}
+
+RECORDED_ACTIONS = {
+  'FOO' : "Date,Dividends\nDIVIDEND, 20120501,0.170000\nSTARTDATE, 20120430\n",
+  'BAR' : "Date,Dividends\n"
+}
+
+class RecordedYahooHandler(BaseHTTPRequestHandler):
+  """Serves the recorded Yahoo responses, failing the first request for each symbol with a 503."""
+  protocol_version = 'HTTP/1.1'
+  
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    self.server.connections += 1
+  
+  def do_GET(self):
+    url = urlparse(self.path)
+    symbol = parse_qs(url.query)['s'][0]
+    if url.path == '/table.csv':
+      recorded = RECORDED_PRICES
+    else:
+      recorded = RECORDED_ACTIONS
+    if not symbol in self.server.failed:
+      self.server.failed.add(symbol)
+      self.respond(503, 'Unavailable')
+    elif recorded.has_key(symbol):
+      self.respond(200, recorded[symbol])
+    else:
+      self.respond(404, 'Not Found')
+      
+  def respond(self, status, body):
+    self.send_response(status)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+  
+  def log_message(self, *args):
+    pass
+
+class RecordedYahooServer(ThreadingMixIn, HTTPServer):
+  """A local HTTP server for the RecordedYahooHandler."""
+  daemon_threads = True
+  
+  def __init__(self):
+    HTTPServer.__init__(self, ('127.0.0.1', 0), RecordedYahooHandler)
+    self.connections = 0
+    self.failed = set([])
+
+@test
+def test_get_current_prices_and_market_caps():
+  """Test that quotes are requested in batches and parsed in order."""
+  quotes = {'FOO' : '19.80,207.5B', 'BAR' : '10.25,512.1M', 'BAZ' : 'N/A,N/A'}
+  requests = []
+  def fetch(url):
+    requests.append(url)
+    symbols = url[url.index('s=')+2:url.index('&f=')].split('+')
+    return StringIO('\r\n'.join([quotes[symbol] for symbol in symbols]) + '\r\n')
+  (prices, market_caps) = get_current_prices_and_market_caps(['FOO', 'BAR', 'BAZ'], fetch, batch_size=2)
+  assert_equal(len(requests), 2)
+  assert_equal(prices[0:2].tolist(), [1980.0, 1025.0])
+  assert_equal(market_caps[0:2].tolist(), [207.5e9, 512.1e6])
+  assert_true(prices[2] != prices[2])
+  assert_true(market_caps[2] != market_caps[2])
+
+@test
+class TestDownloadSymbols(object):
+  """Tests the download_symbols function against a local server."""
+  
+  @test
+  def test_download_symbols(self):
+    """Test downloading several symbols, with retries, failures, and connection reuse."""
+    server = RecordedYahooServer()
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+      finished = []
+      base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+      (results, failures) = download_symbols(['FOO', 'BAR', 'BAZ'], date(2012, 4, 30), date(2012, 5, 1),
+                                             workers=2, requests_per_second=1000.0, base_url=base_url,
+                                             callback=lambda symbol, eod, error: finished.append(symbol))
+    finally:
+      server.shutdown()
+      server.server_close()
+    assert_equal(sorted(finished), ['BAR', 'BAZ', 'FOO'])
+    assert_equal(sorted(results.keys()), ['BAR', 'FOO'])
+    assert_equal(failures.keys(), ['BAZ'])
+    assert_equal(failures['BAZ'].status, 404)
+    foo = results['FOO']
+    assert_equal(foo.dates, [date(2012, 4, 30), date(2012, 5, 1)])
+    assert_equal(foo.close_prices, [1958, 1980])
+    assert_equal(foo.dividends, [None, 17.0])
+    assert_equal(results['BAR'].open_prices, [1000])
+    assert_true(server.connections <= 2)
+
 if __name__ == "__main__":
   from proboscis import TestProgram
   TestProgram().run_and_exit()
\ No newline at end of file
@@ -23,7 +23,9 @@ from proboscis import test
 from proboscis.asserts import assert_equal
 from proboscis.asserts import assert_not_equal
 from proboscis.asserts import assert_false
+from proboscis.asserts import assert_true
 from djscrooge.backtest import Portfolio, EndOfDay, Split, OpenPosition, Backtest, Strategy, Taxes, Commissions
+from math import log, sqrt
 from datetime import date
 from datetime import timedelta
 from proboscis.decorators import before_class
@@ -111,6 +113,7 @@ def get_mock_end_of_day_class(open_prices, high_prices=None, low_prices=None, cl
         self.high_prices.append(high_prices[i % n])
         self.low_prices.append(low_prices[i % n])
         self.close_prices.append(close_prices[i % n])
+        self.adj_close_prices.append(close_prices[i % n])
         self.dividends.append(dividends[i % n])
         self.splits.append(splits[i % n])
         self.volumes.append(volumes[i % n])
@@ -181,6 +184,28 @@ class TestEndOfDay(object):
     assert_equal(eod.get_index_from_date(start + timedelta(1)), 1)
     assert_equal(eod.get_index_from_date(start + timedelta(2)), 2)
     
+  @test
+  def test_merge_tail(self):
+    """Test the merge_tail method."""
+    start = date(2000,1,1)
+    end_of_day_class = get_mock_end_of_day_class([1, 2, 3, 4, 5, 6])
+    def get_eod(first_day, last_day):
+      eod = end_of_day_class('FOO', start, start + timedelta(last_day))
+      for column in [eod.dates, eod.open_prices, eod.high_prices, eod.low_prices, eod.close_prices,
+                     eod.adj_close_prices, eod.dividends, eod.splits, eod.volumes]:
+        del column[0:first_day]
+      return eod
+    eod = get_eod(0, 3)
+    assert_equal(eod.get_index_from_date(start + timedelta(3)), 3)
+    assert_true(eod.merge_tail(get_eod(2, 5)))
+    assert_equal(eod.open_prices, [1, 2, 3, 4, 5, 6])
+    assert_equal(eod.get_index_from_date(start + timedelta(5)), 5)
+    changed = get_eod(4, 5)
+    changed.close_prices[0] = 0
+    assert_false(eod.merge_tail(changed))
+    assert_false(eod.merge_tail(get_eod(6, 7)))
+    assert_equal(len(eod.dates), 6)
+    
     
 @test(groups=['backtest'], depends_on_groups=['portfolio', 'end_of_day'])
 class TestBacktest(object):
@@ -193,7 +218,60 @@ class TestBacktest(object):
     end = start + timedelta(3)
     backtest = Backtest(start, end, end_of_day_class=get_mock_end_of_day_class([1,2,3,4]))
     assert_equal(backtest.simulation_date, end)
-        
+
+  @test
+  def test_performance(self):
+    """Test the performance statistics computed during the simulation."""
+    end_of_day_class = get_mock_end_of_day_class([4, 8, 2, 4])
+    start = date(2000,1,1)
+    portfolio = Portfolio(0)
+    portfolio.add_position(OpenPosition('FOO', start - timedelta(1), 1, 1))
+    backtest = Backtest(start, start + timedelta(3), end_of_day_class=end_of_day_class, portfolio=portfolio)
+    performance = backtest.performance
+    returns = [log(2.0), log(0.25), log(2.0)]
+    mean = sum(returns) / 3.0
+    variance = sum([(x - mean) ** 2 for x in returns]) / 2.0
+    assert_equal(performance.days, 4)
+    assert_equal(performance.total_return, 0.0)
+    assert_equal(performance.max_drawdown, 0.75)
+    assert_equal(performance.exposure, 1.0)
+    assert_equal(performance.turnover, 0.0)
+    assert_true(abs(backtest.analytics.log_return_mean - mean) < 1.0e-12)
+    assert_true(abs(performance.volatility - sqrt(variance * 252)) < 1.0e-12)
+    
+  @test
+  def test_returns(self):
+    """Test the return arrays of the Backtest class."""
+    end_of_day_class = get_mock_end_of_day_class([4, 8, 2, 4])
+    start = date(2000,1,1)
+    portfolio = Portfolio(0)
+    portfolio.add_position(OpenPosition('FOO', start - timedelta(1), 1, 1))
+    backtest = Backtest(start, start + timedelta(3), end_of_day_class=end_of_day_class, portfolio=portfolio)
+    assert_equal(backtest.close_returns.tolist(), [1.0, -0.75, 1.0])
+    assert_equal(backtest.open_returns.tolist(), [1.0, -0.75, 1.0])
+    assert_equal(backtest.close_log_returns.tolist(), [log(2.0), log(0.25), log(2.0)])
+    assert_true(backtest.close_log_returns is backtest.close_log_returns)
+    backtest.open_values = [1, 2]
+    assert_equal(backtest.open_log_returns.tolist(), [log(2.0)])
+
+  @test
+  def test_preload(self):
+    """Test that the Backtest class preloads symbols with one call to load_many."""
+    mock_class = get_mock_end_of_day_class([1, 2, 3, 4])
+    loads = []
+    class LoadManyEndOfDay(mock_class):
+      @classmethod
+      def load_many(cls, symbols, start_date, end_date):
+        loads.append(sorted(symbols))
+        return super(LoadManyEndOfDay, cls).load_many(symbols, start_date, end_date)
+    start = date(2000,1,1)
+    backtest = Backtest(start, start + timedelta(3), end_of_day_class=LoadManyEndOfDay,
+                        preload_symbols=['FOO', 'BAR'])
+    backtest.preload(['BAR', 'BAZ'])
+    assert_equal(loads, [['BAR', 'FOO'], ['BAZ']])
+    assert_equal(backtest.get_end_of_day('FOO').open_prices, [1, 2, 3, 4])
+    assert_equal(backtest.get_close_data('BAZ', start + timedelta(2)).close_price, 3)
+
 def get_mock_strategy_class(execute_method):
   """Returns a strategy subclass which tracks the current execution day in the variable day.
   
@@ -290,6 +368,7 @@ class TestCommissions(object):
                         portfolio=portfolio)
     expected = [103, 201, 200, 199]
     assert_equal(backtest.values, expected)
+    assert_equal(backtest.analytics.traded_value, 300)
 
 @test(depends_on_groups=['portfolio', 'end_of_day', 'strategy', 'backtest'])
 class TestTaxes(object):
@@ -0,0 +1,97 @@
+"""This file contains tests for the charting module of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies: 
+    proboscis: <https://github.com/rackspace/python-proboscis>
+"""
+from proboscis import test
+from proboscis.asserts import assert_equal
+from djscrooge.charting import largest_triangle_three_buckets, min_max_buckets, get_chart_series, \
+  chart_backtests_to_directory
+from djscrooge.backtest import Backtest
+from datetime import date, timedelta
+from numpy import arange, sin
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+import subprocess
+import sys
+
+@test
+def test_largest_triangle_three_buckets():
+  """Test the largest_triangle_three_buckets function."""
+  x = arange(7) * 1.0
+  y = arange(7) * 0.0
+  y[2] = 5.0
+  y[4] = -5.0
+  assert_equal(largest_triangle_three_buckets(x, y, 4).tolist(), [0, 2, 4, 6])
+  assert_equal(largest_triangle_three_buckets(x, y, 10).tolist(), range(0, 7))
+  
+@test
+def test_min_max_buckets():
+  """Test the min_max_buckets function."""
+  y = arange(8) * 0.0
+  y[1] = 3.0
+  y[2] = -1.0
+  y[5] = 7.0
+  assert_equal(min_max_buckets(y, 4).tolist(), [0, 1, 2, 4, 5, 7])
+  
+@test
+def test_get_chart_series():
+  """Test that get_chart_series converts to dollars and keeps the requested number of points."""
+  backtest = Backtest(date(1900,1,1), date(1900,1,1))
+  backtest.dates = [date(2000,1,1) + timedelta(i) for i in range(0, 1000)]
+  backtest.values = (sin(arange(1000) / 10.0) * 1000 + 10000).astype(int).tolist()
+  (dates, values) = get_chart_series(backtest)
+  assert_equal(values[3], backtest.values[3] / 100.0)
+  (dates, values) = get_chart_series(backtest, 100)
+  assert_equal(len(dates), 100)
+  assert_equal(len(values), 100)
+  assert_equal(dates[-1], backtest.dates[-1])
+  assert_equal(values[-1], backtest.values[-1] / 100.0)
+  (dates, values) = get_chart_series(backtest, 100, 'min_max')
+  assert_equal(max(values), max(backtest.values) / 100.0)
+  assert_equal(min(values), min(backtest.values) / 100.0)
+
+@test
+def test_chart_backtests_to_directory():
+  """Test that chart_backtests_to_directory writes every chart."""
+  backtest = Backtest(date(1900,1,1), date(1900,1,1))
+  backtest.dates = [date(2000,1,1) + timedelta(i) for i in range(0, 100)]
+  backtest.values = range(10000, 10100)
+  directory = mkdtemp()
+  try:
+    charts = [('first', [backtest], {'title' : 'First'}),
+              ('second', [backtest, backtest], {'labels' : ['A', 'B'], 'colors' : ['g', 'b'], 'max_points' : 10})]
+    file_names = chart_backtests_to_directory(charts, directory, 'svg', processes=2)
+    assert_equal(file_names, [os.path.join(directory, 'first.svg'), os.path.join(directory, 'second.svg')])
+    for file_name in file_names:
+      assert_equal(os.path.getsize(file_name) > 0, True)
+  finally:
+    rmtree(directory)
+
+@test
+def test_import_without_pyplot():
+  """Test that importing the charting module does not load pyplot."""
+  loaded = subprocess.check_output([sys.executable, '-c', 
+    'import sys, djscrooge.charting; print "matplotlib.pyplot" in sys.modules'])
+  assert_equal(loaded.strip(), 'False')
+
+if __name__ == "__main__":
+  from proboscis import TestProgram
+  TestProgram().run_and_exit()
@@ -0,0 +1,104 @@
+"""This module contains tests for the config module of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies: 
+    proboscis: <https://github.com/rackspace/python-proboscis>
+"""
+from proboscis import test
+from proboscis.asserts import assert_equal
+from proboscis.asserts import assert_true
+from djscrooge.config import Config
+import os
+
+class StandInClient(object):
+  """Records the arguments a MongoDB client is created with."""
+  
+  def __init__(self, host, port, **options):
+    self.host = host
+    self.port = port
+    self.options = options
+    self.pid = os.getpid()
+
+@test
+class TestMongodbConnection(object):
+  """Tests the MONGODB_CONNECTION property of the Config class."""
+  
+  def __init__(self):
+    self.factory = Config.MONGODB_CLIENT_FACTORY
+    self.connection = Config._Config__mongodb_connection
+    self.pid = Config._Config__mongodb_pid
+    
+  def set_up(self):
+    Config.MONGODB_CLIENT_FACTORY = StandInClient
+    Config._Config__mongodb_connection = None
+    
+  def tear_down(self):
+    Config.MONGODB_CLIENT_FACTORY = self.factory
+    Config._Config__mongodb_connection = self.connection
+    Config._Config__mongodb_pid = self.pid
+  
+  @test
+  def test_options(self):
+    """Test that the client is created once per process with the configured pool and timeouts."""
+    self.set_up()
+    try:
+      connection = Config().MONGODB_CONNECTION
+      assert_true(connection is Config().MONGODB_CONNECTION)
+      assert_equal(connection.host, Config.MONGODB_HOST)
+      assert_equal(connection.options['maxPoolSize'], Config.MONGODB_MAX_POOL_SIZE)
+      assert_equal(connection.options['connectTimeoutMS'], Config.MONGODB_CONNECT_TIMEOUT_MS)
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_default_client(self):
+    """Test that pymongo.MongoClient is the default client, and accepts the configured options."""
+    self.set_up()
+    try:
+      from pymongo import MongoClient
+      Config.MONGODB_CLIENT_FACTORY = None
+      connection = Config().MONGODB_CONNECTION
+      try:
+        assert_true(isinstance(connection, MongoClient))
+      finally:
+        connection.close()
+    finally:
+      self.tear_down()
+      
+  @test
+  def test_fork(self):
+    """Test that a forked child process gets its own client."""
+    self.set_up()
+    try:
+      parent_connection = Config().MONGODB_CONNECTION
+      pid = os.fork()
+      if pid == 0:
+        connection = Config().MONGODB_CONNECTION
+        status = 0
+        if connection is parent_connection or connection.pid != os.getpid():
+          status = 1
+        os._exit(status)
+      (pid, status) = os.waitpid(pid, 0)
+      assert_equal(status, 0)
+      assert_true(Config().MONGODB_CONNECTION is parent_connection)
+    finally:
+      self.tear_down()
+
+if __name__ == "__main__":
+  from proboscis import TestProgram
+  TestProgram().run_and_exit()
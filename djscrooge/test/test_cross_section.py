@@ -0,0 +1,107 @@
+"""This module contains tests for the cross_section module of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies: 
+    proboscis: <https://github.com/rackspace/python-proboscis>
+    numpy: <http://numpy.scipy.org/>
+"""
+from proboscis import test
+from proboscis.asserts import assert_equal
+from proboscis.asserts import assert_true
+from djscrooge.backtest import Backtest, EndOfDay
+from djscrooge.config import Config
+from djscrooge.cross_section import UniversePanel, top_k, bottom_k
+from djscrooge.library.strategy.biggest_loser import BiggestLoser
+from datetime import date, timedelta
+from numpy import array, isnan, nan
+
+PRICES = {'AAA' : [(10, 9), (10, 12), (10, 7)],
+          'BBB' : [(20, 15), (20, 21), (20, 19)],
+          'CCC' : [None, (30, 30), (30, 35)]}
+
+class PanelEndOfDay(EndOfDay):
+  """An EndOfDay class serving the (open, close) prices of PRICES, starting on 2000-01-03."""
+  
+  def __init__(self, symbol, start_date, end_date):
+    super(PanelEndOfDay, self).__init__(symbol, start_date, end_date)
+    if not PRICES.has_key(symbol):
+      raise KeyError('No prices for ' + symbol + '.')
+    for (i, prices) in enumerate(PRICES[symbol]):
+      if prices is not None:
+        self.dates.append(date(2000, 1, 3) + timedelta(i))
+        self.open_prices.append(prices[0])
+        self.close_prices.append(prices[1])
+        self.high_prices.append(max(prices))
+        self.low_prices.append(min(prices))
+        self.adj_close_prices.append(prices[1])
+        self.volumes.append(100)
+        self.dividends.append(None)
+        self.splits.append(None)
+
+@test
+def test_top_k():
+  """Test that the top_k and bottom_k functions order each row and skip NaN values."""
+  values = array([[3.0, 1.0, 2.0, 5.0],
+                  [nan, 4.0, nan, nan]])
+  assert_equal(top_k(values, 2).tolist(), [[3, 0], [1, -1]])
+  assert_equal(bottom_k(values, 3).tolist(), [[1, 2, 0], [1, -1, -1]])
+  assert_equal(top_k(values, 9).tolist(), [[3, 0, 2, 1], [1, -1, -1, -1]])
+
+@test
+def test_universe_panel():
+  """Test the UniversePanel class."""
+  panel = UniversePanel.load(PanelEndOfDay, ['AAA', 'BBB', 'CCC', 'XXX'], date(2000, 1, 3), 
+                             date(2000, 1, 5))
+  assert_equal(panel.symbols, ['AAA', 'BBB', 'CCC'])
+  assert_equal(panel.failed_symbols, ['XXX'])
+  assert_true(isinstance(panel.errors['XXX'], KeyError))
+  assert_true(isinstance(panel.load_error, KeyError))
+  opens = panel.get('open')
+  assert_equal(opens.shape, (3, 3))
+  assert_true(isnan(opens[0, 2]))
+  losers = panel.rank(lambda p: p.get('open') - p.get('close'), 1)
+  assert_equal(losers[date(2000, 1, 3)], ['BBB'])
+  assert_equal(losers[date(2000, 1, 5)], ['AAA'])
+  laggards = panel.rank(lambda p: p.get('close') / p.get('open'), 2, largest=False)
+  assert_equal(laggards[date(2000, 1, 4)], ['CCC', 'BBB'])
+
+class PanelBiggestLoser(BiggestLoser):
+  """The BiggestLoser strategy over the symbols of PRICES."""
+  
+  def get_symbols(self):
+    return ['AAA', 'BBB', 'CCC']
+
+@test
+def test_biggest_loser():
+  """Test that BiggestLoser holds the symbol which lost the most from open to close the day before."""
+  symbol_for_all_dates = Config.BACKTEST_SYMBOL_FOR_ALL_DATES
+  Config.BACKTEST_SYMBOL_FOR_ALL_DATES = 'AAA'
+  try:
+    backtest = Backtest(date(2000, 1, 3), date(2000, 1, 5), strategy_class=PanelBiggestLoser,
+                        end_of_day_class=PanelEndOfDay)
+  finally:
+    Config.BACKTEST_SYMBOL_FOR_ALL_DATES = symbol_for_all_dates
+  strategy = backtest.strategy
+  assert_equal(strategy.panel.load_error, None)
+  assert_equal(strategy.biggest_losers, {date(2000, 1, 4) : 'BBB', date(2000, 1, 5) : 'CCC'})
+  assert_equal(backtest.portfolio.symbols, set(['CCC']))
+  assert_equal(backtest.portfolio.get_positions('CCC')[0].purchase_date, date(2000, 1, 5))
+
+if __name__ == "__main__":
+  from proboscis import TestProgram
+  TestProgram().run_and_exit()
@@ -19,8 +19,10 @@ Copyright (C) 2012  James Adam Cataldo
 from proboscis import test
 from djscrooge.backtest import Backtest
 from datetime import date
-from djscrooge.hypothesis_test import get_log_daily_returns, hypothesis_test
-from proboscis.asserts import assert_equal, assert_true
+import djscrooge.hypothesis_test
+from djscrooge.hypothesis_test import get_log_daily_returns, hypothesis_test, \
+  sequential_hypothesis_test, batch_hypothesis_test, adjust_p_values
+from proboscis.asserts import assert_equal, assert_true, assert_raises
 from math import exp
 from numpy import power
 
@@ -49,6 +51,101 @@ def test_hypothesis_test():
   assert_true(abs(actual_mean - 100.0) < 0.000001)
   assert_equal(actual_p_value, 0.0)
 
+@test
+def test_hypothesis_test_seed():
+  """Test that the hypothesis_test function is reproducible and leaves its inputs untouched."""
+  test_returns = [0.01, -0.02, 0.015, 0.003, -0.004, 0.02, -0.01]
+  benchmark_returns = [0.002, 0.001, -0.001, 0.0, 0.003, 0.001, 0.002]
+  test_copy = list(test_returns)
+  benchmark_copy = list(benchmark_returns)
+  (mean1, p_value1) = hypothesis_test(test_returns, benchmark_returns, seed=42)
+  (mean2, p_value2) = hypothesis_test(test_returns, benchmark_returns, seed=42, chunk_size=7)
+  assert_equal(test_returns, test_copy)
+  assert_equal(benchmark_returns, benchmark_copy)
+  assert_equal(mean1, mean2)
+  assert_equal(p_value1, p_value2)
+  assert_true(p_value1 > 0.0 and p_value1 < 100.0)
+
+@test
+def test_sequential_hypothesis_test():
+  """Test that the sequential_hypothesis_test function stops early and ignores the process count."""
+  test_returns = [0.01 * ((i * 7) % 5 - 2) for i in range(0, 200)]
+  benchmark_returns = [0.05] * 200
+  (excess_return, p_value, resamples) = sequential_hypothesis_test(test_returns, benchmark_returns,
+                                                                   batch_size=100, processes=1, seed=3)
+  assert_true(excess_return < 0.0)
+  assert_equal(p_value, 100.0)
+  assert_equal(resamples, 100)
+  serial = sequential_hypothesis_test(test_returns, [0.0] * 200, batch_size=100, processes=1, seed=3)
+  parallel = sequential_hypothesis_test(test_returns, [0.0] * 200, batch_size=100, processes=2, seed=3)
+  assert_equal(serial, parallel)
+  assert_raises(ValueError, sequential_hypothesis_test, test_returns, benchmark_returns,
+                max_resamples=0, processes=1)
+
+class RecordingPool(object):
+  """A stand-in for multiprocessing.Pool, recording the tasks submitted and running each on request."""
+  
+  submitted = []
+  
+  def __init__(self, processes):
+    RecordingPool.submitted = []
+  
+  def apply_async(self, function, arguments):
+    RecordingPool.submitted.append(arguments)
+    return RecordingResult(function, arguments)
+  
+  def terminate(self):
+    pass
+  
+  def join(self):
+    pass
+  
+class RecordingResult(object):
+  """The result of a RecordingPool task."""
+  
+  def __init__(self, function, arguments):
+    self.function = function
+    self.arguments = arguments
+  
+  def get(self):
+    return self.function(*self.arguments)
+
+@test
+def test_sequential_hypothesis_test_waves():
+  """Test that batches are submitted at most one per process ahead of those counted."""
+  test_returns = [0.01 * ((i * 7) % 5 - 2) for i in range(0, 200)]
+  pool = djscrooge.hypothesis_test.Pool
+  djscrooge.hypothesis_test.Pool = RecordingPool
+  try:
+    (excess_return, p_value, resamples) = sequential_hypothesis_test(test_returns, [0.05] * 200,
+                                                                     batch_size=100, processes=3, seed=3)
+  finally:
+    djscrooge.hypothesis_test.Pool = pool
+  assert_equal(resamples, 100)
+  assert_equal(len(RecordingPool.submitted), 3)
+
+@test
+def test_batch_hypothesis_test():
+  """Test that the batch_hypothesis_test function matches hypothesis_test on each strategy."""
+  test_returns = [[0.01 * (((i + j) * 7) % 5 - 2) + 0.001 * j for i in range(0, 50)] for j in range(0, 4)]
+  benchmark_returns = [0.001 * (i % 3) for i in range(0, 50)]
+  (excess_returns, p_values) = batch_hypothesis_test(test_returns, benchmark_returns, k=500, seed=5,
+                                                     chunk_size=64)
+  for j in range(0, 4):
+    (excess_return, p_value) = hypothesis_test(test_returns[j], benchmark_returns, k=500, seed=5)
+    assert_true(abs(excess_returns[j] - excess_return) < 1.0e-10)
+    assert_true(abs(p_values[j] - p_value) < 1.0e-10)
+  adjusted = batch_hypothesis_test(test_returns, benchmark_returns, k=500, seed=5, adjustment='bonferroni')[1]
+  assert_equal(adjusted.tolist(), adjust_p_values(p_values, 'bonferroni').tolist())
+
+@test
+def test_adjust_p_values():
+  """Test the adjust_p_values function."""
+  p_values = [4.0, 1.0, 3.0, 60.0]
+  assert_equal(adjust_p_values(p_values, 'bonferroni').tolist(), [16.0, 4.0, 12.0, 100.0])
+  assert_equal(adjust_p_values(p_values, 'holm').tolist(), [9.0, 4.0, 9.0, 60.0])
+  assert_equal(adjust_p_values(p_values, 'benjamini_hochberg').tolist(), [16.0 / 3.0, 4.0, 16.0 / 3.0, 60.0])
+
 if __name__ == "__main__":
   from proboscis import TestProgram
   TestProgram().run_and_exit()
\ No newline at end of file
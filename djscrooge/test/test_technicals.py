@@ -19,7 +19,8 @@ Copyright (C) 2012  James Adam Cataldo
 from djscrooge.technicals import simple_moving_average, accumulate, \
   channel_breakout, channel_normalization, on_balance_volume, \
   accumulation_distribution_volume, money_flow, negative_volume_index, \
-  advance_decline_ratio, net_volume_ratio, high_low_ratio, capm
+  advance_decline_ratio, net_volume_ratio, high_low_ratio, capm, rolling_capm, IndicatorPipeline
+from djscrooge.backtest import EndOfDay
 from proboscis import test
 from proboscis.asserts import assert_equal, assert_true
 
@@ -88,6 +89,31 @@ def test_money_flow():
   expected = [0.0, -0.5 * (5.0/3.0), 0.5 * (7.0/3.0), -1.0 * (4.0/3.0), 1.0 * (8.0/3.0)]
   assert_equal(actual, expected)
   
+@test
+def test_indicator_pipeline():
+  """Test that the IndicatorPipeline class matches the list functions and shares intermediates."""
+  eod = EndOfDay('FOO', None, None)
+  eod.open_prices = [2, 2, 2, 2, 2]
+  eod.high_prices = [4, 4, 4, 4, 4]
+  eod.low_prices = [0, 0, 0, 0, 0]
+  eod.close_prices = [2, 1, 3, 0, 4]
+  eod.adj_close_prices = eod.close_prices
+  eod.volumes = [1, 2, 1, 2, 3]
+  calls = []
+  def range_factor(high, low, close):
+    calls.append(1)
+    return ((close - low) - (high - close)) * 1.0 / (high - low)
+  pipeline = IndicatorPipeline(eod)
+  pipeline.define('range_factor', range_factor, 'high', 'low', 'close')
+  (adv, flow) = pipeline.evaluate('accumulation_distribution_volume', 'money_flow')
+  assert_equal(len(calls), 1)
+  assert_equal(adv.tolist(), accumulation_distribution_volume(eod.high_prices, eod.low_prices,
+                                                              eod.close_prices, eod.volumes))
+  assert_equal(flow.tolist(), money_flow(eod.high_prices, eod.low_prices, eod.close_prices, eod.volumes))
+  assert_equal(pipeline.get('volume_deltas').tolist(), [0, 1, -1, 1, 1])
+  assert_equal(pipeline.get('on_balance_volume').tolist(), on_balance_volume(eod.close_prices, eod.volumes))
+  assert_equal(pipeline.get('negative_volume_index').tolist(), [0.0, 0.0, 200.0, 0.0, 0.0])
+  
 @test
 def test_negative_volume_index():
   """Test the negative_volume_index function."""
@@ -139,6 +165,28 @@ def test_capm():
   assert_true(abs(beta - 2.0) < 1.0e-8)
   assert_true(abs(r - 1.0) < 1.0e-8)
 
+@test
+def test_rolling_capm():
+  """Test the rolling_capm function against the capm function."""
+  market = [100.0, 101.0, 99.0, 102.0, 104.0, 103.0, 107.0]
+  investments = [[50.0, 51.0, 48.0, 50.5, 53.0, 52.0, 56.0],
+                 [10.0, 10.2, 10.1, 10.0, 10.4, 10.3, 10.9]]
+  (alpha, beta, r) = rolling_capm(investments, market, [3, 4], 0.001)
+  assert_equal(alpha.shape, (2, 2, 6))
+  for (k, window) in enumerate([3, 4]):
+    for j in range(0, len(investments)):
+      for i in range(0, window - 1):
+        assert_true(alpha[k][j][i] != alpha[k][j][i])
+      for i in range(window - 1, 6):
+        start = i + 1 - window
+        expected = capm(investments[j][start:i+2], market[start:i+2], 0.001)
+        assert_true(abs(alpha[k][j][i] - expected[0]) < 1.0e-10)
+        assert_true(abs(beta[k][j][i] - expected[1]) < 1.0e-10)
+        assert_true(abs(r[k][j][i] - expected[2]) < 1.0e-10)
+  (alpha, beta, r) = rolling_capm(investments[0], market, 6)
+  assert_equal(beta.shape, (1, 6))
+  assert_true(abs(beta[0][5] - capm(investments[0], market)[1]) < 1.0e-10)
+
 if __name__ == "__main__":
   from proboscis import TestProgram
   TestProgram().run_and_exit()
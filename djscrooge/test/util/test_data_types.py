@@ -24,7 +24,8 @@ from proboscis.asserts import assert_equal
 from proboscis.asserts import assert_true
 from proboscis.asserts import assert_false
 from proboscis.asserts import assert_raises
-from djscrooge.util.data_types import OrderedSet, glb_index_in_sorted_list, iterator_to_list, index_in_sorted_list
+from djscrooge.util.data_types import OrderedSet, glb_index_in_sorted_list, iterator_to_list, index_in_sorted_list, \
+  LRUCache
 
 @test
 class TestOrderedSet(object):
@@ -145,6 +146,26 @@ def test_glb_index_in_sorted_list():
   expected = 1
   assert_equal(glb_index_in_sorted_list(x, list), expected)
 
+@test
+def test_lru_cache():
+  """Test that the LRUCache class evicts the least recently used item and counts lookups."""
+  cache = LRUCache(2)
+  cache.put('a', 1)
+  cache.put('b', 2)
+  assert_equal(cache.get('a'), 1)
+  cache.put('c', 3)
+  assert_equal(len(cache), 2)
+  assert_false('b' in cache)
+  assert_equal(cache.get('b'), None)
+  assert_equal(cache.get('c'), 3)
+  assert_equal((cache.hits, cache.misses), (2, 1))
+  cache.put('d', 4)
+  cache.resize(1)
+  assert_equal(len(cache), 1)
+  assert_true('d' in cache)
+  cache.clear()
+  assert_equal((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
 if __name__ == "__main__":
   from proboscis import TestProgram
   TestProgram().run_and_exit()
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""This file contains tests for the http_pool module of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies: 
+    proboscis: <https://github.com/rackspace/python-proboscis>
+"""
+from proboscis import test
+from proboscis.asserts import assert_true
+from proboscis.asserts import assert_equal
+from proboscis.asserts import assert_raises
+from djscrooge.util.http_pool import backoff_delay, RateLimiter, PersistentHttpClient, open_connection
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from httplib import HTTPConnection, HTTPSConnection
+from threading import Thread, Lock
+from time import time, sleep
+
+@test
+def test_backoff_delay():
+  """Test that the backoff_delay function grows exponentially up to the cap."""
+  for attempt in range(0, 10):
+    delay = backoff_delay(attempt, base=1.0, cap=8.0)
+    assert_true(delay >= 0.0)
+    assert_true(delay <= min(8.0, 2.0 ** attempt))
+    
+@test
+def test_rate_limiter():
+  """Test that the RateLimiter class spaces out events."""
+  limiter = RateLimiter(100.0)
+  start = time()
+  for i in range(0, 6):
+    limiter.wait()
+  assert_true(time() - start >= 0.05)
+
+@test
+def test_open_connection():
+  """Test that the connection class follows the URL scheme."""
+  assert_true(isinstance(open_connection('http', 'example.com', 1.0), HTTPConnection))
+  assert_true(isinstance(open_connection('https', 'example.com', 1.0), HTTPSConnection))
+  assert_raises(ValueError, open_connection, 'ftp', 'example.com', 1.0)
+
+class CountingHandler(BaseHTTPRequestHandler):
+  """Answers every request with 'ok', counting the connections opened and closed."""
+  protocol_version = 'HTTP/1.1'
+  
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    with self.server.lock:
+      self.server.opened += 1
+    
+  def finish(self):
+    BaseHTTPRequestHandler.finish(self)
+    with self.server.lock:
+      self.server.closed += 1
+  
+  def do_GET(self):
+    self.send_response(200)
+    self.send_header('Content-Length', '2')
+    self.end_headers()
+    self.wfile.write('ok')
+    
+  def log_message(self, *args):
+    pass
+
+class CountingServer(ThreadingMixIn, HTTPServer):
+  """A local HTTP server for the CountingHandler."""
+  daemon_threads = True
+  
+  def __init__(self):
+    HTTPServer.__init__(self, ('127.0.0.1', 0), CountingHandler)
+    self.lock = Lock()
+    self.opened = 0
+    self.closed = 0
+
+@test
+def test_close():
+  """Test that close shuts the connections opened by every thread."""
+  server = CountingServer()
+  thread = Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  try:
+    client = PersistentHttpClient(1000.0)
+    url = 'http://127.0.0.1:%d/' % server.server_address[1]
+    threads = [Thread(target=lambda: [client.get(url).read() for i in range(0, 3)]) for i in range(0, 2)]
+    for worker in threads:
+      worker.start()
+    for worker in threads:
+      worker.join()
+    assert_equal(server.opened, 2)
+    client.close()
+    deadline = time() + 5.0
+    while server.closed < 2 and time() < deadline:
+      sleep(0.01)
+    assert_equal(server.closed, 2)
+  finally:
+    server.shutdown()
+    server.server_close()
+
+if __name__ == "__main__":
+  from proboscis import TestProgram
+  TestProgram().run_and_exit()
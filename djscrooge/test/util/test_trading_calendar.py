@@ -0,0 +1,70 @@
+"""This module contains tests for the trading_calendar module of the DJ Scrooge backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+Dependencies: 
+    proboscis: <https://github.com/rackspace/python-proboscis>
+"""
+from proboscis import test
+from proboscis.asserts import assert_equal
+from proboscis.asserts import assert_true
+from proboscis.asserts import assert_false
+from djscrooge.util.trading_calendar import easter, get_holidays, is_trading_day, \
+  last_completed_session
+from datetime import date, datetime
+
+@test
+def test_easter():
+  """Test the easter function."""
+  assert_equal(date(2012, 4, 8), easter(2012))
+  assert_equal(date(2019, 4, 21), easter(2019))
+  assert_equal(date(2024, 3, 31), easter(2024))
+
+@test
+def test_get_holidays():
+  """Test the get_holidays function against the published NYSE holidays."""
+  expected = set([date(2022, 1, 17), date(2022, 2, 21), date(2022, 4, 15), date(2022, 5, 30),
+                  date(2022, 6, 20), date(2022, 7, 4), date(2022, 9, 5), date(2022, 11, 24),
+                  date(2022, 12, 26)])
+  assert_equal(expected, get_holidays(2022))
+  assert_true(date(2012, 10, 29) in get_holidays(2012))
+  assert_true(date(2021, 12, 31) not in get_holidays(2021))
+  assert_true(date(2021, 6, 18) not in get_holidays(2021))
+
+@test
+def test_is_trading_day():
+  """Test the is_trading_day function."""
+  assert_true(is_trading_day(date(2012, 7, 3)))
+  assert_false(is_trading_day(date(2012, 7, 4)))
+  assert_false(is_trading_day(date(2012, 7, 7)))
+
+@test
+def test_last_completed_session():
+  """Test that the last_completed_session function skips weekends, holidays and open sessions."""
+  now = datetime(2012, 7, 9, 21, 0)
+  assert_equal(date(2012, 7, 6), last_completed_session(date(2012, 7, 8), now))
+  assert_equal(date(2012, 7, 3), last_completed_session(date(2012, 7, 4), now))
+  assert_equal(date(2012, 7, 9), last_completed_session(date(2012, 7, 9), now))
+  assert_equal(date(2012, 7, 9), last_completed_session(None, now))
+  now = datetime(2012, 7, 9, 19, 59)
+  assert_equal(date(2012, 7, 6), last_completed_session(date(2012, 7, 31), now))
+  now = datetime(2012, 12, 24, 18, 1)
+  assert_equal(date(2012, 12, 24), last_completed_session(None, now))
+
+if __name__ == "__main__":
+  from proboscis import TestProgram
+  TestProgram().run_and_exit()
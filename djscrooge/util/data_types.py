@@ -16,6 +16,8 @@ Copyright (C) 2012  James Adam Cataldo
     You should have received a copy of the GNU General Public License
     along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
 """
+from collections import OrderedDict
+from threading import Lock
 
 class Node(object):
   """A doubly-linkned list node object"""
@@ -132,6 +134,66 @@ class OrderedSet(object):
     """Returnes the number of elements in teh set."""
     return self.__length
   
+class LRUCache(object):
+  """A thread-safe mapping holding at most max_size items, which evicts the least recently used.
+  
+  The hits and misses attributes count the lookups made with get, for tuning max_size.
+  """
+  
+  def __init__(self, max_size):
+    """Construct a new LRUCache holding at most max_size items."""
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self.__items = OrderedDict()
+    self.__lock = Lock()
+    
+  def get(self, key, default=None):
+    """Returns the item of the given key, marking it as the most recently used, or default."""
+    with self.__lock:
+      if not key in self.__items:
+        self.misses += 1
+        return default
+      self.hits += 1
+      value = self.__items.pop(key)
+      self.__items[key] = value
+      return value
+    
+  def put(self, key, value):
+    """Adds or replaces the item of the given key, evicting the least recently used items if full."""
+    with self.__lock:
+      if key in self.__items:
+        del self.__items[key]
+      self.__items[key] = value
+      self.__evict()
+        
+  def resize(self, max_size):
+    """Sets max_size, evicting the least recently used items if the cache holds more."""
+    with self.__lock:
+      self.max_size = max_size
+      self.__evict()
+        
+  def clear(self):
+    """Removes all the items and resets the hit and miss counters."""
+    with self.__lock:
+      self.__items.clear()
+      self.hits = 0
+      self.misses = 0
+      
+  def __contains__(self, key):
+    """Returns True if the given key is in the cache, without counting a hit or a miss."""
+    with self.__lock:
+      return key in self.__items
+    
+  def __len__(self):
+    """Returns the number of items in the cache."""
+    with self.__lock:
+      return len(self.__items)
+    
+  def __evict(self):
+    while len(self.__items) > self.max_size:
+      self.__items.popitem(last=False)
+  
 def iterator_to_list(iterator):
   """Given an arbitrary iterator, create a list of the values.
   
@@ -0,0 +1,157 @@
+"""This module contains a pooled, rate-limited HTTP client of the DJ Scrooge Backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from httplib import HTTPConnection, HTTPSConnection, HTTPException
+from urlparse import urlparse
+from StringIO import StringIO
+from threading import Lock, local
+from random import uniform
+from time import sleep, time
+import socket
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+  """Returns a random delay, in seconds, before retrying after the given number of failed attempts.
+  
+  The delay is drawn uniformly between zero and min(cap, base * 2 ** attempt). This is exponential
+  backoff with full jitter, which keeps many clients retrying at once from doing so in lockstep.
+  """
+  return uniform(0, min(cap, base * 2 ** attempt))
+
+class RateLimiter(object):
+  """Spaces out events to at most the given number per second, across all threads."""
+  
+  def __init__(self, events_per_second):
+    """Construct a RateLimiter allowing the given number of events per second."""
+    self.interval = 1.0 / events_per_second
+    self.__lock = Lock()
+    self.__next_time = 0.0
+    
+  def wait(self):
+    """Block until the next event is allowed."""
+    with self.__lock:
+      now = time()
+      start = max(now, self.__next_time)
+      self.__next_time = start + self.interval
+    if start > now:
+      sleep(start - now)
+
+class HttpError(IOError):
+  """An HTTP response with an error status."""
+  
+  def __init__(self, url, status, reason):
+    """Construct an HttpError for the given url, status code, and reason phrase."""
+    IOError.__init__(self, 'HTTP %d %s: %s' % (status, reason, url))
+    self.url = url
+    self.status = status
+
+def open_connection(scheme, host, timeout):
+  """Returns a new HTTPConnection to the host, or an HTTPSConnection if the scheme is https."""
+  if scheme == 'https':
+    return HTTPSConnection(host, timeout=timeout)
+  if scheme == 'http':
+    return HTTPConnection(host, timeout=timeout)
+  raise ValueError('Unsupported URL scheme: ' + scheme)
+
+class PersistentHttpClient(object):
+  """A thread-safe HTTP client which reuses one keep-alive connection per host in each thread.
+  
+  Requests to each host are limited to requests_per_second, shared by all threads. Failed
+  requests, including those answered with a 5xx status, are retried with exponential backoff
+  and jitter. Responses with a 4xx status are not retried.
+  """
+  
+  def __init__(self, requests_per_second=10.0, retries=3, timeout=30.0, backoff_base=0.5):
+    """Construct a PersistentHttpClient.
+    
+    requests_per_second -- The most requests per second to each host.
+    retries -- The number of times to retry a failed request.
+    timeout -- The socket timeout, in seconds.
+    backoff_base -- The base delay, in seconds, passed to backoff_delay.
+    """
+    self.requests_per_second = requests_per_second
+    self.retries = retries
+    self.timeout = timeout
+    self.backoff_base = backoff_base
+    self.__lock = Lock()
+    self.__rate_limiters = {}
+    self.__connections = []
+    self.__local = local()
+    
+  def get(self, url):
+    """Returns the body of the response to a GET request of the given url, as a StringIO object."""
+    parsed_url = urlparse(url)
+    path = parsed_url.path
+    if parsed_url.query != '':
+      path += '?' + parsed_url.query
+    attempt = 0
+    while True:
+      self.__get_rate_limiter(parsed_url.netloc).wait()
+      try:
+        connection = self.__get_connection(parsed_url.scheme, parsed_url.netloc)
+        connection.request('GET', path)
+        response = connection.getresponse()
+        body = response.read()
+        if response.status < 400:
+          return StringIO(body)
+        error = HttpError(url, response.status, response.reason)
+        if response.status < 500:
+          raise error
+      except (HTTPException, socket.error), e:
+        self.__close_connection((parsed_url.scheme, parsed_url.netloc))
+        error = e
+      if attempt >= self.retries:
+        raise error
+      sleep(backoff_delay(attempt, self.backoff_base))
+      attempt += 1
+      
+  def close(self):
+    """Close the connections opened by every thread.
+    
+    This must only be called once no other thread is using the client, for instance after a
+    pool of worker threads has finished. A thread using the client afterwards reconnects.
+    """
+    with self.__lock:
+      connections = self.__connections
+      self.__connections = []
+    for connection in connections:
+      connection.close()
+      
+  def __get_rate_limiter(self, host):
+    with self.__lock:
+      if not self.__rate_limiters.has_key(host):
+        self.__rate_limiters[host] = RateLimiter(self.requests_per_second)
+      return self.__rate_limiters[host]
+  
+  def __get_connection(self, scheme, host):
+    if not hasattr(self.__local, 'connections'):
+      self.__local.connections = {}
+    key = (scheme, host)
+    if not self.__local.connections.has_key(key):
+      connection = open_connection(scheme, host, self.timeout)
+      with self.__lock:
+        self.__connections.append(connection)
+      self.__local.connections[key] = connection
+    return self.__local.connections[key]
+  
+  def __close_connection(self, key):
+    connection = getattr(self.__local, 'connections', {}).pop(key, None)
+    if connection is not None:
+      with self.__lock:
+        if connection in self.__connections:
+          self.__connections.remove(connection)
+      connection.close()
@@ -0,0 +1,151 @@
+"""This module contains the NYSE trading calendar of the DJ Scrooge Backtesting API.
+Copyright (C) 2012  James Adam Cataldo
+
+    This file is part of DJ Scrooge.
+
+    DJ Scrooge is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with DJ Scrooge.  If not, see <http://www.gnu.org/licenses/>.
+
+The holiday rules are those of the modern NYSE calendar, and are not exact before 1998,
+when Martin Luther King, Jr. Day became an exchange holiday.
+"""
+from datetime import date, datetime, timedelta
+
+CLOSE_HOUR = 16
+"""The hour, in New York time, of the regular close."""
+
+EARLY_CLOSE_HOUR = 13
+"""The hour, in New York time, of the close on the days before some holidays."""
+
+SPECIAL_CLOSURES = frozenset([
+  date(1985, 9, 27), # Hurricane Gloria
+  date(1994, 4, 27), # President Nixon's funeral
+  date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13), date(2001, 9, 14), # September 11th
+  date(2004, 6, 11), # President Reagan's funeral
+  date(2007, 1, 2), # President Ford's funeral
+  date(2012, 10, 29), date(2012, 10, 30), # Hurricane Sandy
+  date(2018, 12, 5), # President George H. W. Bush's funeral
+  date(2025, 1, 9), # President Carter's funeral
+])
+"""Days the exchange closed outside of its regular holiday schedule."""
+
+__holidays = {}
+
+def easter(year):
+  """Returns the date of Easter Sunday of the given year in the Gregorian calendar."""
+  a = year % 19
+  b = year // 100
+  c = year % 100
+  d = (19 * a + b - b // 4 - (b - (b + 8) // 25 + 1) // 3 + 15) % 30
+  e = (32 + 2 * (b % 4) + 2 * (c // 4) - d - (c % 4)) % 7
+  f = d + e - 7 * ((a + 11 * d + 22 * e) // 451) + 114
+  return date(year, f // 31, f % 31 + 1)
+
+def nth_weekday(year, month, weekday, n):
+  """Returns the nth given weekday (Monday is 0) of the month, counting from the end when n < 0."""
+  if n > 0:
+    first = date(year, month, 1)
+    return first + timedelta((weekday - first.weekday()) % 7 + 7 * (n - 1))
+  if month == 12:
+    last = date(year, 12, 31)
+  else:
+    last = date(year, month + 1, 1) - timedelta(1)
+  return last - timedelta((last.weekday() - weekday) % 7 + 7 * (-n - 1))
+
+def observed(day):
+  """Returns the day a fixed-date holiday is observed: Friday for Saturday, Monday for Sunday."""
+  if day.weekday() == 5:
+    return day - timedelta(1)
+  if day.weekday() == 6:
+    return day + timedelta(1)
+  return day
+
+def get_holidays(year):
+  """Returns the set of weekday holidays and special closures of the exchange in the given year."""
+  if year in __holidays:
+    return __holidays[year]
+  holidays = set([
+    nth_weekday(year, 2, 0, 3), # Washington's Birthday
+    easter(year) - timedelta(2), # Good Friday
+    nth_weekday(year, 5, 0, -1), # Memorial Day
+    observed(date(year, 7, 4)), # Independence Day
+    nth_weekday(year, 9, 0, 1), # Labor Day
+    nth_weekday(year, 11, 3, 4), # Thanksgiving Day
+    observed(date(year, 12, 25)), # Christmas Day
+  ])
+  # New Year's Day is not observed on the last day of the previous year.
+  new_year = date(year, 1, 1)
+  if new_year.weekday() == 6:
+    holidays.add(new_year + timedelta(1))
+  elif new_year.weekday() < 5:
+    holidays.add(new_year)
+  if year >= 1998:
+    holidays.add(nth_weekday(year, 1, 0, 3)) # Martin Luther King, Jr. Day
+  if year >= 2022:
+    holidays.add(observed(date(year, 6, 19))) # Juneteenth
+  holidays.update(day for day in SPECIAL_CLOSURES if day.year == year)
+  __holidays[year] = frozenset(holidays)
+  return __holidays[year]
+
+def is_trading_day(day):
+  """Returns True if the exchange has a session on the given date."""
+  return day.weekday() < 5 and not day in get_holidays(day.year)
+
+def previous_trading_day(day):
+  """Returns the latest trading day strictly before the given date."""
+  day -= timedelta(1)
+  while not is_trading_day(day):
+    day -= timedelta(1)
+  return day
+
+def get_close_hour(day):
+  """Returns the hour, in New York time, the session of the given trading day closes."""
+  if day.month == 7 and day.day == 3 and day.weekday() < 4:
+    return EARLY_CLOSE_HOUR
+  if day.month == 12 and day.day == 24 and day.weekday() < 5:
+    return EARLY_CLOSE_HOUR
+  if day == nth_weekday(day.year, 11, 3, 4) + timedelta(1):
+    return EARLY_CLOSE_HOUR
+  return CLOSE_HOUR
+
+def new_york_time(utc_time):
+  """Converts the given naive UTC datetime to naive New York time.
+
+  Daylight saving time runs from 2 AM on the second Sunday of March to 2 AM on the first
+  Sunday of November, the rule in effect since 2007.
+  """
+  standard = utc_time - timedelta(hours=5)
+  year = standard.year
+  dst_start = datetime.combine(nth_weekday(year, 3, 6, 2), datetime.min.time()) + timedelta(hours=2)
+  dst_end = datetime.combine(nth_weekday(year, 11, 6, 1), datetime.min.time()) + timedelta(hours=1)
+  if dst_start <= standard < dst_end:
+    return standard + timedelta(hours=1)
+  return standard
+
+def last_completed_session(day=None, now=None):
+  """Returns the date of the latest trading session which closed on or before the given date.
+
+  day -- The latest date to consider, or None for any date.
+  now -- The current naive UTC datetime, or None to use the system clock.
+
+  A session which has not closed by now has no end-of-day data, so it is not counted.
+  """
+  local_now = new_york_time(now or datetime.utcnow())
+  today = local_now.date()
+  if day is None or day > today:
+    day = today
+  if day == today and is_trading_day(day) and local_now.hour < get_close_hour(day):
+    day -= timedelta(1)
+  if is_trading_day(day):
+    return day
+  return previous_trading_day(day)